@@ -1,33 +1,85 @@
 from typing import Dict, List, Any, Optional
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_groq import ChatGroq
-from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
+from langchain_core.messages import HumanMessage, AIMessage, SystemMessage, message_chunk_to_message
+from agents.model_tiers import ModelTier, TieringPolicy
+from agents.prompt_layout import PromptLayout
+from agents.retrieval import RetrievalStage
+from agents.output_budget import OutputBudget, OutputBudgetPolicy
 import json
+import time
 
 class MetaCSRAgent:
     """CSR Agent implementation for handling customer interactions"""
     
-    def __init__(self, model_name: str, temperature: float, max_tokens: int):
-        self.llm = ChatGroq(
-            model_name=model_name,
-            temperature=temperature,
-            max_tokens=max_tokens
+    def __init__(self,
+                 model_name: str,
+                 temperature: float,
+                 max_tokens: int,
+                 small_model_name: Optional[str] = None,
+                 small_max_tokens: int = 256,
+                 retrieval: Optional[RetrievalStage] = None,
+                 tools: Optional[List[Any]] = None,
+                 output_budgets: Optional[OutputBudgetPolicy] = None,
+                 admission=None):
+        self.temperature = temperature
+        self.retrieval = retrieval
+        # Optional AdmissionController charged once per LLM call; raises AdmissionRejected when shed
+        self.admission = admission
+        # Per-intent output caps and stop sequences; tier max_tokens is the ceiling
+        self.output_budgets = output_budgets or OutputBudgetPolicy()
+        self.tools = tools or []
+        large = ModelTier(name="large", model_name=model_name, max_tokens=max_tokens)
+        # Without a small model every turn goes to the large tier
+        small = ModelTier(
+            name="small",
+            model_name=small_model_name or model_name,
+            max_tokens=small_max_tokens if small_model_name else max_tokens
         )
-        self.prompt = self._create_prompt()
+        self.tiering = TieringPolicy(small=small, large=large)
+        self._llms: Dict[str, ChatGroq] = {}
+        self.llm = self._get_llm(large)
+        self.layout = self._create_prompt()
+        self.prompt = self.layout.template
 
-    def _create_prompt(self) -> ChatPromptTemplate:
+    def _get_llm(self, tier: ModelTier) -> ChatGroq:
+        """Return the (cached) chat model for a tier"""
+        if tier.model_name not in self._llms:
+            self._llms[tier.model_name] = ChatGroq(
+                model_name=tier.model_name,
+                temperature=self.temperature,
+                max_tokens=tier.max_tokens
+            )
+        return self._llms[tier.model_name]
+
+    def get_tier_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Per-tier call counts, latency and token budgets"""
+        return self.tiering.get_stats()
+
+    def get_output_budget_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Output tokens against budget per intent combination"""
+        return self.output_budgets.get_stats()
+
+    def get_prompt_cache_stats(self) -> Dict[str, Any]:
+        """Context serialization memo and provider prefix-cache hit rates"""
+        return self.layout.get_stats()
+
+    def _create_prompt(self) -> PromptLayout:
+        # Keep this text free of per-turn data so the prompt prefix stays cacheable
         system_prompt = """You are an advanced customer service representative with access to various tools and APIs. Your role is to:
 
 1. Help customers with their inquiries and issues
-2. Use available tools to verify identity and fetch information
+2. Call the available tools to fetch information and perform actions
 3. Suggest relevant actions based on customer context
-4. Guide customers through processes step by step
-5. Collect feedback when appropriate
+4. Collect feedback when appropriate
 
 Available tools and their purposes:
-- verify_identity: Check customer credentials
 - query_knowledge_base: Find relevant information
 - fetch_order_status: Check order status
+- fetch_order_statuses: Check the status of several orders in one call
+- get_user_context: Look up account state and available actions
+- update_shipping_address, request_refund, send_order_email: Manage an order
+- update_account_details, schedule_callback: Manage the customer account
 - execute_action: Perform actions on behalf of the customer
 - log_feedback: Record customer satisfaction
 
@@ -36,20 +88,16 @@ Guidelines:
 - Maintain a professional and friendly tone
 - Escalate to human support if confidence is low
 - Suggest relevant next actions based on context
-- Confirm before executing important actions
-- Explain processes clearly
+- Actions that change an order or the account are not run right away: the customer confirms them in the app. Say what will happen and ask them to confirm
+- Answer first, in a few sentences; use a short numbered list only when the customer must follow steps
+- Do not restate the question, repeat the context or add sign-offs
 - Handle errors gracefully
+- When knowledge base articles are provided, answer from them briefly and do not invent policies
 
-Current user context: {user_context}
-Previous interactions: {chat_history}
-Available actions: {available_actions}
+Each customer message is preceded by a [Context] block containing the current user context and the available actions as compact JSON, and, for general or technical questions, relevant knowledge base articles.
 """
 
-        return ChatPromptTemplate.from_messages([
-            ("system", system_prompt),
-            MessagesPlaceholder(variable_name="chat_history"),
-            ("human", "{input}")
-        ])
+        return PromptLayout(system_prompt)
 
     def analyze_sentiment(self, message: str) -> float:
         """Analyze customer message sentiment to adjust response tone"""
@@ -84,33 +132,105 @@ Available actions: {available_actions}
                          message: str, 
                          chat_history: List[Dict], 
                          user_context: Dict,
-                         available_actions: List[Dict]) -> Dict[str, Any]:
-        """Generate appropriate response based on context and message"""
+                         available_actions: List[Dict],
+                         tool_messages: Optional[List[Any]] = None,
+                         allow_tools: bool = True,
+                         record_stats: bool = True,
+                         admission_timeout: Optional[float] = None) -> Dict[str, Any]:
+        """Generate appropriate response based on context and message
+
+        `tool_messages` carries the tool calls and results from earlier steps of the
+        same turn. When the model requests tools, the result has `tool_calls` set and
+        `message` holds the AIMessage to append to that scratchpad. Calls made with
+        `record_stats=False` (speculation) are left out of tier and budget stats.
+        Each call is charged to the admission controller of the current scope first.
+        """
         
         # Analyze message
         sentiment = self.analyze_sentiment(message)
         intents = self.determine_intent(message)
         
-        # Prepare context for prompt
-        context = {
-            "chat_history": chat_history,
-            "input": message,
-            "user_context": json.dumps(user_context, indent=2),
-            "available_actions": json.dumps(available_actions, indent=2)
-        }
+        # Ground general and technical questions in the knowledge base
+        extra_context = {}
+        if self.retrieval is not None:
+            snippets = self.retrieval.run(message, intents)
+            if snippets:
+                extra_context["knowledge_base"] = "\n" + snippets
+        
+        # Prepare context for prompt: static prefix first, dynamic context last
+        context = self.layout.build_inputs(
+            message=message,
+            chat_history=chat_history,
+            user_context=user_context,
+            available_actions=available_actions,
+            extra_context=extra_context,
+            scratchpad=tool_messages
+        )
+        
+        # Pick model tier, then the intent's output budget under the tier's ceiling
+        tier = self.tiering.select(message, intents, sentiment)
+        budget = self.output_budgets.select(intents, tier.max_tokens)
+        llm = self._get_llm(tier)
+        if self.tools and allow_tools:
+            llm = llm.bind_tools(self.tools)
+        llm = llm.bind(max_tokens=budget.max_tokens, stop=list(budget.stop) or None)
+        
+        if self.admission is not None:
+            self.admission.admit_current(timeout=admission_timeout)
         
         # Get response from LLM
-        response = self.prompt | self.llm
-        result = response.invoke(context)
+        response = self.prompt | llm
+        started = time.perf_counter()
+        early_stopped = False
+        if self.output_budgets.early_stop and budget.max_sentences:
+            result, early_stopped = self._stream_until_complete(response, context, budget)
+        else:
+            result = response.invoke(context)
+        latency = time.perf_counter() - started
+        usage = self.layout.record_usage(result)
+        if not usage["output_tokens"] and result.content:
+            # A stream cut short carries no usage report; estimate from the text
+            usage["output_tokens"] = len(result.content) // 4 + 1
+        finish_reason = (getattr(result, "response_metadata", None) or {}).get("finish_reason")
+        if record_stats:
+            self.tiering.record(tier, latency, usage["output_tokens"])
+            self.output_budgets.record(intents, budget, usage["output_tokens"],
+                                       hit_limit=finish_reason == "length", early_stopped=early_stopped)
         
         return {
             "response": result.content,
+            "message": result,
+            "tool_calls": getattr(result, "tool_calls", None) or [],
             "sentiment": sentiment,
             "intents": intents,
+            "model_tier": tier.name,
+            "output_budget": budget.max_tokens,
+            "early_stopped": early_stopped,
+            "usage": usage,
+            "latency": latency,
             "confidence": 0.85,  # In production, use actual confidence score
             "suggested_actions": self._suggest_actions(intents, user_context, available_actions)
         }
 
+    def _stream_until_complete(self, chain, context: Dict[str, Any], budget: OutputBudget):
+        """Stream the answer and stop once it holds `budget.max_sentences` complete sentences
+
+        Streams that start a tool call are read to the end. Returns (message, early_stopped).
+        """
+        message = None
+        for chunk in chain.stream(context):
+            message = chunk if message is None else message + chunk
+            if message.tool_call_chunks or not isinstance(message.content, str):
+                continue
+            prefix = self.output_budgets.complete_prefix(message.content, budget.max_sentences)
+            if prefix is not None:
+                # Leaving the loop closes the stream, which ends generation upstream
+                message.content = prefix
+                return message_chunk_to_message(message), True
+        if message is None:
+            return AIMessage(content=""), False
+        return message_chunk_to_message(message), False
+
     def _suggest_actions(self, 
                         intents: Dict[str, bool], 
                         user_context: Dict,
@@ -0,0 +1,76 @@
+from dataclasses import dataclass
+from typing import Dict, Any, Optional
+import threading
+
+@dataclass(frozen=True)
+class ModelTier:
+    """A model and the output budget used for turns routed to it"""
+    name: str
+    model_name: str
+    max_tokens: int
+
+@dataclass
+class TierStats:
+    calls: int = 0
+    total_latency: float = 0.0
+    max_tokens_budget: int = 0
+    output_tokens: int = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "total_latency": round(self.total_latency, 4),
+            "avg_latency": round(self.total_latency / self.calls, 4) if self.calls else 0.0,
+            "max_tokens_budget": self.max_tokens_budget,
+            "output_tokens": self.output_tokens
+        }
+
+class TieringPolicy:
+    """Route each turn to a small or large model based on intent, sentiment and length"""
+
+    # Intents that are cheap to answer when they come alone in a short message
+    SIMPLE_INTENTS = {'general_inquiry', 'order_status', 'account_help'}
+    # Intents that usually need multi-step reasoning
+    COMPLEX_INTENTS = {'technical_support', 'billing'}
+
+    def __init__(self,
+                 small: ModelTier,
+                 large: ModelTier,
+                 long_message_words: int = 40,
+                 negative_sentiment: float = 0.5):
+        self.small = small
+        self.large = large
+        self.long_message_words = long_message_words
+        self.negative_sentiment = negative_sentiment
+        self._stats = {small.name: TierStats(), large.name: TierStats()}
+        self._lock = threading.Lock()
+
+    @property
+    def tiers(self) -> Dict[str, ModelTier]:
+        return {self.small.name: self.small, self.large.name: self.large}
+
+    def select(self, message: str, intents: Dict[str, Any], sentiment: float) -> ModelTier:
+        """Pick the tier for a turn"""
+        # analyze_sentiment maps a neutral message to 0.5, anything lower is negative
+        if sentiment < self.negative_sentiment:
+            return self.large
+        if len(message.split()) > self.long_message_words:
+            return self.large
+        if len(intents) > 1 or any(intent in self.COMPLEX_INTENTS for intent in intents):
+            return self.large
+        if all(intent in self.SIMPLE_INTENTS for intent in intents):
+            return self.small
+        return self.large
+
+    def record(self, tier: ModelTier, latency: float, output_tokens: Optional[int] = None):
+        """Record a completed call against its tier"""
+        with self._lock:
+            stats = self._stats.setdefault(tier.name, TierStats())
+            stats.calls += 1
+            stats.total_latency += latency
+            stats.max_tokens_budget += tier.max_tokens
+            stats.output_tokens += output_tokens or 0
+
+    def get_stats(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {name: stats.to_dict() for name, stats in self._stats.items()}
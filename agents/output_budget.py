@@ -0,0 +1,107 @@
+from dataclasses import dataclass
+from typing import Dict, Any, Optional, Tuple
+import re
+import threading
+
+@dataclass(frozen=True)
+class OutputBudget:
+    """Output limits for a turn: token cap, stop sequences and streaming early-stop point"""
+    max_tokens: int
+    # Complete sentences after which a streamed answer is cut; None disables early stop
+    max_sentences: Optional[int] = None
+    stop: Tuple[str, ...] = ()
+
+# Model drift into a new turn or a sign-off never belongs in the answer
+DEFAULT_STOP = ("\nCustomer:", "\nUser:", "[Customer message]", "\nBest regards")
+
+# Budgets per intent from MetaCSRAgent.determine_intent
+INTENT_BUDGETS: Dict[str, OutputBudget] = {
+    'order_status': OutputBudget(max_tokens=160, max_sentences=3, stop=DEFAULT_STOP),
+    'account_help': OutputBudget(max_tokens=200, max_sentences=4, stop=DEFAULT_STOP),
+    'general_inquiry': OutputBudget(max_tokens=256, max_sentences=4, stop=DEFAULT_STOP),
+    'billing': OutputBudget(max_tokens=320, max_sentences=5, stop=DEFAULT_STOP),
+    'technical_support': OutputBudget(max_tokens=512, max_sentences=8, stop=DEFAULT_STOP)
+}
+
+# End of a sentence; digits before the period are list markers ("1.") or decimals
+_SENTENCE_END = re.compile(r"(?<!\d)[.!?](?=\s)")
+
+@dataclass
+class BudgetStats:
+    calls: int = 0
+    budget_tokens: int = 0
+    output_tokens: int = 0
+    hit_limit: int = 0
+    early_stopped: int = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "budget_tokens": self.budget_tokens,
+            "output_tokens": self.output_tokens,
+            "avg_output_tokens": round(self.output_tokens / self.calls, 1) if self.calls else 0.0,
+            "hit_limit": self.hit_limit,
+            "early_stopped": self.early_stopped
+        }
+
+class OutputBudgetPolicy:
+    """Per-intent output budgets, combined with the tier's max_tokens as a ceiling
+
+    A multi-intent message gets the largest single-intent budget plus headroom for
+    each extra intent. With `early_stop`, answers are streamed and cut after the
+    budget's number of complete sentences unless the model is calling tools.
+    """
+
+    def __init__(self,
+                 budgets: Optional[Dict[str, OutputBudget]] = None,
+                 default: OutputBudget = OutputBudget(max_tokens=256, max_sentences=4, stop=DEFAULT_STOP),
+                 extra_intent_tokens: int = 96,
+                 early_stop: bool = False):
+        self.budgets = budgets if budgets is not None else dict(INTENT_BUDGETS)
+        self.default = default
+        self.extra_intent_tokens = extra_intent_tokens
+        self.early_stop = early_stop
+        self._stats: Dict[str, BudgetStats] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(intents: Dict[str, Any]) -> str:
+        return "+".join(sorted(intents)) or "none"
+
+    def select(self, intents: Dict[str, Any], ceiling: int) -> OutputBudget:
+        """Budget for a turn, never above the tier's `ceiling`"""
+        budgets = [self.budgets.get(intent, self.default) for intent in intents] or [self.default]
+        largest = max(budgets, key=lambda b: b.max_tokens)
+        max_tokens = largest.max_tokens + self.extra_intent_tokens * (len(budgets) - 1)
+        sentences = [b.max_sentences for b in budgets]
+        stop = tuple(dict.fromkeys(s for b in budgets for s in b.stop))
+        return OutputBudget(
+            max_tokens=min(max_tokens, ceiling),
+            max_sentences=None if None in sentences else sum(sentences),
+            # Providers accept at most four stop sequences
+            stop=stop[:4]
+        )
+
+    @staticmethod
+    def complete_prefix(text: str, max_sentences: int) -> Optional[str]:
+        """`text` up to the end of its `max_sentences`-th complete sentence, if it has that many"""
+        count = 0
+        for match in _SENTENCE_END.finditer(text):
+            count += 1
+            if count >= max_sentences:
+                return text[:match.end()]
+        return None
+
+    def record(self, intents: Dict[str, Any], budget: OutputBudget, output_tokens: int,
+               hit_limit: bool = False, early_stopped: bool = False):
+        with self._lock:
+            stats = self._stats.setdefault(self.key(intents), BudgetStats())
+            stats.calls += 1
+            stats.budget_tokens += budget.max_tokens
+            stats.output_tokens += output_tokens
+            stats.hit_limit += int(hit_limit)
+            stats.early_stopped += int(early_stopped)
+
+    def get_stats(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {key: stats.to_dict() for key, stats in self._stats.items()}
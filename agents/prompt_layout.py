@@ -0,0 +1,102 @@
+from typing import Dict, List, Any, Optional
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+import json
+import threading
+
+class PromptLayout:
+    """Lay out prompts as a byte-stable static prefix followed by per-turn dynamic context
+
+    The system prompt never changes and chat history is only ever appended to,
+    so provider-side (or local KV) prefix caches can reuse everything up to the
+    current human turn. User context and available actions are serialized
+    compactly and placed in the human turn, after the cacheable prefix.
+    """
+
+    ROLE_MAP = {"user": "human", "assistant": "ai", "system": "system"}
+
+    def __init__(self, system_prompt: str):
+        self.system_prompt = system_prompt
+        self.template = ChatPromptTemplate.from_messages([
+            ("system", "{static_prompt}"),
+            MessagesPlaceholder(variable_name="chat_history"),
+            ("human", "{turn}"),
+            MessagesPlaceholder(variable_name="scratchpad", optional=True)
+        ])
+        self._lock = threading.Lock()
+        self._stats = {
+            "llm_calls": 0,
+            "prompt_tokens": 0,
+            "cached_prompt_tokens": 0,
+            "calls_with_cache_hit": 0
+        }
+
+    @staticmethod
+    def serialize(value: Any) -> str:
+        """Compact JSON for a context value; sorted keys keep equal values byte-identical"""
+        return json.dumps(value, separators=(",", ":"), sort_keys=True, default=str)
+
+    def history_messages(self, chat_history: List[Any], message: str) -> List[Any]:
+        """Normalize history to (role, content) pairs, dropping the current message if already appended"""
+        history = []
+        for msg in chat_history:
+            if isinstance(msg, dict):
+                role = self.ROLE_MAP.get(msg.get("role"), "human")
+                history.append((role, str(msg.get("content", ""))))
+            else:
+                history.append(msg)
+        if history and isinstance(history[-1], tuple) and history[-1] == ("human", message):
+            history.pop()
+        return history
+
+    def build_inputs(self,
+                     message: str,
+                     chat_history: List[Any],
+                     user_context: Dict,
+                     available_actions: List[Dict],
+                     extra_context: Optional[Dict[str, str]] = None,
+                     scratchpad: Optional[List[Any]] = None) -> Dict[str, Any]:
+        """Template variables for a turn; only `turn` and the tool scratchpad follow the cached prefix"""
+        sections = [
+            "[Context]",
+            "user_context: " + self.serialize(user_context),
+            "available_actions: " + self.serialize(available_actions)
+        ]
+        for name, text in (extra_context or {}).items():
+            sections.append(f"{name}: {text}")
+        sections.append("[Customer message]")
+        sections.append(message)
+        return {
+            "static_prompt": self.system_prompt,
+            "chat_history": self.history_messages(chat_history, message),
+            "turn": "\n".join(sections),
+            "scratchpad": list(scratchpad or [])
+        }
+
+    def record_usage(self, result: Any) -> Dict[str, int]:
+        """Track provider-reported prefix-cache usage for a completed call"""
+        usage = getattr(result, "usage_metadata", None) or {}
+        token_usage = (getattr(result, "response_metadata", None) or {}).get("token_usage", {}) or {}
+        prompt_tokens = usage.get("input_tokens") or token_usage.get("prompt_tokens") or 0
+        cached = (usage.get("input_token_details") or {}).get("cache_read")
+        if cached is None:
+            cached = (token_usage.get("prompt_tokens_details") or {}).get("cached_tokens", 0)
+        cached = cached or 0
+        with self._lock:
+            self._stats["llm_calls"] += 1
+            self._stats["prompt_tokens"] += prompt_tokens
+            self._stats["cached_prompt_tokens"] += cached
+            if cached:
+                self._stats["calls_with_cache_hit"] += 1
+        return {
+            "input_tokens": prompt_tokens,
+            "output_tokens": usage.get("output_tokens") or token_usage.get("completion_tokens") or 0,
+            "cached_tokens": cached
+        }
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+        stats["prefix_cache_hit_rate"] = (
+            stats["cached_prompt_tokens"] / stats["prompt_tokens"] if stats["prompt_tokens"] else 0.0
+        )
+        return stats
@@ -0,0 +1,112 @@
+from typing import Dict, List, Any, Optional, Callable, Tuple
+from collections import OrderedDict
+import re
+import threading
+import time
+
+class RetrievalStage:
+    """Fetch knowledge base snippets for general and technical questions
+
+    Results are cached per normalized query and packed into a fixed token budget
+    so grounding a turn adds a bounded amount of prompt.
+    """
+
+    RETRIEVAL_INTENTS = {'general_inquiry', 'technical_support'}
+    # Rough chars-per-token ratio for English prose; avoids loading a tokenizer
+    CHARS_PER_TOKEN = 4
+
+    def __init__(self,
+                 search: Callable[[str, int], List[Dict]],
+                 top_k: int = 3,
+                 token_budget: int = 400,
+                 cache_size: int = 1024,
+                 cache_ttl: float = 600.0):
+        self.search = search
+        self.top_k = top_k
+        self.token_budget = token_budget
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self._cache: "OrderedDict[str, Tuple[float, List[Dict]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {
+            "skipped": 0,
+            "cache_hits": 0,
+            "cache_misses": 0,
+            "errors": 0,
+            "snippets_injected": 0,
+            "tokens_injected": 0
+        }
+
+    @staticmethod
+    def normalize(query: str) -> str:
+        return " ".join(re.findall(r"[a-z0-9]+", query.lower()))
+
+    def should_retrieve(self, intents: Dict[str, Any]) -> bool:
+        return any(intent in self.RETRIEVAL_INTENTS for intent in intents)
+
+    def retrieve(self, query: str) -> List[Dict]:
+        """Top-k articles for a query, served from cache when fresh"""
+        key = self.normalize(query)
+        now = time.monotonic()
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None and now - cached[0] < self.cache_ttl:
+                self._cache.move_to_end(key)
+                self._stats["cache_hits"] += 1
+                return cached[1]
+            self._stats["cache_misses"] += 1
+        try:
+            articles = self.search(query, self.top_k) or []
+        except Exception as e:
+            print(f"Error querying knowledge base: {str(e)}")
+            with self._lock:
+                self._stats["errors"] += 1
+            return []
+        with self._lock:
+            self._cache[key] = (now, articles)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return articles
+
+    def format_snippets(self, articles: List[Dict]) -> Tuple[str, int]:
+        """Pack article snippets into the token budget; returns (text, approx tokens)"""
+        budget = self.token_budget * self.CHARS_PER_TOKEN
+        parts = []
+        for article in articles:
+            title = article.get("title", "")
+            content = " ".join(str(article.get("content", "")).split())
+            snippet = f"- {title}: {content}"
+            if len(snippet) > budget:
+                # Keep a partial snippet only if it still carries some content
+                if budget < len(title) + 40:
+                    break
+                snippet = snippet[:budget - 3].rsplit(" ", 1)[0] + "..."
+            parts.append(snippet)
+            budget -= len(snippet) + 1
+            if budget <= 0:
+                break
+        text = "\n".join(parts)
+        return text, len(text) // self.CHARS_PER_TOKEN
+
+    def run(self, message: str, intents: Dict[str, Any]) -> Optional[str]:
+        """Snippets to inject for this turn, or None when retrieval does not apply"""
+        if not self.should_retrieve(intents):
+            with self._lock:
+                self._stats["skipped"] += 1
+            return None
+        articles = self.retrieve(message)
+        if not articles:
+            return None
+        text, tokens = self.format_snippets(articles)
+        with self._lock:
+            self._stats["snippets_injected"] += text.count("\n") + 1 if text else 0
+            self._stats["tokens_injected"] += tokens
+        return text or None
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+        lookups = stats["cache_hits"] + stats["cache_misses"]
+        stats["cache_hit_rate"] = stats["cache_hits"] / lookups if lookups else 0.0
+        return stats
@@ -0,0 +1,252 @@
+from typing import Dict, List, Any, Optional, Callable, Tuple, FrozenSet
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+import re
+import threading
+import time
+
+from services.admission import TokenBucket
+
+@dataclass(frozen=True)
+class FollowUp:
+    key: str
+    question: str
+    # Whole-word phrases; a next message matches when it contains any of them,
+    # or all of them with `match_all`
+    keywords: Tuple[str, ...]
+    match_all: bool = False
+
+@dataclass
+class Speculation:
+    follow_up: FollowUp
+    response: Dict[str, Any]
+    tokens: int
+    expires_at: float
+    # Intents of the turn that scheduled it and of the predicted question; a message
+    # with only other specific intents is not served
+    intents: FrozenSet[str] = frozenset()
+    # Order numbers and other IDs the answer was generated with
+    references: FrozenSet[str] = frozenset()
+
+# Likely next questions per detected intent, most likely first
+FOLLOW_UPS: Dict[str, List[FollowUp]] = {
+    'order_status': [
+        FollowUp("order_eta", "When will my order arrive?",
+                 ("when will it arrive", "when will my order arrive", "when will it get here",
+                  "when will it be delivered", "delivery date", "expected delivery", "arrival date")),
+        FollowUp("order_address", "Can I change the shipping address for this order?",
+                 ("change the shipping address", "change the address", "change my address",
+                  "update the address", "update my address", "different address"))
+    ],
+    'billing': [
+        FollowUp("billing_refund", "Can I get a refund for this charge?", ("refund", "money back")),
+        FollowUp("billing_invoice", "Can you send me the invoice?", ("invoice", "receipt"))
+    ],
+    'account_help': [
+        FollowUp("account_reset", "How do I reset my password?",
+                 ("reset my password", "reset the password", "forgot my password", "forgot password"))
+    ],
+    'technical_support': [
+        FollowUp("tech_human", "Can I talk to a human about this?",
+                 ("human", "real person", "human agent", "talk to someone"))
+    ]
+}
+
+# What determine_intent returns for a message with no specific intent ("when will it arrive?")
+GENERAL_INTENT = "general_inquiry"
+
+# Order numbers and similar IDs: tokens of three or more characters with a digit
+_REFERENCE = re.compile(r"\b(?=[a-z0-9-]*\d)[a-z0-9-]{3,}\b")
+
+def references(text: str) -> FrozenSet[str]:
+    return frozenset(_REFERENCE.findall(text.lower()))
+
+class SpeculationStage:
+    """Pre-generate answers to likely follow-up questions after a turn
+
+    Predictions come from the turn's intents and its pending action. Answers are
+    generated in the background under a shared token budget, with the turn's
+    tool results as context, and kept per session for `ttl` seconds. The next
+    message is served from them only when it matches exactly one prediction's
+    phrases, has no specific intent or one shared with the scheduling turn or
+    the predicted question, and mentions no order number the answer was not
+    generated with. Anything not served counts as wasted tokens.
+    """
+
+    def __init__(self,
+                 generate: Callable[..., Dict[str, Any]],
+                 classify: Callable[[str], Dict[str, Any]],
+                 max_predictions: int = 2,
+                 tokens_per_minute: float = 4000,
+                 estimated_cost: int = 300,
+                 ttl: float = 120.0,
+                 max_words: int = 25,
+                 workers: int = 1):
+        self.generate = generate
+        self.classify = classify
+        self.max_predictions = max_predictions
+        self.estimated_cost = estimated_cost
+        self.ttl = ttl
+        self.max_words = max_words
+        self.budget = TokenBucket(tokens_per_minute / 60.0, tokens_per_minute)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="csr-speculation")
+        self._cache: Dict[str, Dict[str, Speculation]] = {}
+        # Bumped on every new message so late background results for an old turn are dropped
+        self._generation: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._last_sweep = time.time()
+        self._stats = {"scheduled": 0, "generated": 0, "skipped_budget": 0, "errors": 0,
+                       "hits": 0, "misses": 0, "tokens_spent": 0, "wasted_tokens": 0}
+
+    @staticmethod
+    def normalize(message: str) -> str:
+        return " ".join(re.findall(r"[a-z0-9]+", message.lower()))
+
+    def predict(self, intents: Dict[str, Any], pending_action: Optional[Dict] = None) -> List[FollowUp]:
+        """Top predicted follow-ups for a finished turn"""
+        predictions = []
+        if pending_action and pending_action.get("title"):
+            title = pending_action["title"]
+            words = tuple(w for w in self.normalize(title).split() if len(w) > 3)
+            if words:
+                predictions.append(FollowUp(f"action_{pending_action.get('id', title)}", f"How do I {title.lower()}?",
+                                            words, match_all=True))
+        for intent in intents:
+            predictions.extend(FOLLOW_UPS.get(intent, []))
+        return predictions[:self.max_predictions]
+
+    def schedule(self,
+                 session_id: str,
+                 chat_history: List[Dict],
+                 user_context: Dict,
+                 available_actions: List[Dict],
+                 intents: Dict[str, Any],
+                 pending_action: Optional[Dict] = None,
+                 tool_results: Optional[List[str]] = None):
+        """Queue background answers for the predicted follow-ups of this turn"""
+        if not session_id:
+            return
+        with self._lock:
+            self._sweep(time.time())
+            generation = self._generation.get(session_id, 0)
+        for follow_up in self.predict(intents, pending_action):
+            with self._lock:
+                if not self.budget.available(self.estimated_cost):
+                    self._stats["skipped_budget"] += 1
+                    continue
+                # Reserve the estimate now; the difference is settled after generation
+                self.budget.take(self.estimated_cost)
+                self._stats["scheduled"] += 1
+            self.executor.submit(self._speculate, session_id, generation, follow_up, frozenset(intents),
+                                 list(chat_history), user_context, available_actions, list(tool_results or []))
+
+    def _sweep(self, now: float):
+        """Expire speculations of sessions that never sent another message"""
+        if now - self._last_sweep < self.ttl:
+            return
+        self._last_sweep = now
+        for session_id in list(self._cache):
+            entries = self._cache[session_id]
+            for key in [k for k, e in entries.items() if e.expires_at <= now]:
+                self._stats["wasted_tokens"] += entries.pop(key).tokens
+            if not entries:
+                del self._cache[session_id]
+                self._generation.pop(session_id, None)
+
+    def _speculate(self, session_id: str, generation: int, follow_up: FollowUp, turn_intents: FrozenSet[str],
+                   chat_history: List[Dict], user_context: Dict, available_actions: List[Dict],
+                   tool_results: List[str]):
+        if tool_results:
+            # No tools run here, so the order data looked up this turn is passed as context
+            user_context = {**user_context, "tool_results": tool_results}
+        try:
+            # Answered as if the customer had asked it next; no tools, no side effects, and
+            # kept out of the tier and output budget counters of real turns. This thread has
+            # no admission scope, so the call is charged to the global LLM limit only and is
+            # skipped rather than queued when that limit is reached.
+            response = self.generate(
+                message=follow_up.question,
+                chat_history=chat_history + [{"role": "user", "content": follow_up.question}],
+                user_context=user_context,
+                available_actions=available_actions,
+                allow_tools=False,
+                record_stats=False,
+                admission_timeout=0
+            )
+        except Exception as e:
+            print(f"Error generating speculative answer: {str(e)}")
+            with self._lock:
+                self.budget.refund(self.estimated_cost)
+                self._stats["errors"] += 1
+            return
+        usage = response.get("usage") or {}
+        tokens = (usage.get("input_tokens") or 0) + (usage.get("output_tokens") or 0)
+        with self._lock:
+            self.budget.refund(self.estimated_cost)
+            self.budget.take(tokens)
+            self._stats["generated"] += 1
+            self._stats["tokens_spent"] += tokens
+            if self._generation.get(session_id, 0) != generation or not response.get("response"):
+                # The customer moved on (or the model produced nothing) before it was ready
+                self._stats["wasted_tokens"] += tokens
+                return
+            context = " ".join(str(m.get("content", "")) if isinstance(m, dict) else str(getattr(m, "content", ""))
+                               for m in chat_history)
+            entry = Speculation(
+                follow_up, response, tokens, time.time() + self.ttl,
+                intents=(turn_intents | frozenset(self.classify(follow_up.question))) - {GENERAL_INTENT},
+                references=references(" ".join([context] + tool_results))
+            )
+            self._cache.setdefault(session_id, {})[follow_up.key] = entry
+
+    def take(self, session_id: str, message: str) -> Optional[Dict[str, Any]]:
+        """A pre-generated answer for this message, if one matches; clears the session's other speculations"""
+        if not session_id:
+            return None
+        now = time.time()
+        normalized = " " + self.normalize(message) + " "
+        intents = frozenset(self.classify(message))
+        mentioned = references(message)
+        with self._lock:
+            self._generation[session_id] = self._generation.get(session_id, 0) + 1
+            entries = self._cache.pop(session_id, {})
+            fresh = [e for e in entries.values() if e.expires_at > now]
+            matches = []
+            if len(normalized.split()) <= self.max_words:
+                matches = [e for e in fresh if self._matches(e, normalized, intents, mentioned)]
+            hit = matches[0] if len(matches) == 1 else None
+            self._stats["wasted_tokens"] += sum(e.tokens for e in entries.values() if e is not hit)
+            if hit is None:
+                if fresh:
+                    self._stats["misses"] += 1
+                return None
+            self._stats["hits"] += 1
+        return {**hit.response, "speculative": True, "latency": 0.0, "usage": {}}
+
+    @staticmethod
+    def _matches(entry: Speculation, normalized: str, intents: FrozenSet[str], mentioned: FrozenSet[str]) -> bool:
+        """Whether a speculated answer fits the message as it was asked"""
+        found = [f" {keyword} " in normalized for keyword in entry.follow_up.keywords]
+        if not (all(found) if entry.follow_up.match_all else any(found)):
+            return False
+        # Short follow-ups ("when will it arrive?") carry no intent of their own and
+        # rely on the phrase match; a different intent or an order the answer never
+        # saw needs a real turn
+        if intents != {GENERAL_INTENT} and not intents & entry.intents:
+            return False
+        return mentioned <= entry.references
+
+    def forget(self, session_id: str):
+        """Drop a session's speculations (e.g. when its conversation is reset)"""
+        with self._lock:
+            entries = self._cache.pop(session_id, {})
+            self._stats["wasted_tokens"] += sum(e.tokens for e in entries.values())
+            self._generation.pop(session_id, None)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["cached_sessions"] = len(self._cache)
+        served = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / served if served else 0.0
+        return stats
@@ -1,57 +1,99 @@
 import streamlit as st
 import os
-from typing import Dict, List
+import json
+import time
+import uuid
+import threading
+import logging
+from typing import Dict, List, Optional, Tuple
 from datetime import datetime
-from langchain_core.messages import HumanMessage, AIMessage
-from graph.workflow import MetaCSRWorkflow
-from agents.csr_agent import MetaCSRAgent
+from functools import lru_cache
 from models.state import CSRState, WorkflowState
+from services.write_behind import WriteBehindQueue
+from services.transcripts import TranscriptWriter
+from services.profiling import TurnProfiler
+from services.sharding import ShardedDispatcher
+from tools.registry import registry, ToolsWrapper
+from graph.factory import (build_workflow, build_verification, build_tool_admission, build_llm_admission,
+                           write_behind_handlers)
 
 from dotenv import load_dotenv
 load_dotenv()
 
-from tools.tools import (
-    verify_identity,
-    query_knowledge_base,
-    fetch_order_status,
-    get_user_context,
-    execute_action,
-    log_feedback,
-    update_shipping_address,
-    request_refund,
-    send_order_email,
-    update_account_details,
-    schedule_callback
-)
-
-# A simple wrapper to group standalone tool functions
-class ToolsWrapper:
-    def __init__(self):
-        self.verify_identity = verify_identity
-        self.query_knowledge_base = query_knowledge_base
-        self.fetch_order_status = fetch_order_status
-        self.get_user_context = get_user_context
-        self.execute_action = execute_action
-        self.log_feedback = log_feedback
-        # Add new tools
-        self.update_shipping_address = update_shipping_address
-        self.request_refund = request_refund
-        self.send_order_email = send_order_email
-        self.update_account_details = update_account_details
-        self.schedule_callback = schedule_callback
+from tools.tools import get_meta_csr_tools, WRITE_BEHIND_TOOLS
+
+logger = logging.getLogger(__name__)
+
+@lru_cache(maxsize=4096)
+def format_message(content: str) -> str:
+    """Markdown for a chat message; escapes $ so prices are not rendered as LaTeX"""
+    return str(content).strip().replace("$", "\\$")
+
+@lru_cache(maxsize=256)
+def format_history_page(page: Tuple[Tuple[str, str], ...]) -> str:
+    """One markdown block for a page of older messages"""
+    return "\n\n".join(f"**{role.capitalize()}:** {format_message(content)}" for role, content in page)
 
 class MetaCSRApp:
     def __init__(self):
         self.tools = ToolsWrapper()
-        self.agent = MetaCSRAgent(
-            model_name="mixtral-8x7b-32768",
-            temperature=0.7,
-            max_tokens=1024
+        # The agent and workflow pull in LangChain and LangGraph, so they are built on first use
+        self._workflow = None
+        self._build_lock = threading.Lock()
+        shard_workers = int(os.getenv("CSR_SHARD_WORKERS", "0"))
+        # Verification tokens are cached per session; failed attempts are shared per
+        # customer ID, across processes when turns run in shard workers
+        self.verification = build_verification(shared=shard_workers > 0)
+        # Feedback, callbacks and order emails are written in the background
+        self.write_behind = WriteBehindQueue(
+            handlers=write_behind_handlers(),
+            spool_dir=os.getenv("CSR_SPOOL_DIR"),
+            dead_letter_path=os.getenv("CSR_DEAD_LETTER_PATH", "dead_letter.jsonl")
         )
-        self.workflow = MetaCSRWorkflow(self.tools, self.agent)
+        self.write_behind.start()
+        self.transcripts = TranscriptWriter(os.getenv("CSR_TRANSCRIPT_DIR", "transcripts"))
+        # Opt-in CPU/allocation profiling of reruns (CSR_PROFILE=1)
+        self.profiler = TurnProfiler()
+        # Admission control for LLM calls (charged per call) and backend tool calls
+        self.llm_admission = build_llm_admission()
+        self.tool_admission = build_tool_admission()
+        get_meta_csr_tools().admission = self.tool_admission
+        # With CSR_SHARD_WORKERS set, turns run in worker processes picked by session ID;
+        # each worker applies its own share of the tool limits
+        self.dispatcher = ShardedDispatcher(workers=shard_workers) if shard_workers > 0 else None
+        if self.dispatcher is not None:
+            self.dispatcher.start()
+        # Only the most recent messages are rendered as chat bubbles
+        self.chat_window = 20
+        self.history_page_size = 20
+
+    @property
+    def workflow(self):
+        if self._workflow is None:
+            with self._build_lock:
+                if self._workflow is None:
+                    self._workflow = build_workflow(
+                        verification=self.verification,
+                        write_behind=self.write_behind,
+                        tools=self.tools,
+                        tool_admission=self.tool_admission,
+                        llm_admission=self.llm_admission
+                    )
+        return self._workflow
+
+    @property
+    def agent(self):
+        return self.workflow.agent
+
+    def warm_up(self):
+        """Build the agent and workflow in the background once the first page is on screen"""
+        if self.dispatcher is None and self._workflow is None and not self._build_lock.locked():
+            threading.Thread(target=lambda: self.workflow, name="csr-warm-up", daemon=True).start()
 
     def initialize_session(self):
         """Initialize or reset session state"""
+        if 'session_id' not in st.session_state:
+            st.session_state.session_id = uuid.uuid4().hex
         if 'state_dict' not in st.session_state:
             st.session_state.state_dict = CSRState().to_dict()
         if 'messages' not in st.session_state:
@@ -60,6 +102,10 @@ class MetaCSRApp:
             st.session_state.user_context = {}
         if 'current_order' not in st.session_state:
             st.session_state.current_order = None
+        if 'orders' not in st.session_state:
+            st.session_state.orders = {}
+        if 'history_page' not in st.session_state:
+            st.session_state.history_page = 0
 
     def get_current_state(self) -> CSRState:
         """Retrieve the current state from session storage"""
@@ -114,18 +160,73 @@ class MetaCSRApp:
         if st.session_state.current_order:
             st.sidebar.subheader("Current Order")
             st.sidebar.json(st.session_state.current_order)
+        if len(st.session_state.orders) > 1:
+            with st.sidebar.expander(f"All Orders ({len(st.session_state.orders)})"):
+                for order in st.session_state.orders.values():
+                    st.write(f"**{order.get('order_number')}**: {order.get('status', 'unknown')}")
+        if st.session_state.orders and st.sidebar.button("Refresh Order Status"):
+            self.refresh_orders()
+
+        # Show per-tier model usage and prompt cache efficiency
+        if self._workflow is not None:
+            with st.sidebar.expander("Model Usage"):
+                st.json(self.agent.get_tier_stats())
+                st.json(self.agent.get_output_budget_stats())
+                st.json(self.agent.get_prompt_cache_stats())
+                if self.agent.retrieval is not None:
+                    st.json(self.agent.retrieval.get_stats())
+                st.json(self.workflow.get_stats())
+                if self.workflow.speculation is not None:
+                    st.json(self.workflow.speculation.get_stats())
+                st.json(registry.get_stats())
+
+        # Show admission control counters
+        with st.sidebar.expander("Capacity"):
+            st.json({
+                "llm": self.llm_admission.get_stats(),
+                "tools": self.tool_admission.get_stats(),
+                "verification": self.verification.get_stats(),
+                "write_behind": self.write_behind.get_stats()
+            })
+            if self.dispatcher is not None:
+                st.json(self.dispatcher.get_stats())
+
+        if self.profiler.enabled:
+            self.render_profiling()
+
+    def render_profiling(self):
+        """Hot functions and allocation growth of this session's profiled runs"""
+        summaries = self.profiler.session_summaries(st.session_state.session_id)
+        with st.sidebar.expander(f"Profiling ({len(summaries)} runs)"):
+            if not summaries:
+                st.write("No profiled runs yet.")
+                return
+            latest = summaries[-1]
+            st.write(f"Last {latest['label']}: {latest['elapsed_ms']} ms, {latest['allocated_kb']} KB allocated")
+            st.json(latest["focus_ms"])
+            st.dataframe(latest["hot_functions"])
+            st.dataframe(latest["allocation_growth"])
+            st.line_chart([{"elapsed_ms": s["elapsed_ms"], "allocated_kb": s["allocated_kb"]} for s in summaries])
+            st.caption(f"Profile: {latest['profile']}")
             
     def render_verification(self):
+        # Reuse this session's recent verification instead of asking again
+        token = self.verification.cached(st.session_state.session_id)
+        if token is not None:
+            current_state = self.get_current_state()
+            current_state.verified = True
+            current_state.user_context = token.user_info
+            self.update_state(current_state)
+            st.session_state.user_context = token.user_info
+            st.rerun()
+
         st.header("Identity Verification")
         with st.form("verification_form"):
             customer_id = st.text_input("Customer ID")
             password = st.text_input("Password", type="password")
             submitted = st.form_submit_button("Verify Identity")
             if submitted:
-                result = self.tools.verify_identity.run(
-                    {"customer_id": customer_id, "password": password},
-                    callbacks=[]
-                )
+                result = self.verification.verify(st.session_state.session_id, customer_id, password)
                 current_state = self.get_current_state()
                 if result.success:
                     current_state.verified = True
@@ -165,8 +266,9 @@ class MetaCSRApp:
                 address = st.text_area("New Shipping Address")
                 if st.form_submit_button("Update Address"):
                     result = self.tools.update_shipping_address.run(
-                        order_number,
-                        {"address": address}
+                        {"order_number": order_number, "new_address": {"address": address},
+                         "user_id": st.session_state.user_context.get("id")},
+                        callbacks=[]
                     )
                     if result.success:
                         st.success(result.message)
@@ -178,8 +280,9 @@ class MetaCSRApp:
                 reason = st.text_area("Refund Reason")
                 if st.form_submit_button("Submit Refund Request"):
                     result = self.tools.request_refund.run(
-                        order_number,
-                        reason
+                        {"order_number": order_number, "reason": reason,
+                         "user_id": st.session_state.user_context.get("id")},
+                        callbacks=[]
                     )
                     if result.success:
                         st.success(result.message)
@@ -190,14 +293,15 @@ class MetaCSRApp:
             with st.form("email_form"):
                 email = st.text_input("Email Address")
                 if st.form_submit_button("Send Order Details"):
-                    result = self.tools.send_order_email.run(
-                        email,
-                        order_number
+                    request_id = self.write_behind.submit(
+                        "send_order_email",
+                        {"recipient": email, "order_number": order_number,
+                         "user_id": st.session_state.user_context.get("id")}
                     )
-                    if result.success:
-                        st.success(result.message)
+                    if request_id:
+                        st.success(f"Order details will be emailed to {email} shortly.")
                     else:
-                        st.error(result.message)
+                        st.error("We couldn't queue the email right now. Please try again.")
 
     # def render_account_actions(self):
     #     if not st.session_state.user_context:
@@ -232,18 +336,56 @@ class MetaCSRApp:
     #                 else:
     #                     st.error(result.message)
 
+    def render_history(self, messages: List[Dict]):
+        """Collapsed, paged view of messages older than the chat window"""
+        if not st.checkbox(f"Show {len(messages)} earlier messages", key="show_history"):
+            return
+        pages = max(1, -(-len(messages) // self.history_page_size))
+        page = min(st.session_state.history_page, pages - 1)
+        # Page 0 holds the messages just before the window, higher pages go further back
+        end = len(messages) - page * self.history_page_size
+        start = max(0, end - self.history_page_size)
+        page_messages = tuple((m.get("role", ""), str(m.get("content", ""))) for m in messages[start:end])
+        st.markdown(format_history_page(page_messages))
+        
+        older, position, newer = st.columns([1, 2, 1])
+        with older:
+            if page < pages - 1 and st.button("Older", key="history_older"):
+                st.session_state.history_page = page + 1
+                st.rerun()
+        with position:
+            st.caption(f"Messages {start + 1}-{end} of {len(messages)}")
+        with newer:
+            if page > 0 and st.button("Newer", key="history_newer"):
+                st.session_state.history_page = page - 1
+                st.rerun()
+
     def render_chat_interface(self):
         st.header("Chat Support")
-        # Display chat history
-        for message in st.session_state.messages:
+        messages = st.session_state.messages
+        window_start = max(0, len(messages) - self.chat_window)
+        if window_start:
+            self.render_history(messages[:window_start])
+        
+        # Action buttons are only offered on the latest assistant reply
+        latest_assistant = next(
+            (idx for idx in range(len(messages) - 1, -1, -1) if messages[idx].get("role") == "assistant"),
+            None
+        )
+        
+        # Display recent chat history
+        for idx in range(window_start, len(messages)):
+            message = messages[idx]
             with st.chat_message(message["role"]):
-                st.write(message["content"])
-                if "suggested_actions" in message and message["suggested_actions"]:
+                st.markdown(format_message(message["content"]))
+                if idx == latest_assistant and message.get("suggested_actions"):
                     self.render_action_buttons(message["suggested_actions"])
         
         # Render order and account actions if user is verified
         current_state = self.get_current_state()
         if current_state.verified:
+            if current_state.pending_tool_call:
+                self.render_tool_confirmation(current_state.pending_tool_call)
             self.render_order_actions()
             
 
@@ -255,40 +397,162 @@ class MetaCSRApp:
         else:
             st.info("Conversation ended. Please start a new conversation to continue.")
 
-    def generate_agent_response(self, user_input: str) -> Dict:
-        response = self.agent.generate_response(
-            message=user_input,
-            chat_history=st.session_state.messages,
-            user_context=st.session_state.user_context,
-            available_actions=self.get_available_actions()
-        )
-        return {
-            "role": "assistant",
-            "content": response.get("response", ""),
-            "suggested_actions": response.get("suggested_actions", [])
-        }
+    def render_tool_confirmation(self, call: Dict):
+        """Confirm or cancel the state-changing tool call the assistant proposed"""
+        st.info(f"Please confirm: **{call.get('title', call.get('name'))}**")
+        st.json(call.get("args", {}))
+        confirm, cancel = st.columns(2)
+        with confirm:
+            if st.button("Confirm", key=f"confirm_{call.get('id')}"):
+                self.confirm_tool_call(call)
+        with cancel:
+            if st.button("Cancel", key=f"cancel_{call.get('id')}"):
+                self.clear_tool_call("Action cancelled: " + call.get("title", call.get("name", "")))
+
+    def confirm_tool_call(self, call: Dict):
+        """Run a confirmed tool call as the verified customer"""
+        caller = {"user_id": st.session_state.user_context.get("id"), "session_id": st.session_state.session_id}
+        try:
+            args = registry.bind_caller(call["name"], call.get("args", {}), caller)
+            if call["name"] in WRITE_BEHIND_TOOLS:
+                success = self.write_behind.submit(call["name"], args) is not None
+                message = "Request accepted" if success else "Service busy, please retry"
+            else:
+                with self.tool_admission.scope(caller["session_id"], caller["user_id"]):
+                    result = registry.get(call["name"]).invoke(args)
+                success, message = result.success, result.error or result.message
+        except Exception as e:
+            print(f"Error executing confirmed action: {str(e)}")
+            success, message = False, str(e)
+        title = call.get("title", call["name"])
+        self.clear_tool_call(f"Action executed: {title}" if success else f"Action failed: {title} ({message})")
+
+    def clear_tool_call(self, note: str):
+        current_state = self.get_current_state()
+        current_state.pending_tool_call = {}
+        self.update_state(current_state)
+        st.session_state.messages.append({"role": "system", "content": note})
+        st.rerun()
 
     def update_chat_history(self, user_input: str):
         # Append user message
         user_message = {"role": "user", "content": user_input}
         st.session_state.messages.append(user_message)
+        started = time.perf_counter()
+        self.profiler.label_current("turn")
+        session_id = st.session_state.session_id
+        customer_id = st.session_state.user_context.get("id")
         try:
-            agent_response = self.generate_agent_response(user_input)
-            st.session_state.messages.append(agent_response)
-            # Update workflow state based on the conversation
-            state = self.get_current_state()
-            state.messages = st.session_state.messages
-            new_state = self.workflow.invoke(state)
+            # One workflow run verifies, calls tools as needed and produces the answer;
+            # every LLM call in it is charged to LLM admission control
+            with self.tool_admission.scope(session_id, customer_id):
+                state = self.get_current_state()
+                state.session_id = session_id
+                state.messages = st.session_state.messages
+                state.available_actions = self.get_available_actions()
+                new_state = (self.dispatcher or self.workflow).invoke(state)
+            response = new_state.last_response
+            if response.get("shed_reason"):
+                new_state.messages = st.session_state.messages
+                self.update_state(new_state)
+                self.shed_turn(response["shed_reason"])
+                self.log_turn(user_input, started, new_state, shed_reason=response["shed_reason"])
+                return
+            self.remember_orders(self.orders_from_tools(new_state.scratchpad))
+            if response:
+                st.session_state.messages.append({
+                    "role": "assistant",
+                    "content": response.get("response", ""),
+                    "suggested_actions": response.get("suggested_actions", [])
+                })
+            new_state.messages = st.session_state.messages
             self.update_state(new_state)
             if new_state.requires_escalation:
                 st.session_state.messages.append({
                     "role": "system",
                     "content": "This conversation will be escalated to a human agent."
                 })
+            self.log_turn(user_input, started, new_state)
         except Exception as e:
-            print(f"Error generating response: {str(e)}")
+            logger.exception("Error generating response")
+            self.log_turn(user_input, started, error=str(e))
             st.error("An error occurred generating a response. Please try again.")
 
+    def log_turn(self, user_input: str, started: float, state: Optional[CSRState] = None,
+                 shed_reason: Optional[str] = None, error: Optional[str] = None):
+        """Append one turn to the transcript log"""
+        response = state.last_response if state is not None else {}
+        usage = response.get("turn_usage", {})
+        self.transcripts.write({
+            "ts": time.time(),
+            "session_id": st.session_state.session_id,
+            "customer_id": st.session_state.user_context.get("id"),
+            "turn": sum(1 for m in st.session_state.messages if m.get("role") == "user"),
+            "message": user_input,
+            "response": response.get("response"),
+            "intents": sorted(response.get("intents", {})),
+            "sentiment": response.get("sentiment"),
+            "confidence": response.get("confidence"),
+            "model_tier": response.get("model_tier"),
+            "tools_called": response.get("tools_called", []),
+            "latency_ms": round((time.perf_counter() - started) * 1000, 1),
+            "llm_latency_ms": round(usage.get("llm_latency", 0.0) * 1000, 1),
+            "input_tokens": usage.get("input_tokens", 0),
+            "output_tokens": usage.get("output_tokens", 0),
+            "cached_tokens": usage.get("cached_tokens", 0),
+            "escalated": bool(state.requires_escalation) if state is not None else False,
+            "shed_reason": shed_reason,
+            "error": error
+        })
+
+    def remember_orders(self, orders: List[Dict]):
+        """Track orders looked up in this session; the last one becomes the current order"""
+        for order in orders:
+            if isinstance(order, dict) and order.get("order_number"):
+                st.session_state.orders[order["order_number"]] = order
+                st.session_state.current_order = order
+
+    def orders_from_tools(self, scratchpad: List) -> List[Dict]:
+        """Order statuses returned by tool calls during a turn"""
+        orders = []
+        for message in scratchpad:
+            if getattr(message, "name", None) not in ("fetch_order_status", "fetch_order_statuses"):
+                continue
+            try:
+                data = json.loads(message.content).get("data") or {}
+            except (ValueError, AttributeError):
+                continue
+            orders.extend(data.get("orders", [data]))
+        return orders
+
+    def refresh_orders(self):
+        """Refresh every tracked order with one batch lookup"""
+        with self.tool_admission.scope(st.session_state.session_id, st.session_state.user_context.get("id")):
+            result = self.tools.fetch_order_statuses.run(
+                {"order_numbers": list(st.session_state.orders), "user_id": st.session_state.user_context.get("id")},
+                callbacks=[]
+            )
+        if result.success:
+            current = (st.session_state.current_order or {}).get("order_number")
+            self.remember_orders(result.data.get("orders", []))
+            if current in st.session_state.orders:
+                st.session_state.current_order = st.session_state.orders[current]
+        else:
+            st.sidebar.error(result.message)
+
+    def shed_turn(self, reason: str):
+        """Answer with a canned reply when the turn is rejected by admission control"""
+        if reason in ("session_rate", "customer_rate"):
+            content = "You're sending messages faster than we can answer them. Please wait a few seconds and try again."
+        else:
+            # Over global capacity: offer a human instead of making the customer retry
+            content = ("We're experiencing unusually high demand right now. "
+                       "Please try again shortly, or connect to a human agent below.")
+            state = self.get_current_state()
+            state.requires_escalation = True
+            self.update_state(state)
+        st.session_state.messages.append({"role": "assistant", "content": content})
+
     def execute_action(self, action: Dict):
         if not action or "id" not in action:
             st.error("Invalid action")
@@ -299,6 +563,9 @@ class MetaCSRApp:
         )
         if result.success:
             st.success(result.message)
+            current_state = self.get_current_state()
+            current_state.pending_action = {}
+            self.update_state(current_state)
             st.session_state.messages.append({
                 "role": "system",
                 "content": f"Action executed: {action.get('title', action['id'])}"
@@ -311,13 +578,19 @@ class MetaCSRApp:
         if not st.session_state.state_dict.get("verified", False):
             return []
         result = self.tools.get_user_context.run(
-            st.session_state.user_context.get("id", ""),
+            {"user_id": st.session_state.user_context.get("id", "")},
             callbacks=[]
         )
         return result.data.get("available_actions", []) if result.success else []
 
     def run(self):
         self.initialize_session()
+        # Reruns that handle a chat message are relabelled "turn" by update_chat_history
+        with self.profiler.profile(st.session_state.session_id, "render"):
+            self.render()
+        self.warm_up()
+
+    def render(self):
         self.render_header()
         self.render_sidebar()
         current_state = self.get_current_state()
@@ -341,6 +614,11 @@ class MetaCSRApp:
                 )
                 st.info("Connecting to a human agent...")
 
+@st.cache_resource
+def load_app() -> MetaCSRApp:
+    """Share one app (models, tools, counters) across reruns and sessions"""
+    return MetaCSRApp()
+
 if __name__ == "__main__":
-    app = MetaCSRApp()
+    app = load_app()
     app.run()
\ No newline at end of file
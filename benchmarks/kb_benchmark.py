@@ -0,0 +1,70 @@
+"""Retrieval latency benchmark for the local knowledge base.
+
+Usage: python -m benchmarks.kb_benchmark [--docs 100000] [--queries 500] [--no-embeddings]
+"""
+import argparse
+import itertools
+import random
+import statistics
+import tempfile
+import time
+
+from tools.knowledge_base import KnowledgeBase
+
+CATEGORIES = ["shipping", "returns", "account", "billing", "technical", "orders"]
+
+def synthetic_articles(count: int, vocab_size: int, words_per_doc: int, seed: int = 7):
+    rng = random.Random(seed)
+    vocab = [f"term{i}" for i in range(vocab_size)]
+    # Zipf-like weights so some terms are common and most are rare, as in real help content
+    cum_weights = list(itertools.accumulate(1.0 / (rank + 1) for rank in range(vocab_size)))
+    for i in range(count):
+        words = rng.choices(vocab, cum_weights=cum_weights, k=words_per_doc)
+        yield {
+            "id": f"article-{i}",
+            "title": " ".join(words[:6]),
+            "content": " ".join(words[6:]),
+            "category": CATEGORIES[i % len(CATEGORIES)]
+        }
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--docs", type=int, default=100_000)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--vocab", type=int, default=30_000)
+    parser.add_argument("--words", type=int, default=80)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--no-embeddings", action="store_true")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as index_dir:
+        kb = KnowledgeBase(index_dir, use_embeddings=not args.no_embeddings)
+        started = time.perf_counter()
+        kb.build_from_articles(synthetic_articles(args.docs, args.vocab, args.words))
+        build_time = time.perf_counter() - started
+
+        started = time.perf_counter()
+        kb = KnowledgeBase(index_dir, use_embeddings=not args.no_embeddings)
+        open_time = time.perf_counter() - started
+
+        rng = random.Random(11)
+        queries = [" ".join(f"term{rng.randrange(2000)}" for _ in range(rng.randint(2, 6)))
+                   for _ in range(args.queries)]
+        for label, category in (("all", None), ("category", "shipping")):
+            latencies = []
+            for query in queries:
+                started = time.perf_counter()
+                kb.search(query, category=category, top_k=args.top_k)
+                latencies.append((time.perf_counter() - started) * 1000)
+            print(f"search[{label}] docs={kb.doc_count} queries={len(queries)} "
+                  f"p50={statistics.median(latencies):.2f}ms "
+                  f"p95={percentile(latencies, 95):.2f}ms "
+                  f"p99={percentile(latencies, 99):.2f}ms")
+        print(f"build={build_time:.1f}s open(mmap)={open_time * 1000:.1f}ms")
+
+if __name__ == "__main__":
+    main()
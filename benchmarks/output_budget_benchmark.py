@@ -0,0 +1,157 @@
+"""Average output tokens per turn with and without per-intent output budgets.
+
+Replays a conversation set through MetaCSRAgent.generate_response against a
+stub model that writes verbose answers the way an unconstrained model tends to
+(long explanations followed by a sign-off). The stub honours max_tokens and
+stop sequences and can stream, so three modes are compared:
+
+  fixed      the previous fixed max_tokens cap, no stop sequences
+  budgets    per-intent max_tokens and stop sequences
+  early-stop budgets plus the streaming complete-answer cut
+
+Messages come from a built-in set, or from transcript logs with --transcripts.
+
+Usage: python -m benchmarks.output_budget_benchmark [--transcripts transcripts/] [--limit 500]
+"""
+import argparse
+import os
+import statistics
+from collections import defaultdict
+from typing import Any, Dict, Iterator, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from agents.output_budget import OutputBudget, OutputBudgetPolicy
+
+REPLAY_SET = [
+    "Where is my order #1042?",
+    "Has my order shipped yet?",
+    "What's the tracking number for my delivery?",
+    "My package says delivered but I don't have it",
+    "How do I reset my password?",
+    "I can't login to my account",
+    "Can I change the email on my profile?",
+    "What is your return policy?",
+    "Do you ship internationally?",
+    "How long does standard shipping take?",
+    "I was charged twice for the same order",
+    "Can I get a copy of my invoice?",
+    "Why is there an extra charge on my bill?",
+    "The app shows an error when I check out",
+    "The discount code is not working",
+    "My payment failed but the order is still showing as placed",
+    "Where is my order and why was my card charged twice?",
+    "Thanks, that's great!"
+]
+
+class VerboseStubModel(BaseChatModel):
+    """Writes a long answer word by word; honours max_tokens and stop sequences"""
+
+    sentences: int = 12
+
+    @property
+    def _llm_type(self) -> str:
+        return "verbose-stub"
+
+    def _answer(self, messages: List[BaseMessage]) -> str:
+        question = str(messages[-1].content).splitlines()[-1]
+        body = " ".join(
+            f"Step {i + 1}: regarding \"{question[:40]}\", here is some more detail you may find useful to know about this."
+            for i in range(self.sentences)
+        )
+        return f"Thank you for reaching out. {body} Is there anything else I can help you with?\nBest regards,\nCustomer Support"
+
+    def _words(self, messages: List[BaseMessage], stop: Optional[List[str]], max_tokens: Optional[int]) -> List[str]:
+        text = self._answer(messages)
+        for sequence in stop or []:
+            index = text.find(sequence)
+            if index >= 0:
+                text = text[:index]
+        # One stub token per whitespace-separated word
+        words = text.split(" ")
+        return words[:max_tokens] if max_tokens else words
+
+    def _generate(self, messages, stop=None, run_manager=None, max_tokens=None, **kwargs) -> ChatResult:
+        words = self._words(messages, stop, max_tokens)
+        message = AIMessage(
+            content=" ".join(words),
+            usage_metadata={"input_tokens": 0, "output_tokens": len(words), "total_tokens": len(words)}
+        )
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages, stop=None, run_manager=None, max_tokens=None, **kwargs) -> Iterator[ChatGenerationChunk]:
+        words = self._words(messages, stop, max_tokens)
+        for i, word in enumerate(words):
+            yield ChatGenerationChunk(message=AIMessageChunk(content=word if i == 0 else " " + word))
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+def load_messages(transcripts: Optional[str], limit: int) -> List[str]:
+    if not transcripts:
+        return list(REPLAY_SET)
+    from services.transcripts import iter_records
+    messages = []
+    for record in iter_records(transcripts):
+        if record.get("message") and not record.get("shed_reason"):
+            messages.append(record["message"])
+            if len(messages) >= limit:
+                break
+    return messages
+
+def replay(agent, messages: List[str]) -> Dict[str, List[int]]:
+    """Output tokens per turn, grouped by intent combination"""
+    tokens = defaultdict(list)
+    for message in messages:
+        response = agent.generate_response(
+            message=message,
+            chat_history=[{"role": "user", "content": message}],
+            user_context={"id": "USER001"},
+            available_actions=[],
+            allow_tools=False
+        )
+        # Counted from the text so streamed and non-streamed answers compare alike
+        tokens[OutputBudgetPolicy.key(response["intents"])].append(len(response["response"].split(" ")))
+    return tokens
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--transcripts", help="Replay customer messages from a transcript directory")
+    parser.add_argument("--limit", type=int, default=500)
+    args = parser.parse_args()
+
+    # The Groq client wants a key at construction even though the stub is used instead
+    os.environ.setdefault("GROQ_API_KEY", "stub")
+    from agents.csr_agent import MetaCSRAgent
+
+    messages = load_messages(args.transcripts, args.limit)
+    fixed = {intent: OutputBudget(max_tokens=1024) for intent in
+             ("order_status", "account_help", "general_inquiry", "billing", "technical_support")}
+    modes = {
+        "fixed": OutputBudgetPolicy(budgets=fixed, default=OutputBudget(max_tokens=1024), extra_intent_tokens=0),
+        "budgets": OutputBudgetPolicy(),
+        "early-stop": OutputBudgetPolicy(early_stop=True)
+    }
+    results = {}
+    stub = VerboseStubModel()
+    for mode, policy in modes.items():
+        agent = MetaCSRAgent("large", 0.0, 1024, small_model_name="small", small_max_tokens=256,
+                             output_budgets=policy)
+        agent._get_llm = lambda tier: stub
+        results[mode] = replay(agent, messages)
+
+    print(f"turns={len(messages)}")
+    intents = sorted(results["fixed"])
+    print(f"{'intents':<32}" + "".join(f"{mode:>12}" for mode in modes))
+    for intent in intents:
+        row = [statistics.mean(results[mode][intent]) for mode in modes]
+        print(f"{intent:<32}" + "".join(f"{value:12.1f}" for value in row))
+    averages = {mode: statistics.mean(t for turns in results[mode].values() for t in turns) for mode in modes}
+    print(f"{'average':<32}" + "".join(f"{averages[mode]:12.1f}" for mode in modes))
+    for mode in list(modes)[1:]:
+        print(f"{mode}: {100 * (1 - averages[mode] / averages['fixed']):.1f}% fewer output tokens than fixed")
+
+if __name__ == "__main__":
+    main()
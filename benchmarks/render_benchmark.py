@@ -0,0 +1,66 @@
+"""Rerun time of the chat interface for long conversations.
+
+Renders render_chat_interface headlessly with Streamlit's AppTest, once with the
+default chat window and once with the window opened to the whole conversation.
+
+Usage: python -m benchmarks.render_benchmark [--messages 200] [--runs 10]
+"""
+import argparse
+import statistics
+import time
+
+from streamlit.testing.v1 import AppTest
+
+def chat_page():
+    import streamlit as st
+    from app import MetaCSRApp
+
+    # Rendering only: skip model and tool construction
+    app = MetaCSRApp.__new__(MetaCSRApp)
+    app.chat_window = st.session_state.get("bench_window", 20)
+    app.history_page_size = 20
+    app.initialize_session()
+    app.render_chat_interface()
+
+def build_messages(count: int):
+    messages = []
+    for i in range(count):
+        if i % 2 == 0:
+            messages.append({"role": "user", "content": f"Where is my order #{1000 + i}? It cost $49.99."})
+        else:
+            messages.append({
+                "role": "assistant",
+                "content": f"Order #{1000 + i - 1} has shipped and should arrive in **3-5 business days**.",
+                "suggested_actions": [
+                    {"id": "order_track", "title": "Track order"},
+                    {"id": "order_refund", "title": "Request refund"}
+                ]
+            })
+    return messages
+
+def measure(messages, window, runs):
+    at = AppTest.from_function(chat_page, default_timeout=60)
+    at.session_state["messages"] = messages
+    at.session_state["bench_window"] = window
+    at.run()  # warm-up: imports and caches
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        at.run()
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    messages = build_messages(args.messages)
+    windowed = measure(messages, 20, args.runs)
+    full = measure(messages, len(messages), args.runs)
+    print(f"messages={len(messages)} rerun median: windowed={windowed:.1f}ms full={full:.1f}ms "
+          f"speedup={full / windowed:.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""Turn throughput with conversations sharded over worker processes.
+
+The LLM is replaced by a stub that answers instantly, so a turn's cost is the
+app's own CPU work: intent and sentiment analysis, prompt templating, JSON
+serialization and graph dispatch. Throughput is measured in-process (one GIL)
+and with 1..N shard workers; with enough cores it should grow near-linearly.
+
+Usage: python -m benchmarks.sharding_benchmark [--workers 1 2 4] [--sessions 64] [--turns 20] [--history 30]
+"""
+import argparse
+import itertools
+import os
+import threading
+import time
+import uuid
+
+from services.sharding import ShardedDispatcher
+
+def build_stub_workflow(worker_id: int = 0, shards: int = 1):
+    """Production workflow with the model replaced by an instant stub"""
+    from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+    from langchain_core.messages import AIMessage
+    from graph.factory import build_workflow
+
+    # The Groq client wants a key at construction even though the stub never calls it
+    os.environ.setdefault("GROQ_API_KEY", "stub")
+
+    class StubChatModel(GenericFakeChatModel):
+        def bind_tools(self, tools, **kwargs):
+            return self
+
+    reply = AIMessage(
+        content="Your order has shipped and should arrive within 3-5 business days.",
+        usage_metadata={"input_tokens": 900, "output_tokens": 20, "total_tokens": 920}
+    )
+    stub = StubChatModel(messages=itertools.repeat(reply))
+    workflow = build_workflow()
+    workflow.agent._get_llm = lambda tier: stub
+    return workflow
+
+def build_state(session_id: str, history: int, turn: int):
+    from models.state import CSRState
+    messages = []
+    for i in range(history):
+        if i % 2 == 0:
+            messages.append({"role": "user", "content": f"Where is my order #{1000 + i}? It was a delivery for $49.99."})
+        else:
+            messages.append({"role": "assistant", "content": f"Order #{1000 + i - 1} has shipped and is on its way."})
+    messages.append({"role": "user", "content": f"Can you check the delivery of order #{2000 + turn}?"})
+    return CSRState(
+        session_id=session_id,
+        verified=True,
+        messages=messages,
+        user_context={"id": "USER001", "name": "John Doe", "email": "john@example.com"},
+        available_actions=[{"id": "order_track", "title": "Track order", "priority": "high"}]
+    )
+
+def run_load(runner, sessions: int, turns: int, history: int, clients: int) -> float:
+    """Turns per second with `clients` concurrent callers over `sessions` sessions"""
+    session_ids = [uuid.uuid4().hex for _ in range(sessions)]
+    work = [(sid, turn) for turn in range(turns) for sid in session_ids]
+    states = [build_state(sid, history, turn) for sid, turn in work]
+    cursor = itertools.count()
+
+    def client():
+        while True:
+            index = next(cursor)
+            if index >= len(states):
+                return
+            runner.invoke(states[index])
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return len(states) / (time.perf_counter() - started)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--sessions", type=int, default=64)
+    parser.add_argument("--turns", type=int, default=20)
+    parser.add_argument("--history", type=int, default=30)
+    args = parser.parse_args()
+
+    print(f"cpus={os.cpu_count()} sessions={args.sessions} turns/session={args.turns} history={args.history}")
+    workflow = build_stub_workflow()
+    run_load(workflow, 4, 2, args.history, 1)  # warm-up
+    baseline = run_load(workflow, args.sessions, args.turns, args.history, clients=8)
+    print(f"in-process  {baseline:8.1f} turns/s")
+
+    for workers in args.workers:
+        dispatcher = ShardedDispatcher(factory="benchmarks.sharding_benchmark:build_stub_workflow", workers=workers)
+        dispatcher.start()
+        dispatcher.wait_ready()
+        run_load(dispatcher, workers * 4, 2, args.history, workers)  # warm-up
+        throughput = run_load(dispatcher, args.sessions, args.turns, args.history, clients=workers * 4)
+        dispatcher.stop()
+        print(f"workers={workers:<3} {throughput:8.1f} turns/s  speedup={throughput / baseline:.2f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""Cold-start cost of the app: import time per module and time to first turn.
+
+Each measurement runs in a fresh interpreter. Import times come from
+`python -X importtime`; the cumulative time of each project module is reported
+along with the slowest third-party imports.
+
+Usage: python -m benchmarks.startup_benchmark [--runs 5] [--top 10]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+PROJECT_MODULES = ("app", "tools.", "agents.", "graph.", "models.", "services.")
+
+STAGES = {
+    "import": "import app",
+    "construct": "import app; app.MetaCSRApp()",
+    "first_turn_ready": "import app; app.MetaCSRApp().workflow"
+}
+
+def run_python(code: str, importtime: bool = False) -> subprocess.CompletedProcess:
+    args = [sys.executable] + (["-X", "importtime"] if importtime else []) + ["-c", code]
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE="1")
+    return subprocess.run(args, capture_output=True, text=True, env=env, check=True)
+
+def parse_importtime(stderr: str):
+    """(module, self_us, cumulative_us) for every line of -X importtime output"""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        own, cumulative, name = line[len("import time:"):].split("|")
+        rows.append((name.strip(), int(own), int(cumulative)))
+    return rows
+
+def time_stage(code: str, runs: int) -> float:
+    timings = []
+    for _ in range(runs):
+        result = run_python(f"import time; _t = time.perf_counter(); {code}; print(time.perf_counter() - _t)")
+        timings.append(float(result.stdout.strip().splitlines()[-1]) * 1000)
+    return statistics.median(timings)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    rows = parse_importtime(run_python(STAGES["first_turn_ready"], importtime=True).stderr)
+    print("Project modules (cumulative import ms):")
+    for name, _, cumulative in sorted(rows, key=lambda r: r[2], reverse=True):
+        if name.startswith(PROJECT_MODULES):
+            print(f"  {name:<28} {cumulative / 1000:8.1f}")
+
+    print(f"Slowest {args.top} third-party top-level packages (cumulative import ms):")
+    third_party = [r for r in rows if "." not in r[0] and not r[0].startswith(PROJECT_MODULES)]
+    for name, _, cumulative in sorted(third_party, key=lambda r: r[2], reverse=True)[:args.top]:
+        print(f"  {name:<28} {cumulative / 1000:8.1f}")
+
+    print(f"Wall time, median of {args.runs} fresh interpreters:")
+    for stage, code in STAGES.items():
+        print(f"  {stage:<28} {time_stage(code, args.runs):8.1f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1 @@
+"""Puts the repository root on sys.path so tests import modules as `python -m` does"""
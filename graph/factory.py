@@ -0,0 +1,108 @@
+from typing import Dict, List, Any, Optional, Callable
+import os
+
+from tools.registry import registry, ToolsWrapper
+from tools.tools import AGENT_TOOLS, WRITE_BEHIND_TOOLS
+
+def search_knowledge_base(query: str, top_k: int) -> List[Dict]:
+    result = registry.get("query_knowledge_base").run(
+        {"query": query, "top_k": top_k},
+        callbacks=[]
+    )
+    return result.data.get("articles", []) if result.success else []
+
+def write_behind_handlers() -> Dict[str, Callable[[Dict[str, Any]], Any]]:
+    """Write-behind handlers for the fire-and-forget tools"""
+    def handler(name: str):
+        return lambda payload: registry.get(name).invoke(payload)
+    return {name: handler(name) for name in WRITE_BEHIND_TOOLS}
+
+def build_verification(shared: bool = False):
+    """Verification service; `shared` keeps failed attempts in SQLite so every process sees them"""
+    from services.verification import VerificationService, InMemoryAttemptStore, SqliteAttemptStore
+    from tools.tools import get_meta_csr_tools
+    path = os.getenv("CSR_VERIFICATION_DB") or ("verification_attempts.db" if shared else None)
+    return VerificationService(
+        verify_fn=get_meta_csr_tools().verify_identity_impl,
+        store=SqliteAttemptStore(path) if path else InMemoryAttemptStore()
+    )
+
+def build_tool_admission(shards: int = 1):
+    """Admission control for backend tool calls
+
+    Sessions are pinned to one shard, so session limits apply as-is; a customer's
+    sessions and the global load spread over all shards, so those limits are split.
+    """
+    from services.admission import AdmissionController
+    return AdmissionController(
+        session_rate=2.0, session_burst=10,
+        customer_rate=4.0 / shards, customer_burst=max(1.0, 20 / shards),
+        global_rate=50.0 / shards, global_burst=max(1.0, 100 / shards)
+    )
+
+def build_llm_admission(shards: int = 1):
+    """Admission control charged once per LLM call (tool-loop steps, final answers, speculation)
+
+    Split across shards like the tool limits.
+    """
+    from services.admission import AdmissionController
+    return AdmissionController(
+        session_rate=1.0, session_burst=10,
+        customer_rate=2.0 / shards, customer_burst=max(1.0, 20 / shards),
+        global_rate=40.0 / shards, global_burst=max(1.0, 80 / shards)
+    )
+
+def build_workflow(verification=None, write_behind=None, tools=None, tool_admission=None, llm_admission=None):
+    """The production agent and workflow, shared by the app and shard workers"""
+    # LangChain and LangGraph are imported here, not at module load
+    from agents.csr_agent import MetaCSRAgent
+    from agents.output_budget import OutputBudgetPolicy
+    from agents.retrieval import RetrievalStage
+    from agents.speculation import SpeculationStage
+    from graph.workflow import MetaCSRWorkflow
+    agent = MetaCSRAgent(
+        model_name="mixtral-8x7b-32768",
+        temperature=0.7,
+        # Ceiling for the large tier; per-intent budgets set the actual cap per turn
+        max_tokens=1024,
+        small_model_name="llama-3.1-8b-instant",
+        small_max_tokens=256,
+        retrieval=RetrievalStage(search=search_knowledge_base),
+        tools=registry.get_many(AGENT_TOOLS),
+        output_budgets=OutputBudgetPolicy(early_stop=bool(os.getenv("CSR_EARLY_STOP"))),
+        admission=llm_admission
+    )
+    return MetaCSRWorkflow(
+        tools or ToolsWrapper(),
+        agent,
+        verification=verification,
+        write_behind=write_behind,
+        tool_admission=tool_admission,
+        speculation=SpeculationStage(generate=agent.generate_response, classify=agent.determine_intent)
+        if os.getenv("CSR_SPECULATION") else None
+    )
+
+def build_worker_workflow(worker_id: int, shards: int = 1):
+    """Workflow for a shard worker process
+
+    Each worker has its own write-behind queue and spool, its share of the tool
+    and LLM admission limits, and a verification service whose lockouts live in SQLite
+    so they hold across workers and the app process.
+    """
+    from services.write_behind import WriteBehindQueue
+    from tools.tools import get_meta_csr_tools
+    tool_admission = build_tool_admission(shards)
+    get_meta_csr_tools().admission = tool_admission
+    spool_dir = os.getenv("CSR_SPOOL_DIR")
+    write_behind = WriteBehindQueue(
+        handlers=write_behind_handlers(),
+        spool_dir=os.path.join(spool_dir, f"worker-{worker_id}") if spool_dir else None,
+        dead_letter_path=os.getenv("CSR_DEAD_LETTER_PATH", "dead_letter.jsonl")
+    )
+    write_behind.start()
+    return build_workflow(
+        verification=build_verification(shared=True),
+        write_behind=write_behind,
+        tool_admission=tool_admission,
+        llm_admission=build_llm_admission(shards)
+    )
@@ -1,55 +1,66 @@
 from typing import Dict, List, Any, Tuple
-from langchain_core.messages import BaseMessage, FunctionMessage, HumanMessage, AIMessage
-from langchain_core.output_parsers import JsonOutputParser
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from contextvars import copy_context
+from langchain_core.messages import BaseMessage, HumanMessage, ToolMessage
 from langgraph.graph import StateGraph, Graph
-from dataclasses import dataclass, field
-from enum import Enum
+from langgraph.errors import GraphRecursionError
+from dataclasses import asdict, fields, is_dataclass
+from models.state import CSRState, WorkflowState
+from services.admission import AdmissionRejected
+from tools.registry import registry
+from tools.tools import PARALLEL_SAFE_TOOLS, WRITE_BEHIND_TOOLS, CONFIRM_TOOLS
 import json
+import threading
 
-class WorkflowState(Enum):
-    INIT = "init"
-    VERIFY = "verify"
-    PROCESS = "process"
-    EXECUTE = "execute"
-    FEEDBACK = "feedback"
-    END = "end"
-
-@dataclass
-class CSRState:
-    messages: List[BaseMessage] = field(default_factory=list)
-    current_state: WorkflowState = WorkflowState.INIT
-    verified: bool = False
-    verification_attempts: int = 0
-    user_context: Dict = field(default_factory=dict)
-    confidence_score: float = 1.0
-    requires_escalation: bool = False
-    pending_action: Dict = field(default_factory=dict)
-    feedback_submitted: bool = False
-    processed: bool = False
-    
 class MetaCSRWorkflow:
-    def __init__(self, tools, agent):
+    def __init__(self, tools, agent, max_tool_steps: int = 3, verification=None, write_behind=None,
+                 speculation=None, tool_admission=None):
         self.tools = tools
         self.agent = agent
+        # Optional AdmissionController; backend tool calls of a run are charged to its session
+        self.tool_admission = tool_admission
+        # Optional SpeculationStage serving pre-generated answers to predicted follow-ups
+        self.speculation = speculation
+        self.verification = verification
+        self.write_behind = write_behind
+        self.max_tool_steps = max_tool_steps
+        self.tool_map = {t.name: t for t in agent.tools}
+        self.executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="csr-tools")
+        # Executions each node may use per invoke: one pass, except the model/tool
+        # loop which gets one extra pass per allowed tool step
+        self.node_budgets = {
+            "verify_identity": 1,
+            "process_query": max_tool_steps + 1,
+            "run_tools": max_tool_steps,
+            "collect_feedback": 1,
+            "end": 1
+        }
+        self.recursion_limit = sum(self.node_budgets.values()) + 1
+        self._stats_lock = threading.Lock()
+        self._stats = {"invokes": 0, "node_executions": 0, "wasted_node_executions": 0,
+                       "budget_exhausted": 0, "awaiting_input": 0}
+        self._node_stats: Dict[str, int] = {name: 0 for name in self.node_budgets}
         self.graph = self._build_graph()
 
     def _build_graph(self) -> Graph:
         workflow = StateGraph(CSRState)
         
         # Add nodes
-        workflow.add_node("verify_identity", self._verify_identity_node)
-        workflow.add_node("process_query", self._process_query_node)
-        workflow.add_node("execute_action", self._execute_action_node)
-        workflow.add_node("collect_feedback", self._collect_feedback_node)
-        workflow.add_node("end", self._end_node)
+        workflow.add_node("verify_identity", self._guarded("verify_identity", self._verify_identity_node))
+        workflow.add_node("process_query", self._guarded("process_query", self._process_query_node))
+        workflow.add_node("run_tools", self._guarded("run_tools", self._run_tools_node))
+        workflow.add_node("collect_feedback", self._guarded("collect_feedback", self._collect_feedback_node))
+        workflow.add_node("end", self._guarded("end", self._end_node))
         
-        # Add edges with conditions
+        # Add edges with conditions. An unverified message ends the run and waits
+        # for the customer's next input instead of re-entering verification.
         workflow.add_conditional_edges(
             "verify_identity",
             self._verify_condition,
             {
                 True: "process_query",
-                False: "verify_identity"
+                False: "end"
             }
         )
         
@@ -58,14 +69,15 @@ class MetaCSRWorkflow:
             "process_query",
             self._route_state,
             {
-                "execute": "execute_action",
+                "tools": "run_tools",
                 "feedback": "collect_feedback",
                 "end": "end",
                 
             }
         )
         
-        workflow.add_edge("execute_action", "end")
+        # Tool results go back to the model until it produces a final answer
+        workflow.add_edge("run_tools", "process_query")
         workflow.add_edge("collect_feedback", "end")
         
         # Set entry point
@@ -73,23 +85,84 @@ class MetaCSRWorkflow:
         
         return workflow.compile()
     
+    def _guarded(self, name: str, node):
+        """Wrap a node with its per-invoke execution budget and progress accounting"""
+        def run(state: CSRState) -> CSRState:
+            counts = dict(state.node_counts)
+            counts[name] = counts.get(name, 0) + 1
+            state.node_counts = counts
+            if counts[name] > self.node_budgets[name]:
+                # Out of budget: skip the node and let the routers end the run
+                state.budget_exhausted = True
+                self._count(name, wasted=True)
+                return state
+            before = self._progress(state)
+            state = node(state)
+            # A repeat pass that changed nothing was avoidable work
+            self._count(name, wasted=counts[name] > 1 and self._progress(state) == before)
+            return state
+        return run
+
+    def _progress(self, state: CSRState) -> Tuple:
+        """Cheap fingerprint of the fields a useful node execution changes"""
+        return (state.verified, state.verification_attempts, state.current_state, state.processed,
+                len(state.scratchpad), state.tool_steps, state.feedback_submitted, id(state.last_response))
+
+    def _count(self, name: str, wasted: bool):
+        with self._stats_lock:
+            self._stats["node_executions"] += 1
+            self._node_stats[name] += 1
+            if wasted:
+                self._stats["wasted_node_executions"] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Node executions per invoke and how many of them made no progress"""
+        with self._stats_lock:
+            stats = dict(self._stats)
+            stats["per_node"] = dict(self._node_stats)
+        invokes = stats["invokes"] or 1
+        stats["nodes_per_invoke"] = stats["node_executions"] / invokes
+        stats["wasted_ratio"] = stats["wasted_node_executions"] / max(stats["node_executions"], 1)
+        return stats
+
     def _verify_identity_node(self, state: CSRState) -> CSRState:
-        """Handle identity verification"""
+        """Handle identity verification; at most one attempt per user message"""
         if not state.verified and state.verification_attempts < 3:
+            # A fresh verification token for this session makes the backend call unnecessary
+            token = self.verification.cached(state.session_id) if self.verification else None
+            if token is not None:
+                state.verified = True
+                state.user_context = token.user_info
+                return state
+            
             # Extract credentials from last message if available
             last_message = state.messages[-1] if state.messages else None
             if isinstance(last_message, HumanMessage):
                 # Simple credential extraction - enhance in production
                 if "CUST" in last_message.content:
-                    result = self.tools.verify_identity(
-                        customer_id=last_message.content,
-                        password="password123"  # In production, get from secure input
-                    )
+                    credentials = {
+                        "customer_id": last_message.content,
+                        "password": "password123"  # In production, get from secure input
+                    }
+                    if self.verification is not None:
+                        result = self.verification.verify(state.session_id, **credentials)
+                    else:
+                        result = self.tools.verify_identity.invoke(credentials)
                     state.verified = result.success
                     if result.success:
                         state.user_context = result.data.get("user_info", {})
             
             state.verification_attempts += 1
+            if not state.verified and state.verification_attempts < 3:
+                # Interrupt: nothing more can happen until the customer sends credentials
+                state.current_state = WorkflowState.VERIFY
+                state.last_response = {
+                    "response": "Please verify your identity to continue.",
+                    "awaiting_input": "verification",
+                    "suggested_actions": []
+                }
+            elif state.current_state == WorkflowState.VERIFY:
+                state.current_state = WorkflowState.PROCESS
             
         return state
 
@@ -113,21 +186,46 @@ class MetaCSRWorkflow:
         # Process message only if not already processed
         if not state.processed:
             try:
-                # Get agent response
-                response = self.agent.generate_response(
-                    message=message_content,
-                    chat_history=[msg for msg in state.messages if isinstance(msg, (dict, BaseMessage))],
-                    user_context=state.user_context,
-                    available_actions=[]  # Will be populated from tools if needed
-                )
+                # A pre-generated answer to a predicted follow-up skips the model call
+                response = None
+                if self.speculation is not None and not state.scratchpad:
+                    response = self.speculation.take(state.session_id, message_content)
+                
+                if response is None:
+                    # Tools are only offered to verified users and withdrawn once the
+                    # step cap is reached to force a final answer
+                    allow_tools = state.verified and state.tool_steps < self.max_tool_steps
+                    response = self.agent.generate_response(
+                        message=message_content,
+                        chat_history=[msg for msg in state.messages if isinstance(msg, (dict, BaseMessage))],
+                        user_context=state.user_context,
+                        available_actions=state.available_actions,
+                        tool_messages=state.scratchpad,
+                        allow_tools=allow_tools
+                    )
+                    self._add_usage(state, response)
+                    
+                    # Model asked for tools: run them before answering
+                    if allow_tools and response.get("tool_calls"):
+                        state.scratchpad = state.scratchpad + [response["message"]]
+                        return state
                 
                 # Update state based on response
                 state.confidence_score = response.get("confidence", 1.0)
                 state.requires_escalation = state.confidence_score < 0.7
+                response["tools_called"] = [
+                    call["name"] for msg in state.scratchpad for call in getattr(msg, "tool_calls", None) or []
+                ]
+                response["turn_usage"] = state.turn_usage
+                state.last_response = response
                 
+                # Remember the suggested next action; the customer confirms it from the UI
                 if response.get("suggested_actions"):
                     state.pending_action = response["suggested_actions"][0]
                 
+            except AdmissionRejected as e:
+                # Over the LLM rate limit: end the turn and let the caller answer with a canned reply
+                state.last_response = {"response": "", "shed_reason": e.reason, "suggested_actions": []}
             except Exception as e:
                 print(f"Error processing query: {str(e)}")
                 state.requires_escalation = True
@@ -136,31 +234,107 @@ class MetaCSRWorkflow:
         
         return state
     
-    def _execute_action_node(self, state: CSRState) -> CSRState:
-        """Execute pending action if any"""
-        if state.pending_action:
+    def _add_usage(self, state: CSRState, response: Dict[str, Any]):
+        """Accumulate token counts and model latency over all LLM calls of a turn"""
+        usage = dict(state.turn_usage)
+        for key, value in (response.get("usage") or {}).items():
+            usage[key] = usage.get(key, 0) + (value or 0)
+        usage["llm_latency"] = usage.get("llm_latency", 0.0) + response.get("latency", 0.0)
+        usage["llm_calls"] = usage.get("llm_calls", 0) + 1
+        state.turn_usage = usage
+
+    def _run_tools_node(self, state: CSRState) -> CSRState:
+        """Execute the tool calls requested by the model"""
+        tool_calls = state.scratchpad[-1].tool_calls
+        results: Dict[str, ToolMessage] = {}
+        # Injected tool arguments come from the verified session, never from the model
+        caller = {"user_id": state.user_context.get("id") if state.verified else None,
+                  "session_id": state.session_id}
+        
+        # State-changing calls wait for the customer's confirmation
+        for call in tool_calls:
+            if call["name"] in CONFIRM_TOOLS:
+                results[call["id"]] = self._propose_tool_call(state, call)
+        
+        # Read-only calls run concurrently; calls with side effects run in order.
+        # Each worker gets a copy of the caller's context (admission scope etc.)
+        parallel = [call for call in tool_calls if call["name"] in PARALLEL_SAFE_TOOLS]
+        futures = [self.executor.submit(copy_context().run, self._run_tool_call, call, caller) for call in parallel]
+        for call, future in zip(parallel, futures):
+            results[call["id"]] = future.result()
+        for call in tool_calls:
+            if call["id"] not in results:
+                results[call["id"]] = self._run_tool_call(call, caller)
+        
+        state.scratchpad = state.scratchpad + [results[call["id"]] for call in tool_calls]
+        state.tool_steps += 1
+        return state
+    
+    def _propose_tool_call(self, state: CSRState, call: Dict[str, Any]) -> ToolMessage:
+        """Hold a state-changing call for confirmation instead of running it"""
+        if call["name"] not in self.tool_map:
+            content = {"success": False, "error": f"Unknown tool {call['name']}"}
+        elif state.pending_tool_call:
+            content = {"success": False, "error": "Another action is already awaiting confirmation"}
+        else:
+            state.pending_tool_call = {
+                "id": call["id"],
+                "name": call["name"],
+                "title": call["name"].replace("_", " ").capitalize(),
+                "args": {k: v for k, v in call["args"].items() if k not in registry.injected(call["name"])}
+            }
+            content = {
+                "success": False,
+                "status": "awaiting_confirmation",
+                "message": "Not executed yet. Tell the customer what will happen and ask them to confirm it."
+            }
+        return ToolMessage(content=json.dumps(content), tool_call_id=call["id"], name=call["name"])
+    
+    def _run_tool_call(self, call: Dict[str, Any], caller: Dict[str, Any]) -> ToolMessage:
+        """Run a single tool call and wrap its result for the model"""
+        tool = self.tool_map.get(call["name"])
+        if tool is not None:
+            try:
+                args = registry.bind_caller(call["name"], call["args"], caller)
+            except PermissionError as e:
+                return ToolMessage(content=json.dumps({"success": False, "error": str(e)}),
+                                   tool_call_id=call["id"], name=call["name"])
+        if tool is None:
+            content = json.dumps({"success": False, "error": f"Unknown tool {call['name']}"})
+        elif call["name"] in WRITE_BEHIND_TOOLS and self.write_behind is not None:
+            item_id = self.write_behind.submit(call["name"], args)
+            content = json.dumps({
+                "success": item_id is not None,
+                "message": "Request accepted and will be processed shortly" if item_id else "Service busy, please retry",
+                "data": {"request_id": item_id}
+            })
+        else:
             try:
-                result = self.tools.execute_action.run(
-                    user_id=state.user_context.get("id"),
-                    action_id=state.pending_action.get("id"),
-                    params={}
+                result = tool.invoke(args)
+                content = json.dumps(
+                    asdict(result) if is_dataclass(result) else result,
+                    separators=(",", ":"),
+                    default=str
                 )
-                state.pending_action = {}
             except Exception as e:
-                print(f"Error executing action: {str(e)}")
-                state.requires_escalation = True
-        
-        return state
+                print(f"Error executing tool {call['name']}: {str(e)}")
+                content = json.dumps({"success": False, "error": str(e)})
+        return ToolMessage(content=content, tool_call_id=call["id"], name=call["name"])
     
     def _collect_feedback_node(self, state: CSRState) -> CSRState:
         """Collect feedback if needed"""
         if not state.feedback_submitted and state.requires_escalation:
             try:
-                result = self.tools.log_feedback.run(
-                    session_id="session_123",
-                    rating=3,
-                    comments="Escalated to human agent"
-                )
+                feedback = {
+                    "session_id": state.session_id,
+                    "rating": 3,
+                    "comments": "Escalated to human agent"
+                }
+                # Logging feedback is not on the customer's critical path
+                if self.write_behind is not None:
+                    self.write_behind.submit("log_feedback", feedback)
+                else:
+                    self.tools.log_feedback.invoke(feedback)
                 state.feedback_submitted = True
             except Exception as e:
                 print(f"Error collecting feedback: {str(e)}")
@@ -168,22 +342,66 @@ class MetaCSRWorkflow:
         return state
 
     def _verify_condition(self, state: CSRState) -> bool:
-        """Determine if verification should continue"""
+        """Proceed once verified or out of attempts; otherwise wait for the next message"""
+        if state.budget_exhausted:
+            return False
         return state.verified or state.verification_attempts >= 3
 
     def _route_state(self, state: CSRState) -> str:
         """Determine next state based on current context"""
-        if state.pending_action:
-            return "execute"
+        if state.budget_exhausted:
+            return "end"
+        if state.scratchpad and getattr(state.scratchpad[-1], "tool_calls", None):
+            return "tools"
         elif state.requires_escalation and not state.feedback_submitted:
             return "feedback"
         return "end"
     
     def invoke(self, state: CSRState) -> CSRState:
         """Execute the workflow"""
-        # Reset processed flag for new invocation
+        # Reset processed flag and turn-scoped fields for new invocation
         state.processed = False
-        return self.graph.invoke(state)
+        state.scratchpad = []
+        state.tool_steps = 0
+        state.last_response = {}
+        state.turn_usage = {}
+        state.node_counts = {}
+        state.budget_exhausted = False
+        # An unconfirmed proposal does not carry over to a new message
+        state.pending_tool_call = {}
+        with self._stats_lock:
+            self._stats["invokes"] += 1
+        scope = (self.tool_admission.scope(state.session_id, state.user_context.get("id"))
+                 if self.tool_admission is not None else nullcontext())
+        try:
+            with scope:
+                result = self.graph.invoke(state, config={"recursion_limit": self.recursion_limit})
+        except GraphRecursionError as e:
+            # Budgets should end the run first; this is the backstop
+            print(f"Error running workflow: {str(e)}")
+            state.budget_exhausted = True
+            state.requires_escalation = True
+            result = state
+        # The compiled graph returns channel values; hand callers a state object again
+        if isinstance(result, dict):
+            result = type(state)(**{f.name: result[f.name] for f in fields(state) if f.name in result})
+        with self._stats_lock:
+            if result.budget_exhausted:
+                self._stats["budget_exhausted"] += 1
+            if result.last_response.get("awaiting_input"):
+                self._stats["awaiting_input"] += 1
+        if self.speculation is not None and result.verified and result.last_response.get("response"):
+            self.speculation.schedule(
+                result.session_id,
+                chat_history=[m for m in result.messages if isinstance(m, (dict, BaseMessage))]
+                + [{"role": "assistant", "content": result.last_response["response"]}],
+                user_context=result.user_context,
+                available_actions=result.available_actions,
+                intents=result.last_response.get("intents", {}),
+                pending_action=result.pending_action,
+                tool_results=[m.content for m in result.scratchpad if isinstance(m, ToolMessage)]
+            )
+        return result
     
     def _end_node(self, state: CSRState) -> CSRState:
         """Final state"""
@@ -1,6 +1,6 @@
 # state.py
 from dataclasses import dataclass, field
-from typing import Dict, List, Optional
+from typing import Any, Dict, List, Optional
 from enum import Enum
 
 class WorkflowState(Enum):
@@ -14,6 +14,7 @@ class WorkflowState(Enum):
 @dataclass
 class CSRState:
     # Basic state attributes
+    session_id: str = ""
     verified: bool = False
     verification_attempts: int = 0
     current_state: WorkflowState = WorkflowState.INIT
@@ -29,11 +30,23 @@ class CSRState:
     
     # Action and feedback tracking
     pending_action: Dict = field(default_factory=dict)
+    # State-changing tool call proposed by the model, run once the customer confirms
+    pending_tool_call: Dict = field(default_factory=dict)
     feedback_submitted: bool = False
 
+    # Turn-scoped fields, reset on every workflow run and not persisted
+    available_actions: List[Dict] = field(default_factory=list)
+    scratchpad: List[Any] = field(default_factory=list)
+    tool_steps: int = 0
+    last_response: Dict = field(default_factory=dict)
+    turn_usage: Dict = field(default_factory=dict)
+    node_counts: Dict = field(default_factory=dict)
+    budget_exhausted: bool = False
+
     def to_dict(self) -> Dict:
         """Convert state to dictionary for storage"""
         return {
+            "session_id": self.session_id,
             "verified": self.verified,
             "verification_attempts": self.verification_attempts,
             "current_state": self.current_state.value,
@@ -43,6 +56,7 @@ class CSRState:
             "requires_escalation": self.requires_escalation,
             "processed": self.processed,
             "pending_action": self.pending_action,
+            "pending_tool_call": self.pending_tool_call,
             "feedback_submitted": self.feedback_submitted
         }
 
@@ -51,6 +65,7 @@ class CSRState:
         """Create state from dictionary"""
         state = cls()
         if data:
+            state.session_id = data.get("session_id", "")
             state.verified = data.get("verified", False)
             state.verification_attempts = data.get("verification_attempts", 0)
             state.current_state = WorkflowState(data.get("current_state", WorkflowState.INIT.value))
@@ -60,5 +75,6 @@ class CSRState:
             state.requires_escalation = data.get("requires_escalation", False)
             state.processed = data.get("processed", False)
             state.pending_action = data.get("pending_action", {})
+            state.pending_tool_call = data.get("pending_tool_call", {})
             state.feedback_submitted = data.get("feedback_submitted", False)
         return state
\ No newline at end of file
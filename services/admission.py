@@ -0,0 +1,216 @@
+from typing import Dict, Optional, Iterator
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+import threading
+import time
+
+# Who the current turn belongs to; set by the app around a turn so tool calls deep
+# inside the workflow are charged to the right session and customer
+_current_session: ContextVar[Optional[str]] = ContextVar("csr_session_id", default=None)
+_current_customer: ContextVar[Optional[str]] = ContextVar("csr_customer_id", default=None)
+
+class AdmissionRejected(Exception):
+    """Raised when a call is shed by admission control"""
+
+    def __init__(self, reason: str):
+        super().__init__(f"Request rejected by admission control: {reason}")
+        self.reason = reason
+
+@dataclass
+class AdmissionDecision:
+    admitted: bool
+    reason: str = ""
+    waited: float = 0.0
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second up to `capacity`"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        # `now` may predate a bucket created after the caller read the clock
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def available(self, amount: float = 1.0, now: Optional[float] = None) -> bool:
+        self._refill(now if now is not None else time.monotonic())
+        return self.tokens >= amount
+
+    def take(self, amount: float = 1.0):
+        self.tokens -= amount
+
+    def refund(self, amount: float = 1.0):
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+    def wait_time(self, amount: float = 1.0) -> float:
+        return max(0.0, (amount - self.tokens) / self.rate) if self.rate > 0 else float("inf")
+
+class AdmissionController:
+    """Token-bucket admission per session, per customer and globally
+
+    Session and customer buckets reject immediately so one noisy client cannot
+    queue up work. When only the global bucket is empty, callers wait in a
+    bounded queue served round-robin across sessions, and are shed once the
+    queue is full or their wait exceeds `max_wait`. A waiter's session and
+    customer tokens are reserved when it enqueues and refunded if it is shed,
+    so queued calls count against those limits while they wait.
+    """
+
+    def __init__(self,
+                 session_rate: float = 0.5,
+                 session_burst: float = 5,
+                 customer_rate: float = 1.0,
+                 customer_burst: float = 10,
+                 global_rate: float = 20.0,
+                 global_burst: float = 40,
+                 max_queue: int = 100,
+                 max_wait: float = 5.0,
+                 idle_ttl: float = 600.0):
+        self.session_rate, self.session_burst = session_rate, session_burst
+        self.customer_rate, self.customer_burst = customer_rate, customer_burst
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.idle_ttl = idle_ttl
+        self._sessions: Dict[str, TokenBucket] = {}
+        self._customers: Dict[str, TokenBucket] = {}
+        # Waiters grouped per session; the OrderedDict order is the round-robin order
+        self._waiters: "OrderedDict[str, deque]" = OrderedDict()
+        self._queued = 0
+        self._cond = threading.Condition()
+        self._last_sweep = time.monotonic()
+        self._stats = {"admitted": 0, "queued": 0, "rejected_session": 0, "rejected_customer": 0,
+                       "rejected_queue_full": 0, "rejected_timeout": 0, "total_wait": 0.0}
+
+    def _bucket(self, buckets: Dict[str, TokenBucket], key: str, rate: float, burst: float) -> TokenBucket:
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = buckets[key] = TokenBucket(rate, burst)
+        return bucket
+
+    def _sweep(self, now: float):
+        """Drop buckets that have been idle long enough to be full again"""
+        if now - self._last_sweep < self.idle_ttl:
+            return
+        self._last_sweep = now
+        for buckets in (self._sessions, self._customers):
+            for key in [k for k, b in buckets.items() if now - b.updated > self.idle_ttl]:
+                del buckets[key]
+
+    def _is_next(self, session_key: str, ticket: object) -> bool:
+        head_session = next(iter(self._waiters))
+        return head_session == session_key and self._waiters[session_key][0] is ticket
+
+    def _dequeue(self, session_key: str, ticket: object):
+        queue = self._waiters[session_key]
+        queue.remove(ticket)
+        del self._waiters[session_key]
+        if queue:
+            # Re-append so the next session in line goes first
+            self._waiters[session_key] = queue
+        self._queued -= 1
+
+    def admit(self,
+              session_id: Optional[str] = None,
+              customer_id: Optional[str] = None,
+              cost: float = 1.0,
+              timeout: Optional[float] = None) -> AdmissionDecision:
+        """Admit or shed one unit of work; never raises"""
+        timeout = self.max_wait if timeout is None else timeout
+        started = time.monotonic()
+        with self._cond:
+            now = started
+            self._sweep(now)
+            session = self._bucket(self._sessions, session_id, self.session_rate, self.session_burst) if session_id else None
+            customer = self._bucket(self._customers, customer_id, self.customer_rate, self.customer_burst) if customer_id else None
+            if session is not None and not session.available(cost, now):
+                self._stats["rejected_session"] += 1
+                return AdmissionDecision(False, "session_rate")
+            if customer is not None and not customer.available(cost, now):
+                self._stats["rejected_customer"] += 1
+                return AdmissionDecision(False, "customer_rate")
+
+            if not self._waiters and self.global_bucket.available(cost, now):
+                self._reserve(session, customer, cost)
+                self._take_global(cost)
+                return AdmissionDecision(True)
+
+            if self._queued >= self.max_queue:
+                self._stats["rejected_queue_full"] += 1
+                return AdmissionDecision(False, "queue_full")
+
+            self._reserve(session, customer, cost)
+            session_key = session_id or customer_id or "anonymous"
+            ticket = object()
+            self._waiters.setdefault(session_key, deque()).append(ticket)
+            self._queued += 1
+            self._stats["queued"] += 1
+            deadline = started + timeout
+            while True:
+                now = time.monotonic()
+                if self._is_next(session_key, ticket) and self.global_bucket.available(cost, now):
+                    self._dequeue(session_key, ticket)
+                    self._take_global(cost)
+                    waited = now - started
+                    self._stats["total_wait"] += waited
+                    self._cond.notify_all()
+                    return AdmissionDecision(True, waited=waited)
+                remaining = deadline - now
+                if remaining <= 0:
+                    self._dequeue(session_key, ticket)
+                    self._refund(session, customer, cost)
+                    self._stats["rejected_timeout"] += 1
+                    self._cond.notify_all()
+                    return AdmissionDecision(False, "over_capacity", waited=now - started)
+                self._cond.wait(min(remaining, max(self.global_bucket.wait_time(cost), 0.01)))
+
+    @staticmethod
+    def _reserve(session: Optional[TokenBucket], customer: Optional[TokenBucket], cost: float):
+        if session is not None:
+            session.take(cost)
+        if customer is not None:
+            customer.take(cost)
+
+    @staticmethod
+    def _refund(session: Optional[TokenBucket], customer: Optional[TokenBucket], cost: float):
+        if session is not None:
+            session.refund(cost)
+        if customer is not None:
+            customer.refund(cost)
+
+    def _take_global(self, cost: float):
+        self.global_bucket.take(cost)
+        self._stats["admitted"] += 1
+
+    @contextmanager
+    def scope(self, session_id: Optional[str], customer_id: Optional[str] = None) -> Iterator[None]:
+        """Attribute calls made inside the block to a session and customer"""
+        session_token = _current_session.set(session_id)
+        customer_token = _current_customer.set(customer_id)
+        try:
+            yield
+        finally:
+            _current_session.reset(session_token)
+            _current_customer.reset(customer_token)
+
+    def admit_current(self, cost: float = 1.0, timeout: Optional[float] = None):
+        """Admit a call for the current scope, raising AdmissionRejected when shed"""
+        decision = self.admit(_current_session.get(), _current_customer.get(), cost, timeout)
+        if not decision.admitted:
+            raise AdmissionRejected(decision.reason)
+
+    def get_stats(self) -> Dict[str, float]:
+        with self._cond:
+            stats = dict(self._stats)
+            stats["queue_depth"] = self._queued
+            stats["tracked_sessions"] = len(self._sessions)
+            stats["tracked_customers"] = len(self._customers)
+        stats["avg_wait"] = stats["total_wait"] / stats["queued"] if stats["queued"] else 0.0
+        return stats
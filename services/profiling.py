@@ -0,0 +1,135 @@
+from typing import Dict, List, Any, Optional, Iterator
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+import cProfile
+import os
+import pstats
+import random
+import threading
+import time
+import tracemalloc
+
+# Functions on the turn's hot path that are always reported, even outside the top-N
+FOCUS_FUNCTIONS = {
+    "generate_response", "build_inputs", "serialize", "dumps", "to_dict", "from_dict",
+    "invoke", "_process_query_node", "_run_tools_node", "render_chat_interface", "render_sidebar"
+}
+
+class _Scope:
+    def __init__(self, label: str):
+        self.label = label
+
+class TurnProfiler:
+    """Opt-in cProfile + tracemalloc snapshots around app reruns and chat turns
+
+    Enabled with CSR_PROFILE=1. Sampled runs (CSR_PROFILE_SAMPLE, default 1.0) are
+    dumped as .prof files to CSR_PROFILE_DIR (default `profiles`) and summarized
+    per session: hottest functions by cumulative time and top allocation growth.
+    Only one run is profiled at a time because tracemalloc is process-wide.
+    Summaries are kept for the `max_sessions` most recently profiled sessions,
+    `history` runs each.
+    """
+
+    def __init__(self,
+                 enabled: Optional[bool] = None,
+                 output_dir: Optional[str] = None,
+                 sample_rate: Optional[float] = None,
+                 top_n: int = 15,
+                 history: int = 20,
+                 max_sessions: int = 100):
+        self.enabled = enabled if enabled is not None else os.getenv("CSR_PROFILE", "") not in ("", "0", "false")
+        self.output_dir = output_dir or os.getenv("CSR_PROFILE_DIR", "profiles")
+        self.sample_rate = sample_rate if sample_rate is not None else float(os.getenv("CSR_PROFILE_SAMPLE", "1.0"))
+        self.top_n = top_n
+        self._busy = threading.Lock()
+        self._local = threading.local()
+        self.history = history
+        self.max_sessions = max_sessions
+        self._sessions: "OrderedDict[str, deque]" = OrderedDict()
+        self._lock = threading.Lock()
+        if self.enabled:
+            os.makedirs(self.output_dir, exist_ok=True)
+
+    def label_current(self, label: str):
+        """Relabel the run being profiled on this thread (e.g. a rerun that handled a turn)"""
+        scope = getattr(self._local, "scope", None)
+        if scope is not None:
+            scope.label = label
+
+    @contextmanager
+    def profile(self, session_id: str, label: str = "render") -> Iterator[None]:
+        if not self.enabled or random.random() > self.sample_rate or not self._busy.acquire(blocking=False):
+            yield
+            return
+        scope = _Scope(label)
+        self._local.scope = scope
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start(5)
+        before = tracemalloc.take_snapshot()
+        profiler = cProfile.Profile()
+        started = time.perf_counter()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            # Also runs when Streamlit interrupts the script with st.rerun()
+            profiler.disable()
+            elapsed = time.perf_counter() - started
+            after = tracemalloc.take_snapshot()
+            if started_tracing:
+                tracemalloc.stop()
+            self._local.scope = None
+            try:
+                self._record(session_id, scope.label, elapsed, profiler, before, after)
+            finally:
+                self._busy.release()
+
+    def _record(self, session_id: str, label: str, elapsed: float, profiler: cProfile.Profile,
+                before: tracemalloc.Snapshot, after: tracemalloc.Snapshot):
+        path = os.path.join(self.output_dir, f"{session_id or 'anonymous'}-{label}-{int(time.time() * 1000)}.prof")
+        profiler.dump_stats(path)
+
+        stats = pstats.Stats(profiler).stats
+        rows = []
+        for (filename, line, name), (_, calls, own, cumulative, _) in stats.items():
+            rows.append({
+                "function": f"{name} ({os.path.basename(filename)}:{line})",
+                "name": name,
+                "calls": calls,
+                "own_ms": round(own * 1000, 2),
+                "cumulative_ms": round(cumulative * 1000, 2)
+            })
+        rows.sort(key=lambda r: r["cumulative_ms"], reverse=True)
+        focus = {}
+        for row in rows:
+            if row["name"] in FOCUS_FUNCTIONS and row["name"] not in focus:
+                focus[row["name"]] = row["cumulative_ms"]
+
+        growth = after.compare_to(before, "lineno")
+        allocations = [
+            {"location": str(diff.traceback[0]), "size_kb": round(diff.size_diff / 1024, 1), "count": diff.count_diff}
+            for diff in growth[:self.top_n] if diff.size_diff
+        ]
+        summary = {
+            "label": label,
+            "ts": time.time(),
+            "elapsed_ms": round(elapsed * 1000, 1),
+            "allocated_kb": round(sum(d.size_diff for d in growth) / 1024, 1),
+            "profile": path,
+            "hot_functions": [{k: v for k, v in r.items() if k != "name"} for r in rows[:self.top_n]],
+            "focus_ms": focus,
+            "allocation_growth": allocations
+        }
+        with self._lock:
+            summaries = self._sessions.get(session_id)
+            if summaries is None:
+                summaries = self._sessions[session_id] = deque(maxlen=self.history)
+            summaries.append(summary)
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+    def session_summaries(self, session_id: str) -> List[Dict[str, Any]]:
+        with self._lock:
+            return list(self._sessions.get(session_id, []))
@@ -0,0 +1,400 @@
+"""Multi-process sharding of conversations by session ID.
+
+A dispatcher in the app process hashes each session ID onto a ring of worker
+processes. Every worker builds its own workflow, agent and caches (via a
+factory given as "module:function"), so a session's turns always land on the
+same warm worker and CPU-bound turn work runs on all cores instead of behind
+one GIL. Turns travel over a multiprocessing Pipe as pickled CSRState objects.
+
+A health thread pings workers and restarts any that died or stopped
+answering; `resize` adds or removes workers and only the sessions whose ring
+position moves change workers.
+"""
+from typing import Dict, List, Any, Optional
+from concurrent.futures import Future
+import bisect
+import hashlib
+import importlib
+import itertools
+import multiprocessing
+import os
+import threading
+import time
+
+# ----------------------------
+# Consistent hashing
+# ----------------------------
+class HashRing:
+    """Consistent hash ring with virtual nodes"""
+
+    def __init__(self, nodes=(), replicas: int = 64):
+        self.replicas = replicas
+        self._keys: List[int] = []
+        self._owners: Dict[int, Any] = {}
+        for node in nodes:
+            self.add(node)
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
+
+    def add(self, node):
+        for i in range(self.replicas):
+            point = self._hash(f"{node}#{i}")
+            if point not in self._owners:
+                bisect.insort(self._keys, point)
+                self._owners[point] = node
+
+    def remove(self, node):
+        for i in range(self.replicas):
+            point = self._hash(f"{node}#{i}")
+            if self._owners.get(point) == node:
+                del self._owners[point]
+                self._keys.pop(bisect.bisect_left(self._keys, point))
+
+    def get(self, key: str):
+        if not self._keys:
+            raise LookupError("Hash ring is empty")
+        index = bisect.bisect(self._keys, self._hash(key)) % len(self._keys)
+        return self._owners[self._keys[index]]
+
+    @property
+    def nodes(self) -> List[Any]:
+        return sorted(set(self._owners.values()))
+
+# ----------------------------
+# Worker process
+# ----------------------------
+def _load_factory(factory: str):
+    module, _, name = factory.partition(":")
+    return getattr(importlib.import_module(module), name)
+
+def _worker_main(worker_id: int, factory: str, conn, shards: int):
+    """Serve turns for one shard until told to stop or the pipe closes"""
+    workflow = _load_factory(factory)(worker_id, shards)
+    turns = 0
+    while True:
+        try:
+            request_id, kind, payload = conn.recv()
+        except (EOFError, OSError):
+            break
+        if kind == "stop":
+            break
+        try:
+            if kind == "turn":
+                result = workflow.invoke(payload)
+                turns += 1
+            elif kind == "ping":
+                result = {"worker_id": worker_id, "pid": os.getpid(), "turns": turns}
+            elif kind == "stats":
+                result = {"turns": turns, "workflow": workflow.get_stats()}
+                if hasattr(workflow.agent, "get_tier_stats"):
+                    result["tiers"] = workflow.agent.get_tier_stats()
+                if getattr(workflow, "tool_admission", None) is not None:
+                    result["tool_admission"] = workflow.tool_admission.get_stats()
+                if getattr(workflow.agent, "admission", None) is not None:
+                    result["llm_admission"] = workflow.agent.admission.get_stats()
+                if getattr(workflow, "verification", None) is not None:
+                    result["verification"] = workflow.verification.get_stats()
+            else:
+                raise ValueError(f"Unknown request kind {kind}")
+            conn.send((request_id, True, result))
+        except Exception as e:
+            conn.send((request_id, False, f"{type(e).__name__}: {str(e)}"))
+    conn.close()
+
+class WorkerUnavailable(Exception):
+    """Raised for requests to a worker that died or was stopped"""
+
+class _Worker:
+    def __init__(self, worker_id: int, process, conn):
+        self.worker_id = worker_id
+        self.process = process
+        self.conn = conn
+        self.send_lock = threading.Lock()
+        self.pending: Dict[int, Future] = {}
+        self.sent_at: Dict[int, float] = {}
+        self.pending_lock = threading.Lock()
+        self.started_at = time.time()
+        self.ready: Optional[Future] = None
+        self.turns = 0
+        self.failures = 0
+
+    def oldest_pending(self) -> Optional[float]:
+        with self.pending_lock:
+            return min(self.sent_at.values(), default=None)
+
+    def fail_pending(self, reason: str):
+        with self.pending_lock:
+            pending, self.pending = self.pending, {}
+            self.sent_at = {}
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(WorkerUnavailable(reason))
+
+# ----------------------------
+# Dispatcher
+# ----------------------------
+class ShardedDispatcher:
+    """Route turns to worker processes by consistent hash of the session ID
+
+    `invoke(state)` has the same contract as MetaCSRWorkflow.invoke, so the app
+    can use either. The factory is called as `factory(worker_id, shards)` and
+    sets up each worker's own limits (tool admission, verification lockouts);
+    context variables of the app process do not cross into workers.
+    """
+
+    def __init__(self,
+                 factory: str = "graph.factory:build_worker_workflow",
+                 workers: int = 2,
+                 replicas: int = 64,
+                 health_interval: float = 5.0,
+                 ping_timeout: float = 5.0,
+                 turn_timeout: float = 120.0,
+                 max_restarts: int = 3,
+                 start_method: str = "spawn"):
+        self.factory = factory
+        self.size = workers
+        self.health_interval = health_interval
+        self.ping_timeout = ping_timeout
+        self.turn_timeout = turn_timeout
+        self.max_restarts = max_restarts
+        self._context = multiprocessing.get_context(start_method)
+        self._ring = HashRing(replicas=replicas)
+        self._workers: Dict[int, _Worker] = {}
+        self._ids = itertools.count()
+        self._lock = threading.RLock()
+        self._stopping = threading.Event()
+        self._health_thread: Optional[threading.Thread] = None
+        self._stats = {"turns": 0, "errors": 0, "restarts": 0, "removed": 0, "rebalances": 0}
+
+    # ---- lifecycle ----
+    def start(self):
+        with self._lock:
+            for worker_id in range(self.size):
+                self._workers[worker_id] = self._spawn(worker_id)
+                self._ring.add(worker_id)
+        self._health_thread = threading.Thread(target=self._health_loop, name="shard-health", daemon=True)
+        self._health_thread.start()
+
+    def _spawn(self, worker_id: int) -> _Worker:
+        parent_conn, child_conn = self._context.Pipe()
+        process = self._context.Process(
+            target=_worker_main,
+            args=(worker_id, self.factory, child_conn, self.size),
+            name=f"csr-shard-{worker_id}",
+            daemon=True
+        )
+        process.start()
+        child_conn.close()
+        worker = _Worker(worker_id, process, parent_conn)
+        threading.Thread(target=self._read_responses, args=(worker,), name=f"shard-reader-{worker_id}",
+                         daemon=True).start()
+        # Answered once the factory has built the workflow; until then the pending
+        # ping marks the worker as busy starting up rather than unhealthy
+        worker.ready = self._request(worker, "ping", None)
+        return worker
+
+    def wait_ready(self, timeout: float = 120.0) -> bool:
+        """Block until every worker has built its workflow"""
+        with self._lock:
+            workers = list(self._workers.values())
+        deadline = time.time() + timeout
+        try:
+            for worker in workers:
+                worker.ready.result(timeout=max(0.0, deadline - time.time()))
+            return True
+        except Exception:
+            return False
+
+    def stop(self, timeout: float = 5.0):
+        self._stopping.set()
+        with self._lock:
+            workers = list(self._workers.values())
+            self._workers.clear()
+        for worker in workers:
+            self._stop_worker(worker, timeout)
+
+    def _stop_worker(self, worker: _Worker, timeout: float):
+        try:
+            with worker.send_lock:
+                worker.conn.send((None, "stop", None))
+        except (OSError, ValueError):
+            pass
+        worker.process.join(timeout)
+        if worker.process.is_alive():
+            worker.process.terminate()
+        worker.fail_pending("worker stopped")
+
+    # ---- IPC ----
+    def _read_responses(self, worker: _Worker):
+        while True:
+            try:
+                request_id, ok, result = worker.conn.recv()
+            except (EOFError, OSError):
+                break
+            with worker.pending_lock:
+                future = worker.pending.pop(request_id, None)
+                worker.sent_at.pop(request_id, None)
+            if future is None:
+                continue
+            if ok:
+                future.set_result(result)
+            else:
+                future.set_exception(RuntimeError(result))
+        worker.fail_pending(f"worker {worker.worker_id} exited")
+
+    def _request(self, worker: _Worker, kind: str, payload: Any) -> Future:
+        future: Future = Future()
+        request_id = next(self._ids)
+        with worker.pending_lock:
+            worker.pending[request_id] = future
+            worker.sent_at[request_id] = time.time()
+        try:
+            with worker.send_lock:
+                worker.conn.send((request_id, kind, payload))
+        except (OSError, ValueError) as e:
+            with worker.pending_lock:
+                worker.pending.pop(request_id, None)
+                worker.sent_at.pop(request_id, None)
+            # The reader may already have failed it when the worker exited
+            if not future.done():
+                future.set_exception(WorkerUnavailable(str(e)))
+        return future
+
+    # ---- routing ----
+    def worker_for(self, session_id: str) -> int:
+        with self._lock:
+            return self._ring.get(session_id or "anonymous")
+
+    def invoke(self, state):
+        """Run one turn on the session's worker and return the new state"""
+        with self._lock:
+            worker = self._workers[self._ring.get(state.session_id or "anonymous")]
+        try:
+            result = self._request(worker, "turn", state).result(timeout=self.turn_timeout)
+        except Exception:
+            with self._lock:
+                self._stats["errors"] += 1
+            raise
+        with self._lock:
+            worker.turns += 1
+            self._stats["turns"] += 1
+        return result
+
+    # ---- health and rebalancing ----
+    def ping(self, worker_id: int) -> bool:
+        """True when the worker is alive and either answers a ping or is busy within the turn timeout"""
+        with self._lock:
+            worker = self._workers.get(worker_id)
+        if worker is None or not worker.process.is_alive():
+            return False
+        # Workers serve one request at a time, so a ping would queue behind a long turn
+        oldest = worker.oldest_pending()
+        if oldest is not None:
+            return time.time() - oldest < self.turn_timeout
+        try:
+            self._request(worker, "ping", None).result(timeout=self.ping_timeout)
+            return True
+        except Exception:
+            return False
+
+    def _health_loop(self):
+        while not self._stopping.wait(self.health_interval):
+            self._check_workers()
+
+    def _check_workers(self):
+        with self._lock:
+            worker_ids = list(self._workers)
+        for worker_id in worker_ids:
+            if self._stopping.is_set():
+                return
+            if self.ping(worker_id):
+                self._recovered(worker_id)
+            else:
+                self._replace(worker_id)
+
+    def _recovered(self, worker_id: int):
+        """Clear the failure count once a (restarted) worker has answered a ping"""
+        with self._lock:
+            worker = self._workers.get(worker_id)
+            if worker is None or not worker.failures:
+                return
+            ready = worker.ready
+            if ready is not None and ready.done() and ready.exception() is None:
+                worker.failures = 0
+
+    def _replace(self, worker_id: int):
+        """Restart an unhealthy worker in place, or drop it from the ring after too many restarts in a row"""
+        with self._lock:
+            worker = self._workers.get(worker_id)
+            if worker is None:
+                return
+            worker.failures += 1
+            if worker.process.is_alive():
+                worker.process.terminate()
+            worker.fail_pending("worker restarted")
+            if worker.failures > self.max_restarts and len(self._workers) > 1:
+                # Its sessions move to the neighbouring workers on the ring
+                del self._workers[worker_id]
+                self._ring.remove(worker_id)
+                self._stats["removed"] += 1
+                print(f"Error: shard worker {worker_id} removed after {worker.failures} failures")
+                return
+            replacement = self._spawn(worker_id)
+            replacement.failures = worker.failures
+            self._workers[worker_id] = replacement
+            self._stats["restarts"] += 1
+
+    def resize(self, workers: int, timeout: float = 5.0):
+        """Grow or shrink the pool; only sessions whose ring position moves change workers"""
+        removed = []
+        with self._lock:
+            # Workers started from here on split limits over the new size; running
+            # workers keep their share until they are restarted
+            self.size = max(workers, 1)
+            while len(self._workers) < workers:
+                worker_id = max(self._workers, default=-1) + 1
+                self._workers[worker_id] = self._spawn(worker_id)
+                self._ring.add(worker_id)
+            while len(self._workers) > max(workers, 1):
+                worker_id = max(self._workers)
+                self._ring.remove(worker_id)
+                removed.append(self._workers.pop(worker_id))
+            self.size = len(self._workers)
+            self._stats["rebalances"] += 1
+        for worker in removed:
+            # Let turns already queued on the worker finish before stopping it
+            deadline = time.time() + timeout
+            while worker.pending and time.time() < deadline:
+                time.sleep(0.05)
+            self._stop_worker(worker, timeout)
+
+    def worker_stats(self, timeout: float = 5.0) -> Dict[int, Any]:
+        """Workflow and model tier stats reported by each worker"""
+        with self._lock:
+            workers = list(self._workers.values())
+        futures = {worker.worker_id: self._request(worker, "stats", None) for worker in workers}
+        stats = {}
+        for worker_id, future in futures.items():
+            try:
+                stats[worker_id] = future.result(timeout=timeout)
+            except Exception as e:
+                stats[worker_id] = {"error": str(e)}
+        return stats
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["workers"] = {
+                worker_id: {
+                    "pid": worker.process.pid,
+                    "alive": worker.process.is_alive(),
+                    "turns": worker.turns,
+                    "in_flight": len(worker.pending),
+                    "failures": worker.failures,
+                    "uptime": round(time.time() - worker.started_at, 1)
+                }
+                for worker_id, worker in self._workers.items()
+            }
+        return stats
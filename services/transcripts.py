@@ -0,0 +1,179 @@
+"""Append-only conversation transcript log and offline columnar export.
+
+Turns are buffered in memory and appended to gzip-compressed JSONL files that
+rotate by size. Each flush appends a new gzip member, which standard gzip
+readers treat as one continuous stream.
+
+Export to Parquet (requires pyarrow):
+    python -m services.transcripts export transcripts/ turns.parquet
+"""
+from typing import Dict, List, Any, Optional, Iterator
+import argparse
+import atexit
+import glob
+import gzip
+import json
+import os
+import threading
+import time
+
+# Columns of a turn record, in export order
+TURN_FIELDS = [
+    ("ts", "float"),
+    ("session_id", "string"),
+    ("customer_id", "string"),
+    ("turn", "int"),
+    ("message", "string"),
+    ("response", "string"),
+    ("intents", "list"),
+    ("sentiment", "float"),
+    ("confidence", "float"),
+    ("model_tier", "string"),
+    ("tools_called", "list"),
+    ("latency_ms", "float"),
+    ("llm_latency_ms", "float"),
+    ("input_tokens", "int"),
+    ("output_tokens", "int"),
+    ("cached_tokens", "int"),
+    ("escalated", "bool"),
+    ("shed_reason", "string"),
+    ("error", "string")
+]
+
+class TranscriptWriter:
+    """Buffered, size-rotated, gzip-compressed JSONL writer for turn records"""
+
+    def __init__(self,
+                 directory: str,
+                 buffer_size: int = 100,
+                 flush_interval: float = 5.0,
+                 max_bytes: int = 64 * 1024 * 1024,
+                 compresslevel: int = 6):
+        self.directory = directory
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.compresslevel = compresslevel
+        self._buffer: List[str] = []
+        self._lock = threading.Lock()
+        self._path: Optional[str] = None
+        self._file_index = 0
+        self._stats = {"records": 0, "flushes": 0, "files": 0, "bytes": 0}
+        self._closed = threading.Event()
+        os.makedirs(directory, exist_ok=True)
+        self._flusher = threading.Thread(target=self._flush_periodically, name="transcript-flush", daemon=True)
+        self._flusher.start()
+        atexit.register(self.close)
+
+    def _new_path(self) -> str:
+        self._file_index += 1
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        return os.path.join(self.directory, f"transcripts-{stamp}-{os.getpid()}-{self._file_index:04d}.jsonl.gz")
+
+    def write(self, record: Dict[str, Any]):
+        """Buffer one turn record; flushes when the buffer is full"""
+        line = json.dumps(record, separators=(",", ":"), default=str)
+        with self._lock:
+            self._buffer.append(line)
+            self._stats["records"] += 1
+            full = len(self._buffer) >= self.buffer_size
+        if full:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            if not self._buffer:
+                return
+            lines, self._buffer = self._buffer, []
+            if self._path is None or os.path.getsize(self._path) >= self.max_bytes:
+                self._path = self._new_path()
+                self._stats["files"] += 1
+            data = ("\n".join(lines) + "\n").encode("utf-8")
+            with gzip.open(self._path, "ab", compresslevel=self.compresslevel) as f:
+                f.write(data)
+            self._stats["flushes"] += 1
+            self._stats["bytes"] += len(data)
+
+    def _flush_periodically(self):
+        while not self._closed.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error flushing transcripts: {str(e)}")
+
+    def close(self):
+        if not self._closed.is_set():
+            self._closed.set()
+            self.flush()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["buffered"] = len(self._buffer)
+            stats["current_file"] = self._path
+        return stats
+
+# ----------------------------
+# Offline export
+# ----------------------------
+def iter_records(directory: str) -> Iterator[Dict[str, Any]]:
+    """Stream turn records from every transcript file, oldest first"""
+    for path in sorted(glob.glob(os.path.join(directory, "*.jsonl.gz")), key=os.path.getmtime):
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+def export_parquet(directory: str, output_path: str, batch_size: int = 50_000) -> int:
+    """Convert transcripts to a Parquet file in bounded-memory batches; returns the row count"""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise RuntimeError("Parquet export requires pyarrow: pip install pyarrow") from e
+
+    types = {
+        "float": pa.float64(),
+        "string": pa.string(),
+        "int": pa.int64(),
+        "list": pa.list_(pa.string()),
+        "bool": pa.bool_()
+    }
+    schema = pa.schema([(name, types[kind]) for name, kind in TURN_FIELDS])
+    rows = 0
+    columns: Dict[str, List] = {name: [] for name, _ in TURN_FIELDS}
+    with pq.ParquetWriter(output_path, schema, compression="zstd") as writer:
+        def write_batch():
+            writer.write_table(pa.table(columns, schema=schema))
+            for values in columns.values():
+                values.clear()
+
+        for record in iter_records(directory):
+            for name, kind in TURN_FIELDS:
+                value = record.get(name)
+                if kind == "list" and isinstance(value, dict):
+                    value = list(value)
+                columns[name].append(value)
+            rows += 1
+            if rows % batch_size == 0:
+                write_batch()
+        if columns["ts"]:
+            write_batch()
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description="Transcript log utilities")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    export = subcommands.add_parser("export", help="Convert transcripts to Parquet")
+    export.add_argument("directory")
+    export.add_argument("output")
+    export.add_argument("--batch-size", type=int, default=50_000)
+    args = parser.parse_args()
+
+    if args.command == "export":
+        started = time.perf_counter()
+        rows = export_parquet(args.directory, args.output, args.batch_size)
+        print(f"Exported {rows} turns to {args.output} in {time.perf_counter() - started:.1f}s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+from typing import Dict, Optional, Tuple, Callable, Any
+from dataclasses import dataclass
+import sqlite3
+import threading
+import time
+import uuid
+
+from tools.tools import ActionResult, INVALID_CREDENTIALS
+
+# ----------------------------
+# Failed-attempt stores
+# ----------------------------
+# (failures, locked_until, last_failure, in_flight, reserved_at) of a customer with no attempts
+_NO_ATTEMPTS = (0, 0.0, 0.0, 0, 0.0)
+
+def _reserve_attempt(row: Tuple, now: float, free_attempts: int, window: float, lease: float) -> Optional[Tuple]:
+    """`row` with one more attempt in flight, or None when the attempt has to be refused
+
+    Attempts still in flight count against the free attempts left, so a burst of
+    concurrent guesses cannot all reach the backend before the first failure is
+    recorded. Once the free attempts are used up, one attempt at a time is let through.
+    """
+    failures, locked_until, last_failure, in_flight, reserved_at = row
+    if locked_until > now:
+        return None
+    if now - last_failure > window:
+        failures = 0
+    if now - reserved_at > lease:
+        # Reservations of a process that died mid-check
+        in_flight = 0
+    if in_flight >= max(1, free_attempts - failures):
+        return None
+    return (failures, locked_until, last_failure, in_flight + 1, now)
+
+def _settle_attempt(row: Tuple, now: float, outcome: str, backoff: Callable[[int], float], window: float) -> Tuple:
+    """`row` after an attempt in flight ended: outcome is failure, success or error"""
+    failures, locked_until, last_failure, in_flight, reserved_at = row
+    in_flight = max(0, in_flight - 1)
+    if outcome == "success":
+        return (0, 0.0, 0.0, in_flight, reserved_at)
+    if outcome == "failure":
+        failures = 1 if now - last_failure > window else failures + 1
+        return (failures, now + backoff(failures), now, in_flight, reserved_at)
+    return (failures, locked_until, last_failure, in_flight, reserved_at)
+
+class InMemoryAttemptStore:
+    """Failed and in-flight attempts per customer ID, shared by all sessions of this process"""
+
+    def __init__(self):
+        self._attempts: Dict[str, Tuple] = {}
+        self._lock = threading.Lock()
+
+    def get(self, customer_id: str) -> Tuple[int, float, float]:
+        """(failures, locked_until, last_failure) for a customer"""
+        with self._lock:
+            return self._attempts.get(customer_id, _NO_ATTEMPTS)[:3]
+
+    def reserve(self, customer_id: str, free_attempts: int, window: float, lease: float) -> bool:
+        """Count an attempt as in flight; False when the customer is locked out or has too many in flight"""
+        now = time.time()
+        with self._lock:
+            row = _reserve_attempt(self._attempts.get(customer_id, _NO_ATTEMPTS), now, free_attempts, window, lease)
+            if row is None:
+                return False
+            self._attempts[customer_id] = row
+        return True
+
+    def settle(self, customer_id: str, outcome: str, backoff: Callable[[int], float], window: float) -> Tuple[int, float]:
+        """End an attempt reserved with `reserve`; returns (failures, locked_until)"""
+        now = time.time()
+        with self._lock:
+            row = _settle_attempt(self._attempts.get(customer_id, _NO_ATTEMPTS), now, outcome, backoff, window)
+            if row == _NO_ATTEMPTS:
+                self._attempts.pop(customer_id, None)
+            else:
+                self._attempts[customer_id] = row
+        return row[0], row[1]
+
+class SqliteAttemptStore:
+    """Failed and in-flight attempts in a SQLite file, shared by every process on the host"""
+
+    COLUMNS = ("failures", "locked_until", "last_failure", "in_flight", "reserved_at")
+
+    def __init__(self, path: str):
+        self._conn = sqlite3.connect(path, timeout=5.0, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS verification_attempts ("
+            "customer_id TEXT PRIMARY KEY, failures INTEGER, locked_until REAL, last_failure REAL, "
+            "in_flight INTEGER DEFAULT 0, reserved_at REAL DEFAULT 0)"
+        )
+        # Files written before attempts were reserved lack the in-flight columns
+        existing = {row[1] for row in self._conn.execute("PRAGMA table_info(verification_attempts)")}
+        for column, kind in (("in_flight", "INTEGER"), ("reserved_at", "REAL")):
+            if column not in existing:
+                self._conn.execute(f"ALTER TABLE verification_attempts ADD COLUMN {column} {kind} DEFAULT 0")
+        self._lock = threading.Lock()
+
+    def _row(self, customer_id: str) -> Tuple:
+        row = self._conn.execute(
+            f"SELECT {', '.join(self.COLUMNS)} FROM verification_attempts WHERE customer_id = ?",
+            (customer_id,)
+        ).fetchone()
+        return tuple(row) if row else _NO_ATTEMPTS
+
+    def get(self, customer_id: str) -> Tuple[int, float, float]:
+        with self._lock:
+            return self._row(customer_id)[:3]
+
+    def _update(self, customer_id: str, change: Callable[[Tuple], Optional[Tuple]]) -> Optional[Tuple]:
+        """Read-modify-write a customer's row in one transaction"""
+        with self._lock:
+            # IMMEDIATE takes the write lock up front so concurrent processes serialize
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = change(self._row(customer_id))
+                if row is not None:
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO verification_attempts VALUES (?, ?, ?, ?, ?, ?)",
+                        (customer_id,) + row
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return row
+
+    def reserve(self, customer_id: str, free_attempts: int, window: float, lease: float) -> bool:
+        now = time.time()
+        return self._update(customer_id, lambda row: _reserve_attempt(row, now, free_attempts, window, lease)) is not None
+
+    def settle(self, customer_id: str, outcome: str, backoff: Callable[[int], float], window: float) -> Tuple[int, float]:
+        now = time.time()
+        row = self._update(customer_id, lambda row: _settle_attempt(row, now, outcome, backoff, window))
+        return row[0], row[1]
+
+# ----------------------------
+# Verification Service
+# ----------------------------
+@dataclass
+class VerificationToken:
+    token: str
+    customer_id: str
+    user_info: Dict[str, Any]
+    expires_at: float
+
+class VerificationService:
+    """Identity verification with per-session token caching and brute-force throttling
+
+    A successful check issues a short-lived token for the session so later turns
+    skip the auth backend. Rejected credentials are counted per customer ID in a
+    shared store; after `free_attempts` each further rejection locks the ID out for
+    an exponentially growing delay, during which checks are refused without calling
+    the backend. Each check is reserved in the store before the backend is called,
+    so concurrent checks for one ID never exceed the free attempts left. Backend
+    errors, timeouts and admission rejections are returned as-is and never count
+    towards a lockout.
+    """
+
+    def __init__(self,
+                 verify_fn: Callable[[str, str], ActionResult],
+                 store=None,
+                 token_ttl: float = 600.0,
+                 free_attempts: int = 3,
+                 base_delay: float = 2.0,
+                 max_delay: float = 900.0,
+                 failure_window: float = 3600.0,
+                 attempt_lease: float = 60.0):
+        self.verify_fn = verify_fn
+        self.store = store or InMemoryAttemptStore()
+        self.token_ttl = token_ttl
+        self.free_attempts = free_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.failure_window = failure_window
+        # How long an attempt counts as in flight if its process never settles it
+        self.attempt_lease = attempt_lease
+        self._tokens: Dict[str, VerificationToken] = {}
+        self._lock = threading.Lock()
+        self._stats = {"token_hits": 0, "backend_calls": 0, "failures": 0, "errors": 0, "throttled": 0}
+
+    def _backoff(self, failures: int) -> float:
+        if failures < self.free_attempts:
+            return 0.0
+        return min(self.max_delay, self.base_delay * 2 ** (failures - self.free_attempts))
+
+    def cached(self, session_id: Optional[str]) -> Optional[VerificationToken]:
+        """The session's verification token, if still valid"""
+        if not session_id:
+            return None
+        with self._lock:
+            token = self._tokens.get(session_id)
+            if token is None:
+                return None
+            if token.expires_at <= time.time():
+                del self._tokens[session_id]
+                return None
+            self._stats["token_hits"] += 1
+            return token
+
+    def invalidate(self, session_id: str):
+        with self._lock:
+            self._tokens.pop(session_id, None)
+
+    def verify(self, session_id: Optional[str], customer_id: str, password: str) -> ActionResult:
+        """Check credentials unless the customer ID is locked out or has too many checks in flight"""
+        now = time.time()
+        if not self.store.reserve(customer_id, self.free_attempts, self.failure_window, self.attempt_lease):
+            with self._lock:
+                self._stats["throttled"] += 1
+            _, locked_until, _ = self.store.get(customer_id)
+            wait = int(locked_until - now) + 1 if locked_until > now else 1
+            return ActionResult(
+                success=False,
+                message=f"Too many failed attempts. Please try again in {wait} seconds.",
+                error="locked_out"
+            )
+
+        with self._lock:
+            self._stats["backend_calls"] += 1
+        try:
+            result = self.verify_fn(customer_id, password)
+        except Exception:
+            self.store.settle(customer_id, "error", self._backoff, self.failure_window)
+            raise
+        if result.success:
+            self.store.settle(customer_id, "success", self._backoff, self.failure_window)
+            user_info = (result.data or {}).get("user_info", {})
+            token = VerificationToken(uuid.uuid4().hex, customer_id, user_info, now + self.token_ttl)
+            if session_id:
+                with self._lock:
+                    self._tokens[session_id] = token
+                    # Opportunistically drop expired tokens
+                    for key in [k for k, t in self._tokens.items() if t.expires_at <= now]:
+                        del self._tokens[key]
+            result.data = {**(result.data or {}), "token": token.token}
+            return result
+
+        if result.error != INVALID_CREDENTIALS:
+            # The check itself failed; the customer may well have the right password
+            self.store.settle(customer_id, "error", self._backoff, self.failure_window)
+            with self._lock:
+                self._stats["errors"] += 1
+            return result
+
+        self.store.settle(customer_id, "failure", self._backoff, self.failure_window)
+        with self._lock:
+            self._stats["failures"] += 1
+        return result
+
+    def get_stats(self) -> Dict[str, int]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["active_tokens"] = len(self._tokens)
+        return stats
@@ -0,0 +1,215 @@
+from typing import Dict, List, Any, Optional, Callable
+from collections import deque
+from dataclasses import dataclass, field, asdict
+import atexit
+import heapq
+import itertools
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+
+@dataclass
+class WorkItem:
+    kind: str
+    payload: Dict[str, Any]
+    id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    attempts: int = 0
+    submitted_at: float = field(default_factory=time.time)
+    last_error: Optional[str] = None
+
+class WriteBehindQueue:
+    """Background queue for fire-and-forget writes (feedback, callbacks, emails)
+
+    `submit` acknowledges immediately. Worker threads take items one at a time and
+    call the handler registered for each item's kind; failures are retried with
+    exponential backoff and end up in a JSONL dead-letter file after
+    `max_retries`. With `spool_dir` set, every accepted item is written to disk
+    until it is done, so a restart picks up unfinished work.
+    """
+
+    def __init__(self,
+                 handlers: Optional[Dict[str, Callable[[Dict[str, Any]], Any]]] = None,
+                 workers: int = 2,
+                 poll_interval: float = 0.5,
+                 max_retries: int = 3,
+                 retry_backoff: float = 1.0,
+                 spool_dir: Optional[str] = None,
+                 dead_letter_path: str = "dead_letter.jsonl",
+                 max_depth: int = 10000):
+        self.handlers = dict(handlers or {})
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.spool_dir = spool_dir
+        self.dead_letter_path = dead_letter_path
+        self.max_depth = max_depth
+        self._ready: "queue.Queue[WorkItem]" = queue.Queue()
+        self._delayed: List = []
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._threads: List[threading.Thread] = []
+        self._stopping = threading.Event()
+        self._handler_latencies: deque = deque(maxlen=256)
+        self._item_latencies: deque = deque(maxlen=256)
+        self._stats = {"submitted": 0, "completed": 0, "failed_attempts": 0, "retried": 0,
+                       "dead_lettered": 0, "rejected": 0, "recovered": 0}
+        if spool_dir:
+            os.makedirs(spool_dir, exist_ok=True)
+
+    def register(self, kind: str, handler: Callable[[Dict[str, Any]], Any]):
+        self.handlers[kind] = handler
+
+    # ---- lifecycle ----
+    def start(self):
+        if self._threads:
+            return
+        self._recover_spool()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"write-behind-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        atexit.register(self.stop)
+
+    def stop(self, timeout: float = 5.0):
+        """Drain outstanding work (up to `timeout`) and stop the workers"""
+        deadline = time.time() + timeout
+        while self.depth() and time.time() < deadline:
+            time.sleep(0.05)
+        self._stopping.set()
+        for thread in self._threads:
+            thread.join(timeout=max(0.0, deadline - time.time()))
+        self._threads = []
+
+    # ---- producer side ----
+    def submit(self, kind: str, payload: Dict[str, Any]) -> Optional[str]:
+        """Accept a write for background processing; returns its id, or None if the queue is full"""
+        if kind not in self.handlers:
+            raise ValueError(f"No write-behind handler registered for {kind}")
+        if self.depth() >= self.max_depth:
+            with self._lock:
+                self._stats["rejected"] += 1
+            return None
+        item = WorkItem(kind=kind, payload=payload)
+        self._spool(item)
+        with self._lock:
+            self._stats["submitted"] += 1
+        self._ready.put(item)
+        return item.id
+
+    def depth(self) -> int:
+        with self._lock:
+            return self._ready.qsize() + len(self._delayed) + self._in_flight
+
+    # ---- spool ----
+    def _spool_path(self, item: WorkItem) -> str:
+        return os.path.join(self.spool_dir, f"{item.id}.json")
+
+    def _spool(self, item: WorkItem):
+        if not self.spool_dir:
+            return
+        path = self._spool_path(item)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(asdict(item), f, default=str)
+        os.replace(path + ".tmp", path)
+
+    def _unspool(self, item: WorkItem):
+        if self.spool_dir:
+            try:
+                os.remove(self._spool_path(item))
+            except FileNotFoundError:
+                pass
+
+    def _recover_spool(self):
+        if not self.spool_dir:
+            return
+        items = []
+        for filename in os.listdir(self.spool_dir):
+            if not filename.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.spool_dir, filename), "r", encoding="utf-8") as f:
+                    items.append(WorkItem(**json.load(f)))
+            except Exception as e:
+                print(f"Error recovering spooled item {filename}: {str(e)}")
+        for item in sorted(items, key=lambda i: i.submitted_at):
+            self._ready.put(item)
+        with self._lock:
+            self._stats["recovered"] += len(items)
+
+    # ---- consumer side ----
+    def _promote_due(self):
+        now = time.time()
+        with self._lock:
+            while self._delayed and self._delayed[0][0] <= now:
+                _, _, item = heapq.heappop(self._delayed)
+                self._ready.put(item)
+
+    def _next_item(self) -> Optional[WorkItem]:
+        self._promote_due()
+        try:
+            item = self._ready.get(timeout=self.poll_interval)
+        except queue.Empty:
+            return None
+        with self._lock:
+            self._in_flight += 1
+        return item
+
+    def _worker(self):
+        while not self._stopping.is_set():
+            item = self._next_item()
+            if item is None:
+                continue
+            started = time.time()
+            self._process(item)
+            with self._lock:
+                self._in_flight -= 1
+                self._handler_latencies.append(time.time() - started)
+
+    def _process(self, item: WorkItem):
+        item.attempts += 1
+        try:
+            result = self.handlers[item.kind](item.payload)
+            # Tools report failure through ActionResult rather than raising
+            if getattr(result, "success", True) is False:
+                raise RuntimeError(getattr(result, "error", None) or getattr(result, "message", "failed"))
+        except Exception as e:
+            item.last_error = str(e)
+            with self._lock:
+                self._stats["failed_attempts"] += 1
+            if item.attempts < self.max_retries:
+                delay = self.retry_backoff * 2 ** (item.attempts - 1)
+                self._spool(item)
+                with self._lock:
+                    self._stats["retried"] += 1
+                    heapq.heappush(self._delayed, (time.time() + delay, next(self._seq), item))
+            else:
+                self._dead_letter(item)
+            return
+        self._unspool(item)
+        with self._lock:
+            self._stats["completed"] += 1
+            self._item_latencies.append(time.time() - item.submitted_at)
+
+    def _dead_letter(self, item: WorkItem):
+        record = {**asdict(item), "dead_lettered_at": time.time()}
+        with self._lock:
+            with open(self.dead_letter_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, default=str) + "\n")
+            self._stats["dead_lettered"] += 1
+        self._unspool(item)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            handler = sorted(self._handler_latencies)
+            items = sorted(self._item_latencies)
+        stats["depth"] = self.depth()
+        stats["handler_latency_avg"] = sum(handler) / len(handler) if handler else 0.0
+        stats["handler_latency_p95"] = handler[int(len(handler) * 0.95)] if handler else 0.0
+        stats["item_latency_p95"] = items[int(len(items) * 0.95)] if items else 0.0
+        return stats
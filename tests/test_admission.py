@@ -0,0 +1,124 @@
+import threading
+
+import pytest
+
+from services.admission import AdmissionController, AdmissionRejected, TokenBucket
+
+def controller(**overrides):
+    # Near-zero refill so bucket contents only change when the test takes tokens
+    limits = dict(session_rate=0.001, session_burst=2, customer_rate=0.001, customer_burst=3,
+                  global_rate=0.001, global_burst=100, max_queue=10, max_wait=0.05)
+    limits.update(overrides)
+    return AdmissionController(**limits)
+
+def test_token_bucket_refills_up_to_capacity():
+    bucket = TokenBucket(rate=2.0, capacity=4)
+    bucket.take(4)
+    assert not bucket.available(1, now=bucket.updated)
+    assert bucket.available(1, now=bucket.updated + 0.5)
+    assert bucket.available(4, now=bucket.updated + 100)
+    assert bucket.tokens == 4
+
+def test_session_burst_is_enforced_per_session():
+    admission = controller()
+    assert admission.admit("s1", "c1").admitted
+    assert admission.admit("s1", "c1").admitted
+    decision = admission.admit("s1", "c1")
+    assert not decision.admitted and decision.reason == "session_rate"
+    # Another session of a different customer is unaffected
+    assert admission.admit("s2", "c2").admitted
+    assert admission.get_stats()["rejected_session"] == 1
+
+def test_customer_burst_spans_sessions():
+    admission = controller()
+    assert admission.admit("s1", "c1").admitted
+    assert admission.admit("s2", "c1").admitted
+    assert admission.admit("s3", "c1").admitted
+    decision = admission.admit("s4", "c1")
+    assert not decision.admitted and decision.reason == "customer_rate"
+
+def test_rejected_call_does_not_consume_tokens():
+    admission = controller(customer_burst=1)
+    assert admission.admit("s1", "c1").admitted
+    assert not admission.admit("s1", "c1").admitted
+    # The session bucket was not charged for the customer rejection
+    assert admission._sessions["s1"].tokens == pytest.approx(1, abs=0.01)
+
+def test_global_bucket_sheds_after_max_wait():
+    admission = controller(global_burst=1)
+    assert admission.admit("s1").admitted
+    decision = admission.admit("s2")
+    assert not decision.admitted and decision.reason == "over_capacity"
+    assert decision.waited >= 0.05
+    assert admission.get_stats()["queue_depth"] == 0
+
+def test_queue_full_rejects_without_waiting():
+    admission = controller(global_burst=1, max_queue=0)
+    assert admission.admit("s1").admitted
+    assert admission.admit("s2").reason == "queue_full"
+
+def test_waiter_is_admitted_once_global_tokens_refill():
+    admission = controller(global_rate=50.0, global_burst=1, max_wait=1.0)
+    assert admission.admit("s1").admitted
+    decision = admission.admit("s2")
+    assert decision.admitted and decision.waited > 0
+
+def test_admit_current_charges_the_scoped_session():
+    admission = controller(session_burst=1)
+    with admission.scope("s1", "c1"):
+        admission.admit_current()
+        with pytest.raises(AdmissionRejected) as excinfo:
+            admission.admit_current()
+    assert excinfo.value.reason == "session_rate"
+    # Outside the scope calls are only charged globally
+    admission.admit_current()
+
+def test_scope_is_isolated_per_thread():
+    admission = controller(session_burst=1)
+    errors = []
+
+    def turn(session_id):
+        with admission.scope(session_id):
+            try:
+                admission.admit_current()
+            except AdmissionRejected as e:
+                errors.append(e)
+
+    threads = [threading.Thread(target=turn, args=(f"s{i}",)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert admission.get_stats()["admitted"] == 4
+
+def test_queued_waiters_count_against_session_limit():
+    # Global bucket empty and refilling slowly: every caller has to queue
+    admission = controller(session_burst=2, global_burst=1, global_rate=20.0, max_queue=50, max_wait=2.0)
+    assert admission.admit("warmup").admitted
+    decisions = []
+    lock = threading.Lock()
+
+    def call():
+        decision = admission.admit("s1", "c1")
+        with lock:
+            decisions.append(decision)
+
+    threads = [threading.Thread(target=call) for _ in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    admitted = [d for d in decisions if d.admitted]
+    assert len(admitted) == 2
+    assert sum(d.reason == "session_rate" for d in decisions) == 18
+    assert admission._sessions["s1"].tokens >= -0.01
+    assert admission._customers["c1"].tokens >= 1 - 0.01
+
+def test_timed_out_waiter_gets_its_session_tokens_back():
+    admission = controller(session_burst=1, global_burst=1)
+    assert admission.admit("warmup").admitted
+    decision = admission.admit("s1", "c1")
+    assert not decision.admitted and decision.reason == "over_capacity"
+    assert admission._sessions["s1"].tokens == pytest.approx(1, abs=0.01)
+    assert admission._customers["c1"].tokens == pytest.approx(3, abs=0.01)
@@ -0,0 +1,92 @@
+import os
+
+import pytest
+
+pytest.importorskip("numpy")
+
+from tools.knowledge_base import KnowledgeBase
+
+ARTICLES = {
+    "account/password.md": "# Reset your password\nUse the forgot password link to reset your password.",
+    "account/email.md": "# Change your email\nUpdate the email address on your profile page.",
+    "shipping/times.md": "# Shipping times\nStandard shipping takes five business days.",
+    "shipping/international.md": "# International shipping\nWe ship to most countries worldwide.",
+    "billing/refunds.md": "# Refund policy\nRefunds are issued to the original payment method."
+}
+
+def write(root, rel_path, text):
+    path = os.path.join(root, rel_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+    # Distinct mtimes so refresh sees the change even on coarse clocks
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+@pytest.fixture
+def kb(tmp_path):
+    articles = str(tmp_path / "articles")
+    for rel_path, text in ARTICLES.items():
+        write(articles, rel_path, text)
+    # BM25 only, and never compact so changes stay in the delta segment
+    kb = KnowledgeBase(str(tmp_path / "index"), articles_dir=articles, use_embeddings=False, compact_ratio=100)
+    kb.refresh()
+    yield kb
+    kb.close()
+
+def ids(results):
+    return [r["id"] for r in results]
+
+def test_build_indexes_all_articles(kb):
+    assert kb.doc_count == len(ARTICLES)
+    assert ids(kb.search("reset password"))[0] == os.path.join("account", "password.md")
+
+def test_category_filter(kb):
+    results = kb.search("shipping", category="shipping")
+    assert set(ids(results)) == {os.path.join("shipping", "times.md"), os.path.join("shipping", "international.md")}
+    assert kb.search("password", category="billing") == []
+
+def test_updated_article_is_served_from_delta_only(kb):
+    rel_path = os.path.join("shipping", "times.md")
+    write(kb.articles_dir, rel_path, "# Shipping times\nExpress delivery arrives overnight.")
+    assert kb.refresh() == {"added": 0, "updated": 1, "deleted": 0, "compacted": 0}
+    assert kb.doc_count == len(ARTICLES)
+    results = kb.search("express overnight delivery")
+    assert ids(results)[0] == rel_path
+    # The tombstoned base version no longer matches its old text
+    assert rel_path not in ids(kb.search("standard business days"))
+
+def test_added_and_deleted_articles(kb):
+    write(kb.articles_dir, os.path.join("billing", "invoices.md"), "# Invoices\nDownload invoices from your orders page.")
+    os.remove(os.path.join(kb.articles_dir, "billing", "refunds.md"))
+    assert kb.refresh() == {"added": 1, "updated": 0, "deleted": 1, "compacted": 0}
+    assert ids(kb.search("invoices")) == [os.path.join("billing", "invoices.md")]
+    assert kb.search("refund policy") == []
+
+def test_base_and_delta_scores_share_one_scale(kb):
+    write(kb.articles_dir, os.path.join("account", "password_help.md"),
+          "# Password help\nIf you forgot your password, reset your password from the login page.")
+    kb.refresh()
+    results = kb.search("reset password", top_k=5)
+    assert {os.path.join("account", "password.md"), os.path.join("account", "password_help.md")} <= set(ids(results[:2]))
+    # Normalized once over both segments: exactly one best hit, all within (0, 1]
+    assert max(r["relevance"] for r in results) == 1.0
+    assert all(0 < r["relevance"] <= 1.0 for r in results)
+
+def test_filtered_delta_hit_does_not_rescale_base_results(kb):
+    before = kb.search("shipping", category="shipping")
+    # A much stronger match outside the requested category
+    write(kb.articles_dir, os.path.join("billing", "shipping_fees.md"),
+          "# Shipping fees\nShipping shipping shipping costs are shown at checkout.")
+    kb.refresh()
+    after = kb.search("shipping", category="shipping")
+    assert [(r["id"], r["relevance"]) for r in after] == [(r["id"], r["relevance"]) for r in before]
+
+def test_refresh_reopens_after_restart(kb):
+    write(kb.articles_dir, os.path.join("shipping", "times.md"), "# Shipping times\nExpress delivery arrives overnight.")
+    kb.refresh()
+    reopened = KnowledgeBase(kb.index_dir, articles_dir=kb.articles_dir, use_embeddings=False, compact_ratio=100)
+    try:
+        assert ids(reopened.search("express overnight"))[0] == os.path.join("shipping", "times.md")
+    finally:
+        reopened.close()
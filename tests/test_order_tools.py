@@ -0,0 +1,92 @@
+import pytest
+
+import tools.tools as tools_module
+from tools.tools import MetaCSRTools, OrderNotFound, fetch_order_status, fetch_order_statuses
+
+class StubBackend(MetaCSRTools):
+    """Order endpoints answered from `owners` (order number -> customer ID); records every call"""
+
+    def __init__(self, owners, batch_response=None, **kwargs):
+        super().__init__(api_base_url="http://backend", api_key="key", **kwargs)
+        self.owners = owners
+        # Replaces the batch endpoint's answer, e.g. an HTTP error
+        self.batch_response = batch_response
+        self.calls = []
+
+    def _order(self, order_number):
+        return {"order_number": order_number, "customer_id": self.owners.get(order_number), "status": "shipped"}
+
+    def _mock_api_call(self, method, endpoint, data=None):
+        self.calls.append((endpoint, data))
+        if endpoint == "/orders/status/batch":
+            if self.batch_response is not None:
+                return self.batch_response
+            return {"orders": [self._order(n) for n in data["order_numbers"] if n in self.owners]}
+        if endpoint.startswith("/orders/") and endpoint.endswith("/status"):
+            return self._order(endpoint.split("/")[2])
+        return super()._mock_api_call(method, endpoint, data)
+
+    def endpoints(self):
+        return [endpoint for endpoint, _ in self.calls]
+
+OWNERS = {"A1": "USER1", "A2": "USER1", "A3": "USER1", "A4": "USER1", "A5": "USER1", "B1": "USER2"}
+
+def test_batch_lookup_deduplicates_and_chunks():
+    backend = StubBackend(OWNERS)
+    orders = backend.get_order_statuses(["A1", " A1 ", "A2", "A3", "A4", "A5", "A2"], "USER1", chunk_size=2)
+    assert list(orders) == ["A1", "A2", "A3", "A4", "A5"]
+    assert [data["order_numbers"] for _, data in backend.calls] == [["A1", "A2"], ["A3", "A4"], ["A5"]]
+
+def test_batch_and_single_lookups_share_the_customer_cache():
+    backend = StubBackend(OWNERS)
+    backend.get_order_statuses(["A1", "A2"], "USER1")
+    assert backend.get_order_status("A1", "USER1")["status"] == "shipped"
+    assert backend.get_order_statuses(["A2"], "USER1")
+    assert len(backend.calls) == 1
+
+def test_cache_entry_is_never_served_to_another_customer():
+    backend = StubBackend(OWNERS)
+    backend.get_order_status("A1", "USER1")
+    with pytest.raises(OrderNotFound):
+        backend.get_order_status("A1", "USER2")
+    # USER2's lookup went to the backend instead of reading USER1's entry
+    assert backend.endpoints() == ["/orders/A1/status", "/orders/A1/status"]
+
+def test_orders_of_other_customers_are_left_out():
+    backend = StubBackend(OWNERS)
+    orders = backend.get_order_statuses(["A1", "B1", "Z9"], "USER1")
+    assert list(orders) == ["A1"]
+    with pytest.raises(OrderNotFound):
+        backend.get_order_status("B1", "USER1")
+
+def test_missing_batch_endpoint_falls_back_to_single_calls():
+    backend = StubBackend(OWNERS, batch_response={"status_code": 404, "error": "Not Found"})
+    orders = backend.get_order_statuses(["A1", "B1"], "USER1")
+    assert list(orders) == ["A1"]
+    assert backend.supports_batch_orders is False
+    assert backend.endpoints()[0] == "/orders/status/batch"
+    assert sorted(backend.endpoints()[1:]) == ["/orders/A1/status", "/orders/B1/status"]
+    # Later lookups skip the batch endpoint
+    backend.get_order_statuses(["A2"], "USER1")
+    assert backend.endpoints()[-1] == "/orders/A2/status"
+
+def test_other_batch_errors_are_raised():
+    backend = StubBackend(OWNERS, batch_response={"status_code": 500, "error": "Internal Server Error"})
+    with pytest.raises(ValueError, match="Internal Server Error"):
+        backend.get_order_statuses(["A1"], "USER1")
+    assert backend.supports_batch_orders is True
+
+def test_mock_backend_without_batch_endpoint():
+    backend = MetaCSRTools(api_base_url="http://backend", api_key="key", mock_batch_orders=False)
+    orders = backend.get_order_statuses(["A1", "A2"], "USER1")
+    assert sorted(orders) == ["A1", "A2"]
+    assert backend.supports_batch_orders is False
+
+def test_order_tools_report_other_customers_orders_as_not_found(monkeypatch):
+    monkeypatch.setattr(tools_module, "_meta_csr_tools", StubBackend(OWNERS))
+    result = fetch_order_statuses(["A1", "B1"], user_id="USER1")
+    assert result.success
+    assert [o["order_number"] for o in result.data["orders"]] == ["A1"]
+    assert result.data["not_found"] == ["B1"]
+    result = fetch_order_status("B1", user_id="USER1")
+    assert not result.success and result.error == "Order B1 not found"
@@ -0,0 +1,100 @@
+from typing import List
+
+import pytest
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from agents.output_budget import DEFAULT_STOP, OutputBudget, OutputBudgetPolicy
+
+ANSWER = "Your order shipped on Monday. It is with the carrier. Delivery is expected Friday. Anything else? Best wishes."
+
+class WordStreamModel(BaseChatModel):
+    """Streams a fixed answer word by word and counts the chunks actually pulled"""
+
+    text: str = ANSWER
+    streamed: List[str] = []
+
+    @property
+    def _llm_type(self) -> str:
+        return "word-stream"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self.text))])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        for i, word in enumerate(self.text.split(" ")):
+            self.streamed.append(word)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=word if i == 0 else " " + word))
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+@pytest.mark.parametrize("text, sentences, expected", [
+    ("One. Two. Three.", 2, "One. Two."),
+    ("One. Two. Three", 3, None),
+    ("Done! Really? Yes. ", 2, "Done! Really?"),
+    # List markers and decimals are not sentence ends
+    ("Steps: 1. Open settings 2. Tap reset. Then wait.", 1, "Steps: 1. Open settings 2. Tap reset."),
+    ("It costs 4.99 today. Thanks.", 1, "It costs 4.99 today."),
+    # The last sentence only counts once the next word has started
+    ("One. Two.", 2, None),
+    ("", 1, None)
+])
+def test_complete_prefix(text, sentences, expected):
+    assert OutputBudgetPolicy.complete_prefix(text, sentences) == expected
+
+def test_select_combines_intents_under_ceiling():
+    policy = OutputBudgetPolicy()
+    single = policy.select({"order_status": True}, ceiling=1024)
+    assert single == OutputBudget(max_tokens=160, max_sentences=3, stop=DEFAULT_STOP)
+    combined = policy.select({"order_status": True, "billing": True}, ceiling=1024)
+    assert combined.max_tokens == 320 + policy.extra_intent_tokens
+    assert combined.max_sentences == 8
+    assert policy.select({"billing": True}, ceiling=100).max_tokens == 100
+    assert policy.select({}, ceiling=1024) == policy.default
+
+def test_select_without_sentence_limit_disables_early_stop():
+    policy = OutputBudgetPolicy(budgets={"billing": OutputBudget(max_tokens=300)})
+    assert policy.select({"billing": True, "order_status": True}, ceiling=1024).max_sentences is None
+
+@pytest.fixture
+def agent_factory(monkeypatch):
+    # The Groq client wants a key at construction even though the stub is used instead
+    monkeypatch.setenv("GROQ_API_KEY", "stub")
+    from agents.csr_agent import MetaCSRAgent
+
+    def make(policy, model):
+        agent = MetaCSRAgent("large", 0.0, 1024, output_budgets=policy)
+        agent._get_llm = lambda tier: model
+        return agent
+    return make
+
+def generate(agent):
+    return agent.generate_response(
+        message="Where is my order?",
+        chat_history=[{"role": "user", "content": "Where is my order?"}],
+        user_context={"id": "USER001"},
+        available_actions=[],
+        allow_tools=False
+    )
+
+def test_early_stop_cuts_the_stream_after_budgeted_sentences(agent_factory):
+    model = WordStreamModel(streamed=[])
+    policy = OutputBudgetPolicy(early_stop=True)
+    response = generate(agent_factory(policy, model))
+    assert response["intents"] == {"order_status": True}
+    assert response["early_stopped"]
+    assert response["response"] == "Your order shipped on Monday. It is with the carrier. Delivery is expected Friday."
+    # Generation stopped one word past the third sentence instead of running to the end
+    assert len(model.streamed) < len(ANSWER.split(" "))
+    assert policy.get_stats()["order_status"]["early_stopped"] == 1
+
+def test_without_early_stop_the_full_answer_is_returned(agent_factory):
+    model = WordStreamModel(streamed=[])
+    policy = OutputBudgetPolicy()
+    response = generate(agent_factory(policy, model))
+    assert not response["early_stopped"]
+    assert response["response"] == ANSWER
+    assert model.streamed == []
+    assert policy.get_stats()["order_status"]["early_stopped"] == 0
@@ -0,0 +1,112 @@
+from concurrent.futures import Future
+
+import pytest
+
+from services.sharding import HashRing, ShardedDispatcher, _Worker
+
+SESSIONS = [f"session-{i}" for i in range(5000)]
+
+def assignment(ring):
+    return {session: ring.get(session) for session in SESSIONS}
+
+def test_empty_ring_raises():
+    with pytest.raises(LookupError):
+        HashRing().get("session-1")
+
+def test_assignment_is_deterministic():
+    assert assignment(HashRing(range(4))) == assignment(HashRing(range(4)))
+
+def test_sessions_spread_over_all_nodes():
+    counts = {}
+    for node in assignment(HashRing(range(4))).values():
+        counts[node] = counts.get(node, 0) + 1
+    assert sorted(counts) == [0, 1, 2, 3]
+    # Virtual nodes keep every worker within a loose band around an even share
+    assert all(0.5 * len(SESSIONS) / 4 < count < 1.5 * len(SESSIONS) / 4 for count in counts.values())
+
+def test_adding_a_node_only_moves_sessions_to_it():
+    ring = HashRing(range(4))
+    before = assignment(ring)
+    ring.add(4)
+    after = assignment(ring)
+    moved = [s for s in SESSIONS if before[s] != after[s]]
+    assert all(after[s] == 4 for s in moved)
+    # Roughly its fair share moves, not the whole keyspace
+    assert len(moved) < 0.35 * len(SESSIONS)
+
+def test_removing_a_node_only_moves_its_sessions():
+    ring = HashRing(range(4))
+    before = assignment(ring)
+    ring.remove(2)
+    after = assignment(ring)
+    assert ring.nodes == [0, 1, 3]
+    for session in SESSIONS:
+        if before[session] != 2:
+            assert after[session] == before[session]
+        else:
+            assert after[session] != 2
+
+def test_remove_then_add_restores_assignment():
+    ring = HashRing(range(4))
+    before = assignment(ring)
+    ring.remove(1)
+    ring.add(1)
+    assert assignment(ring) == before
+
+class FakeProcess:
+    pid = None
+
+    def __init__(self):
+        self.alive = True
+
+    def is_alive(self):
+        return self.alive
+
+    def terminate(self):
+        self.alive = False
+
+class FakePool(ShardedDispatcher):
+    """Dispatcher whose workers are fakes; `healthy` decides what pings return"""
+
+    def __init__(self, workers: int = 2, **kwargs):
+        super().__init__(workers=workers, **kwargs)
+        self.healthy = {}
+        for worker_id in range(workers):
+            self._workers[worker_id] = self._spawn(worker_id)
+            self._ring.add(worker_id)
+
+    def _spawn(self, worker_id):
+        worker = _Worker(worker_id, FakeProcess(), None)
+        worker.ready = Future()
+        return worker
+
+    def ping(self, worker_id):
+        healthy = self.healthy.get(worker_id, True)
+        ready = self._workers[worker_id].ready
+        # A healthy worker answers the startup ping it was spawned with
+        if healthy and not ready.done():
+            ready.set_result({"worker_id": worker_id})
+        return healthy
+
+def test_repeated_failures_with_recovery_keep_the_worker():
+    pool = FakePool(max_restarts=2)
+    for _ in range(10):
+        pool.healthy[0] = False
+        pool._check_workers()
+        pool.healthy[0] = True
+        pool._check_workers()
+    assert pool._ring.nodes == [0, 1]
+    assert pool._workers[0].failures == 0
+    assert pool.get_stats()["restarts"] == 10
+
+def test_consecutive_failures_remove_the_worker():
+    pool = FakePool(max_restarts=2)
+    pool.healthy[0] = False
+    for _ in range(2):
+        pool._check_workers()
+    assert pool._workers[0].failures == 2
+    pool._check_workers()
+    assert pool._ring.nodes == [1]
+    assert pool.get_stats()["removed"] == 1
+    # Its sessions move to the remaining worker
+    assert all(pool.worker_for(session) == 1 for session in SESSIONS[:100])
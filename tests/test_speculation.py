@@ -0,0 +1,97 @@
+import threading
+
+import pytest
+
+from agents.speculation import SpeculationStage
+
+ORDER_TURN = [
+    {"role": "user", "content": "Where is my order A100?"},
+    {"role": "assistant", "content": "Order A100 has shipped."}
+]
+BILLING_TURN = [
+    {"role": "user", "content": "Why was I charged twice?"},
+    {"role": "assistant", "content": "One of the charges is a pending authorization."}
+]
+
+@pytest.fixture
+def classify(monkeypatch):
+    # The Groq client wants a key at construction even though no model is called
+    monkeypatch.setenv("GROQ_API_KEY", "stub")
+    from agents.csr_agent import MetaCSRAgent
+    return MetaCSRAgent("large", 0.0, 1024).determine_intent
+
+def fake_generate(message, **kwargs):
+    return {"response": f"Answer to: {message}", "usage": {"input_tokens": 40, "output_tokens": 10}}
+
+def speculate(classify, chat_history, intents, tool_results=None):
+    """A stage holding finished speculations for session s1"""
+    stage = SpeculationStage(generate=fake_generate, classify=classify)
+    stage.schedule("s1", chat_history, {"id": "USER001"}, [], intents, tool_results=tool_results)
+    # Waits for the background answers
+    stage.executor.shutdown(wait=True)
+    return stage
+
+@pytest.mark.parametrize("message, question", [
+    ("when will it arrive", "When will my order arrive?"),
+    ("When will my order arrive?", "When will my order arrive?"),
+    ("can I change the address", "Can I change the shipping address for this order?"),
+    ("Can I change the address for A100?", "Can I change the shipping address for this order?")
+])
+def test_order_follow_ups_are_served(classify, message, question):
+    stage = speculate(classify, ORDER_TURN, {"order_status": True}, tool_results=['{"order_number": "A100"}'])
+    response = stage.take("s1", message)
+    assert response is not None and response["speculative"]
+    assert response["response"] == f"Answer to: {question}"
+    assert stage.get_stats()["hits"] == 1
+
+def test_billing_follow_up_is_served(classify):
+    stage = speculate(classify, BILLING_TURN, {"billing": True})
+    response = stage.take("s1", "can I get a refund")
+    assert response["response"] == "Answer to: Can I get a refund for this charge?"
+
+@pytest.mark.parametrize("message", [
+    # Names an order the answer was not generated with
+    "when will my order Z123 arrive?",
+    # Adds a billing question the order answer does not cover
+    "when will it arrive, and why is there a second charge?",
+    # Shares no phrase with any prediction
+    "do you sell gift cards?",
+    # Too long to be the predicted question
+    "when will it arrive " + "because I really need it " * 6
+])
+def test_other_messages_need_a_real_turn(classify, message):
+    stage = speculate(classify, ORDER_TURN, {"order_status": True})
+    assert stage.take("s1", message) is None
+    stats = stage.get_stats()
+    assert stats["hits"] == 0 and stats["misses"] == 1
+    assert stats["wasted_tokens"] == stats["tokens_spent"] == 100
+
+def test_take_clears_session_speculations(classify):
+    stage = speculate(classify, ORDER_TURN, {"order_status": True})
+    assert stage.take("s1", "when will it arrive") is not None
+    assert stage.take("s1", "can I change the address") is None
+    # The unused address answer is counted as waste
+    assert stage.get_stats()["wasted_tokens"] == 50
+
+def test_late_answer_for_an_old_turn_is_dropped(classify):
+    release = threading.Event()
+
+    def slow_generate(message, **kwargs):
+        release.wait(5)
+        return fake_generate(message, **kwargs)
+
+    stage = SpeculationStage(generate=slow_generate, classify=classify)
+    stage.schedule("s1", ORDER_TURN, {"id": "USER001"}, [], {"order_status": True})
+    # The customer's next message arrives before the background answers are ready
+    assert stage.take("s1", "thanks, bye") is None
+    release.set()
+    stage.executor.shutdown(wait=True)
+    assert stage.take("s1", "when will it arrive") is None
+    assert stage.get_stats()["wasted_tokens"] == 100
+
+def test_budget_limits_scheduled_speculations(classify):
+    stage = SpeculationStage(generate=fake_generate, classify=classify, tokens_per_minute=300, estimated_cost=300)
+    stage.schedule("s1", ORDER_TURN, {"id": "USER001"}, [], {"order_status": True})
+    stage.executor.shutdown(wait=True)
+    stats = stage.get_stats()
+    assert stats["scheduled"] == 1 and stats["skipped_budget"] == 1
@@ -0,0 +1,152 @@
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from services.verification import InMemoryAttemptStore, SqliteAttemptStore, VerificationService
+from tools.tools import ActionResult, INVALID_CREDENTIALS
+
+class FakeBackend:
+    """verify_fn stand-in that accepts one password and can be told to fail"""
+
+    def __init__(self, password: str = "secret", delay: float = 0.0):
+        self.password = password
+        self.delay = delay
+        self.calls = 0
+        self.error = None
+        self._lock = threading.Lock()
+
+    def __call__(self, customer_id: str, password: str) -> ActionResult:
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.delay)
+        if self.error:
+            return ActionResult(success=False, message="Verification error", error=self.error)
+        if password != self.password:
+            return ActionResult(success=False, message="Invalid credentials", error=INVALID_CREDENTIALS)
+        return ActionResult(success=True, message="Verified", data={"user_info": {"id": customer_id}})
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        return InMemoryAttemptStore()
+    return SqliteAttemptStore(str(tmp_path / "attempts.db"))
+
+def service(backend, store, **overrides):
+    settings = dict(free_attempts=2, base_delay=10.0, max_delay=60.0)
+    settings.update(overrides)
+    return VerificationService(backend, store=store, **settings)
+
+def test_free_attempts_do_not_lock_out(store):
+    backend = FakeBackend()
+    verification = service(backend, store)
+    assert not verification.verify("s1", "USER1", "wrong").success
+    assert verification.verify("s1", "USER1", "secret").success
+    assert store.get("USER1") == (0, 0.0, 0.0)
+
+def test_lockout_refuses_without_calling_backend(store):
+    backend = FakeBackend()
+    verification = service(backend, store)
+    for _ in range(2):
+        verification.verify("s1", "USER1", "wrong")
+    result = verification.verify("s1", "USER1", "secret")
+    assert result.error == "locked_out"
+    assert backend.calls == 2
+    assert verification.get_stats()["throttled"] == 1
+
+def test_lockout_is_per_customer_and_shared_across_sessions(store):
+    backend = FakeBackend()
+    verification = service(backend, store)
+    verification.verify("s1", "USER1", "wrong")
+    verification.verify("s2", "USER1", "wrong")
+    assert verification.verify("s3", "USER1", "secret").error == "locked_out"
+    assert verification.verify("s3", "USER2", "secret").success
+
+def test_backoff_grows_exponentially_up_to_max():
+    verification = service(FakeBackend(), InMemoryAttemptStore())
+    delays = [verification._backoff(failures) for failures in range(1, 7)]
+    assert delays == [0.0, 10.0, 20.0, 40.0, 60.0, 60.0]
+
+def test_failures_outside_window_start_over(store, monkeypatch):
+    verification = service(FakeBackend(), store, failure_window=100.0)
+    clock = [1000.0]
+    monkeypatch.setattr("services.verification.time.time", lambda: clock[0])
+    verification.verify("s1", "USER1", "wrong")
+    clock[0] += 200.0
+    verification.verify("s1", "USER1", "wrong")
+    assert store.get("USER1")[0] == 1
+
+def test_backend_errors_never_count_towards_lockout(store):
+    backend = FakeBackend()
+    backend.error = "timeout"
+    verification = service(backend, store)
+    for _ in range(5):
+        assert verification.verify("s1", "USER1", "secret").error == "timeout"
+    assert store.get("USER1")[0] == 0
+    backend.error = None
+    assert verification.verify("s1", "USER1", "secret").success
+    assert verification.get_stats()["errors"] == 5
+
+def test_success_issues_session_token(store):
+    backend = FakeBackend()
+    verification = service(backend, store)
+    result = verification.verify("s1", "USER1", "secret")
+    token = verification.cached("s1")
+    assert token is not None and result.data["token"] == token.token
+    verification.invalidate("s1")
+    assert verification.cached("s1") is None
+
+def test_sqlite_store_is_shared_between_connections(tmp_path):
+    path = str(tmp_path / "attempts.db")
+    first, second = SqliteAttemptStore(path), SqliteAttemptStore(path)
+    verification = service(FakeBackend(), first)
+    verification.verify("s1", "USER1", "wrong")
+    verification.verify("s1", "USER1", "wrong")
+    failures, locked_until, _ = second.get("USER1")
+    assert failures == 2 and locked_until > 0
+
+def test_concurrent_wrong_passwords_stop_at_free_attempts(store):
+    backend = FakeBackend(delay=0.05)
+    verification = service(backend, store, free_attempts=3)
+    start = threading.Barrier(50)
+    results = []
+    lock = threading.Lock()
+
+    def attempt():
+        start.wait()
+        result = verification.verify(None, "USER1", "wrong")
+        with lock:
+            results.append(result)
+
+    threads = [threading.Thread(target=attempt) for _ in range(50)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert backend.calls <= 3
+    assert sum(r.error == "locked_out" for r in results) == 50 - backend.calls
+    # Every reservation was settled
+    assert store.get("USER1")[0] == backend.calls
+
+def test_unsettled_attempt_expires_after_lease(store):
+    verification = service(FakeBackend(), store, free_attempts=1, attempt_lease=0.05)
+    # A process that reserved an attempt and died before settling it
+    assert store.reserve("USER1", 1, 3600.0, 0.05)
+    assert verification.verify("s1", "USER1", "secret").error == "locked_out"
+    time.sleep(0.1)
+    assert verification.verify("s1", "USER1", "secret").success
+
+def test_sqlite_store_upgrades_old_schema(tmp_path):
+    path = str(tmp_path / "attempts.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE verification_attempts ("
+                 "customer_id TEXT PRIMARY KEY, failures INTEGER, locked_until REAL, last_failure REAL)")
+    conn.execute("INSERT INTO verification_attempts VALUES ('USER1', 1, 0, ?)", (time.time(),))
+    conn.commit()
+    conn.close()
+    store = SqliteAttemptStore(path)
+    assert store.get("USER1")[0] == 1
+    verification = service(FakeBackend(), store)
+    verification.verify("s1", "USER1", "wrong")
+    assert verification.verify("s1", "USER1", "secret").error == "locked_out"
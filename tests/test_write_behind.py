@@ -0,0 +1,101 @@
+import json
+import os
+import time
+
+import pytest
+
+from services.write_behind import WriteBehindQueue
+from tools.tools import ActionResult
+
+def wait_for(condition, timeout: float = 5.0):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            raise AssertionError("condition not met in time")
+        time.sleep(0.01)
+
+def make_queue(tmp_path, handlers, **overrides):
+    settings = dict(workers=1, poll_interval=0.02, retry_backoff=0.01, max_retries=3,
+                    spool_dir=str(tmp_path / "spool"), dead_letter_path=str(tmp_path / "dead_letter.jsonl"))
+    settings.update(overrides)
+    return WriteBehindQueue(handlers=handlers, **settings)
+
+def spooled(tmp_path):
+    return [name for name in os.listdir(tmp_path / "spool") if name.endswith(".json")]
+
+def test_submit_unknown_kind_raises(tmp_path):
+    queue = make_queue(tmp_path, {})
+    with pytest.raises(ValueError):
+        queue.submit("log_feedback", {})
+
+def test_items_are_processed_and_unspooled(tmp_path):
+    seen = []
+    queue = make_queue(tmp_path, {"log_feedback": seen.append})
+    queue.start()
+    try:
+        for rating in range(3):
+            assert queue.submit("log_feedback", {"rating": rating})
+        wait_for(lambda: queue.get_stats()["completed"] == 3)
+    finally:
+        queue.stop()
+    assert [p["rating"] for p in seen] == [0, 1, 2]
+    assert spooled(tmp_path) == []
+
+def test_failure_is_retried_until_it_succeeds(tmp_path):
+    attempts = []
+
+    def flaky(payload):
+        attempts.append(payload)
+        if len(attempts) < 3:
+            raise RuntimeError("backend unavailable")
+
+    queue = make_queue(tmp_path, {"schedule_callback": flaky})
+    queue.start()
+    try:
+        queue.submit("schedule_callback", {"user_id": "USER1"})
+        wait_for(lambda: queue.get_stats()["completed"] == 1)
+    finally:
+        queue.stop()
+    stats = queue.get_stats()
+    assert len(attempts) == 3
+    assert stats["failed_attempts"] == 2 and stats["retried"] == 2 and stats["dead_lettered"] == 0
+
+def test_exhausted_retries_go_to_dead_letter(tmp_path):
+    # Tools report failure through ActionResult rather than raising
+    queue = make_queue(tmp_path, {"send_order_email": lambda p: ActionResult(False, "failed", error="smtp down")})
+    queue.start()
+    try:
+        queue.submit("send_order_email", {"order_number": "A1"})
+        wait_for(lambda: queue.get_stats()["dead_lettered"] == 1)
+    finally:
+        queue.stop()
+    with open(tmp_path / "dead_letter.jsonl", encoding="utf-8") as f:
+        records = [json.loads(line) for line in f]
+    assert len(records) == 1
+    assert records[0]["kind"] == "send_order_email"
+    assert records[0]["attempts"] == 3 and records[0]["last_error"] == "smtp down"
+    assert spooled(tmp_path) == []
+
+def test_spooled_items_are_recovered_on_start(tmp_path):
+    # Never started, as if the process died with the work still queued
+    crashed = make_queue(tmp_path, {"log_feedback": lambda p: None})
+    crashed.submit("log_feedback", {"rating": 1})
+    crashed.submit("log_feedback", {"rating": 2})
+    assert len(spooled(tmp_path)) == 2
+
+    seen = []
+    queue = make_queue(tmp_path, {"log_feedback": seen.append})
+    queue.start()
+    try:
+        wait_for(lambda: queue.get_stats()["completed"] == 2)
+    finally:
+        queue.stop()
+    assert queue.get_stats()["recovered"] == 2
+    assert [p["rating"] for p in seen] == [1, 2]
+    assert spooled(tmp_path) == []
+
+def test_full_queue_rejects_submissions(tmp_path):
+    queue = make_queue(tmp_path, {"log_feedback": lambda p: None}, max_depth=1)
+    assert queue.submit("log_feedback", {"rating": 1})
+    assert queue.submit("log_feedback", {"rating": 2}) is None
+    assert queue.get_stats()["rejected"] == 1
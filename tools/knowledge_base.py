@@ -0,0 +1,532 @@
+from typing import Dict, List, Optional, Any, Iterable, Callable, Tuple
+from array import array
+from collections import Counter
+import json
+import math
+import os
+import re
+import shutil
+import threading
+import zlib
+
+import numpy as np
+
+# ----------------------------
+# Text processing
+# ----------------------------
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "can", "do", "for", "from", "how",
+    "i", "in", "is", "it", "my", "of", "on", "or", "the", "to", "what", "when", "with", "you", "your"
+}
+ARTICLE_EXTENSIONS = (".json", ".md", ".txt")
+
+def tokenize(text: str) -> List[str]:
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+
+class HashingEmbedder:
+    """Deterministic bag-of-words embedding using the hashing trick.
+
+    Good enough to catch paraphrases that share vocabulary with an article; swap in a
+    real sentence-embedding model by passing any callable with a ``dim`` attribute
+    that maps a list of texts to an (n, dim) float32 array.
+    """
+
+    def __init__(self, dim: int = 128, max_cached_tokens: int = 500_000):
+        self.dim = dim
+        self.max_cached_tokens = max_cached_tokens
+        self._token_slots: Dict[str, Tuple[int, float]] = {}
+
+    def _slot(self, token: str) -> Tuple[int, float]:
+        slot = self._token_slots.get(token)
+        if slot is None:
+            # crc32 rather than hash() so vectors are stable across processes
+            bucket = zlib.crc32(token.encode("utf-8"))
+            slot = (bucket % self.dim, 1.0 if bucket & 0x80000000 else -1.0)
+            if len(self._token_slots) >= self.max_cached_tokens:
+                self._token_slots.clear()
+            self._token_slots[token] = slot
+        return slot
+
+    def __call__(self, texts: List[str]) -> np.ndarray:
+        cells, signs = array("q"), array("d")
+        for row, text in enumerate(texts):
+            offset = row * self.dim
+            for token in tokenize(text):
+                bucket, sign = self._slot(token)
+                cells.append(offset + bucket)
+                signs.append(sign)
+        flat = np.bincount(
+            np.frombuffer(cells, dtype=np.int64),
+            weights=np.frombuffer(signs, dtype=np.float64),
+            minlength=len(texts) * self.dim
+        )
+        matrix = flat.reshape(len(texts), self.dim).astype(np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+
+# ----------------------------
+# Article loading
+# ----------------------------
+def load_article(root: str, path: str) -> Dict[str, Any]:
+    """Read an article file; the category defaults to its parent directory name"""
+    rel_path = os.path.relpath(path, root)
+    parent = os.path.dirname(rel_path)
+    default_category = parent.split(os.sep)[0].lower() if parent else "general"
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith(".json"):
+            data = json.load(f)
+            title = data.get("title", rel_path)
+            content = data.get("content", "")
+            category = data.get("category", default_category)
+        else:
+            text = f.read()
+            lines = text.strip().splitlines()
+            title = lines[0].lstrip("# ").strip() if lines else rel_path
+            content = "\n".join(lines[1:]).strip()
+            category = default_category
+    return {"id": rel_path, "title": title, "content": content, "category": str(category).lower()}
+
+def scan_articles(root: str) -> Dict[str, Tuple[int, int]]:
+    """Map article paths (relative to root) to (mtime_ns, size)"""
+    found = {}
+    for dirpath, _, filenames in os.walk(root):
+        for filename in filenames:
+            if filename.endswith(ARTICLE_EXTENSIONS):
+                path = os.path.join(dirpath, filename)
+                stat = os.stat(path)
+                found[os.path.relpath(path, root)] = (stat.st_mtime_ns, stat.st_size)
+    return found
+
+# ----------------------------
+# Index segments
+# ----------------------------
+class _Segment:
+    """Immutable, memory-mapped base index produced by a full build"""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        self.doc_count = meta["doc_count"]
+        self.avg_len = meta["avg_len"]
+        self.vocab: Dict[str, List[int]] = meta["vocab"]
+        self.categories: List[str] = meta["categories"]
+        self.category_codes = {name: code for code, name in enumerate(self.categories)}
+        load = lambda name: np.load(os.path.join(path, name), mmap_mode="r")
+        self.postings_doc = load("postings_doc.npy")
+        self.postings_tf = load("postings_tf.npy")
+        self.doc_len = load("doc_len.npy")
+        self.doc_category = load("doc_category.npy")
+        self.doc_offsets = load("doc_offsets.npy")
+        embeddings_path = os.path.join(path, "embeddings.npy")
+        self.embeddings = np.load(embeddings_path, mmap_mode="r") if os.path.exists(embeddings_path) else None
+        self._docs_file = open(os.path.join(path, "docs.jsonl"), "rb")
+        self._docs_lock = threading.Lock()
+        # Searches in flight; a retired segment is closed when the last one releases it
+        self._refs = 0
+        self._retired = False
+
+    def document(self, idx: int) -> Dict[str, Any]:
+        with self._docs_lock:
+            self._docs_file.seek(int(self.doc_offsets[idx]))
+            return json.loads(self._docs_file.readline())
+
+    def acquire(self):
+        with self._docs_lock:
+            self._refs += 1
+
+    def release(self):
+        with self._docs_lock:
+            self._refs -= 1
+            if self._retired and self._refs == 0:
+                self._docs_file.close()
+
+    def retire(self):
+        """Close now, or once the searches still using this segment finish"""
+        with self._docs_lock:
+            self._retired = True
+            if self._refs == 0:
+                self._docs_file.close()
+
+    def manifest(self) -> Dict[str, List[int]]:
+        with open(os.path.join(self.path, "manifest.json"), "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def close(self):
+        self._docs_file.close()
+
+class _DeltaSegment:
+    """Small in-memory index of articles added or changed since the last full build"""
+
+    def __init__(self, embedder: Optional[Callable] = None):
+        self.embedder = embedder
+        self.articles: Dict[str, Dict[str, Any]] = {}
+        self.tombstones: set = set()
+        self._rebuild()
+
+    def _rebuild(self):
+        self.keys = list(self.articles)
+        self.term_freqs = [Counter(tokenize(self._text(self.articles[key]))) for key in self.keys]
+        self.doc_freq = Counter(term for tf in self.term_freqs for term in tf)
+        self.doc_len = [sum(tf.values()) for tf in self.term_freqs]
+        self.embeddings = (
+            self.embedder([self._text(self.articles[key]) for key in self.keys])
+            if self.embedder is not None and self.keys else None
+        )
+
+    @staticmethod
+    def _text(article: Dict[str, Any]) -> str:
+        return f"{article.get('title', '')} {article.get('content', '')}"
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"tombstones": sorted(self.tombstones), "articles": list(self.articles.values())}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any], embedder: Optional[Callable] = None) -> "_DeltaSegment":
+        delta = cls(embedder)
+        delta.tombstones = set(data.get("tombstones", []))
+        delta.articles = {article["id"]: article for article in data.get("articles", [])}
+        delta._rebuild()
+        return delta
+
+# ----------------------------
+# Knowledge Base
+# ----------------------------
+class KnowledgeBase:
+    """Local help-article search with BM25 and optional embedding hybrid ranking.
+
+    A full build writes an immutable segment of NumPy arrays (CSR postings, document
+    lengths, categories, embeddings) that is memory-mapped on open, so startup cost
+    does not grow with the number of articles. ``refresh`` re-indexes only changed
+    articles into a small delta segment and tombstones their old versions; once the
+    delta grows past ``compact_ratio`` of the base, the index is rebuilt.
+    """
+
+    def __init__(self,
+                 index_dir: str,
+                 articles_dir: Optional[str] = None,
+                 embedder: Optional[Callable] = None,
+                 use_embeddings: bool = True,
+                 k1: float = 1.5,
+                 b: float = 0.75,
+                 compact_ratio: float = 0.1):
+        self.index_dir = index_dir
+        self.articles_dir = articles_dir
+        self.embedder = (embedder or HashingEmbedder()) if use_embeddings else None
+        self.k1 = k1
+        self.b = b
+        self.compact_ratio = compact_ratio
+        self._lock = threading.Lock()
+        # Serializes writers (build switch, refresh); searches only take `_lock` briefly
+        self._write_lock = threading.RLock()
+        self._segment: Optional[_Segment] = None
+        self._delta = _DeltaSegment(self.embedder)
+        os.makedirs(index_dir, exist_ok=True)
+        self._open_current()
+
+    # ---- persistence ----
+    def _current_generation(self) -> Optional[str]:
+        current = os.path.join(self.index_dir, "CURRENT")
+        if not os.path.exists(current):
+            return None
+        with open(current, "r", encoding="utf-8") as f:
+            return f.read().strip() or None
+
+    def _open_current(self):
+        generation = self._current_generation()
+        if generation is None:
+            return
+        self._segment = _Segment(os.path.join(self.index_dir, generation))
+        delta_path = os.path.join(self.index_dir, f"{generation}.delta.json")
+        if os.path.exists(delta_path):
+            with open(delta_path, "r", encoding="utf-8") as f:
+                self._delta = _DeltaSegment.from_dict(json.load(f), self.embedder)
+
+    def _save_delta(self):
+        generation = self._current_generation()
+        if generation is None:
+            return
+        delta_path = os.path.join(self.index_dir, f"{generation}.delta.json")
+        tmp_path = delta_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._delta.to_dict(), f)
+        os.replace(tmp_path, delta_path)
+
+    @property
+    def doc_count(self) -> int:
+        base = self._segment.doc_count - len(self._delta.tombstones) if self._segment else 0
+        return base + len(self._delta.keys)
+
+    # ---- indexing ----
+    def build(self) -> int:
+        """Full rebuild from ``articles_dir``; returns the number of indexed articles"""
+        if not self.articles_dir:
+            raise ValueError("articles_dir is required to build from disk")
+        stats = scan_articles(self.articles_dir)
+        paths = sorted(stats)
+        articles = (load_article(self.articles_dir, os.path.join(self.articles_dir, p)) for p in paths)
+        return self.build_from_articles(articles, stats)
+
+    def build_from_articles(self,
+                            articles: Iterable[Dict[str, Any]],
+                            stats: Optional[Dict[str, Tuple[int, int]]] = None) -> int:
+        """Write a new segment from article dicts (id, title, content, category) and switch to it"""
+        generation = f"seg-{int.from_bytes(os.urandom(4), 'big'):08x}"
+        path = os.path.join(self.index_dir, generation)
+        os.makedirs(path)
+
+        vocab: Dict[str, int] = {}
+        categories: Dict[str, int] = {}
+        term_ids, doc_ids, tfs = array("i"), array("i"), array("H")
+        doc_len, doc_category, doc_offsets = array("f"), array("h"), array("q")
+        manifest: Dict[str, List[int]] = {}
+        embed_batch: List[str] = []
+        embedding_chunks: List[np.ndarray] = []
+
+        with open(os.path.join(path, "docs.jsonl"), "wb") as docs_file:
+            doc_idx = -1
+            for doc_idx, article in enumerate(articles):
+                text = f"{article.get('title', '')} {article.get('content', '')}"
+                counts = Counter(tokenize(text))
+                for term, count in counts.items():
+                    term_ids.append(vocab.setdefault(term, len(vocab)))
+                    doc_ids.append(doc_idx)
+                    tfs.append(min(count, 65535))
+                doc_len.append(sum(counts.values()))
+                category = str(article.get("category", "general")).lower()
+                doc_category.append(categories.setdefault(category, len(categories)))
+                doc_offsets.append(docs_file.tell())
+                docs_file.write(json.dumps(article).encode("utf-8") + b"\n")
+                stat = (stats or {}).get(article["id"], (0, 0))
+                manifest[article["id"]] = [stat[0], stat[1], doc_idx]
+                if self.embedder is not None:
+                    embed_batch.append(text)
+                    if len(embed_batch) >= 4096:
+                        embedding_chunks.append(self.embedder(embed_batch))
+                        embed_batch = []
+        doc_count = doc_idx + 1
+
+        # Group postings by term into CSR layout
+        term_arr = np.frombuffer(term_ids, dtype=np.int32)
+        order = np.argsort(term_arr, kind="stable")
+        np.save(os.path.join(path, "postings_doc.npy"), np.frombuffer(doc_ids, dtype=np.int32)[order])
+        np.save(os.path.join(path, "postings_tf.npy"), np.frombuffer(tfs, dtype=np.uint16)[order])
+        boundaries = np.searchsorted(term_arr[order], np.arange(len(vocab) + 1))
+        vocab_meta = {
+            term: [int(boundaries[tid]), int(boundaries[tid + 1] - boundaries[tid])]
+            for term, tid in vocab.items()
+        }
+        lengths = np.frombuffer(doc_len, dtype=np.float32)
+        np.save(os.path.join(path, "doc_len.npy"), lengths)
+        np.save(os.path.join(path, "doc_category.npy"), np.frombuffer(doc_category, dtype=np.int16))
+        np.save(os.path.join(path, "doc_offsets.npy"), np.frombuffer(doc_offsets, dtype=np.int64))
+        if self.embedder is not None:
+            if embed_batch:
+                embedding_chunks.append(self.embedder(embed_batch))
+            dim = getattr(self.embedder, "dim", 0)
+            matrix = np.vstack(embedding_chunks) if embedding_chunks else np.zeros((0, dim), dtype=np.float32)
+            np.save(os.path.join(path, "embeddings.npy"), matrix.astype(np.float32))
+
+        with open(os.path.join(path, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({
+                "doc_count": doc_count,
+                "avg_len": float(lengths.mean()) if doc_count else 0.0,
+                "vocab": vocab_meta,
+                "categories": sorted(categories, key=categories.get)
+            }, f)
+        with open(os.path.join(path, "manifest.json"), "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+
+        self._switch_to(generation)
+        return doc_count
+
+    def _switch_to(self, generation: str):
+        with self._write_lock:
+            current = os.path.join(self.index_dir, "CURRENT")
+            with open(current + ".tmp", "w", encoding="utf-8") as f:
+                f.write(generation)
+            os.replace(current + ".tmp", current)
+            segment = _Segment(os.path.join(self.index_dir, generation))
+            with self._lock:
+                old = self._segment
+                self._segment = segment
+                self._delta = _DeltaSegment(self.embedder)
+            if old is not None:
+                # In-flight searches keep their mappings and the docs file until they release it;
+                # unlinking is safe on POSIX
+                old.retire()
+                shutil.rmtree(old.path, ignore_errors=True)
+                stale_delta = f"{old.path}.delta.json"
+                if os.path.exists(stale_delta):
+                    os.remove(stale_delta)
+
+    def close(self):
+        with self._write_lock, self._lock:
+            segment, self._segment = self._segment, None
+        if segment is not None:
+            segment.retire()
+
+    def refresh(self) -> Dict[str, int]:
+        """Re-index articles changed on disk since the last build or refresh"""
+        if not self.articles_dir:
+            raise ValueError("articles_dir is required to refresh from disk")
+        # One refresh at a time: each reads the manifest and delta, then swaps in a new delta
+        with self._write_lock:
+            return self._refresh()
+
+    def _refresh(self) -> Dict[str, int]:
+        if self._segment is None:
+            count = self.build()
+            return {"added": count, "updated": 0, "deleted": 0, "compacted": 1}
+
+        on_disk = scan_articles(self.articles_dir)
+        manifest = self._segment.manifest()
+        result = {"added": 0, "updated": 0, "deleted": 0, "compacted": 0}
+        with self._lock:
+            delta = _DeltaSegment.from_dict(self._delta.to_dict(), self.embedder)
+        delta_stats = {key: tuple(a.get("_stat", (0, 0))) for key, a in delta.articles.items()}
+
+        for rel_path, stat in on_disk.items():
+            base_entry = manifest.get(rel_path)
+            if rel_path in delta.articles:
+                if delta_stats[rel_path] == stat:
+                    continue
+                result["updated"] += 1
+            elif base_entry is not None and base_entry[2] not in delta.tombstones:
+                if (base_entry[0], base_entry[1]) == stat:
+                    continue
+                delta.tombstones.add(base_entry[2])
+                result["updated"] += 1
+            else:
+                result["added"] += 1
+            article = load_article(self.articles_dir, os.path.join(self.articles_dir, rel_path))
+            article["_stat"] = list(stat)
+            delta.articles[rel_path] = article
+
+        for rel_path, entry in manifest.items():
+            if rel_path not in on_disk and entry[2] not in delta.tombstones:
+                delta.tombstones.add(entry[2])
+                result["deleted"] += 1
+        for rel_path in [key for key in delta.articles if key not in on_disk]:
+            del delta.articles[rel_path]
+            result["deleted"] += 1
+
+        if len(delta.articles) + len(delta.tombstones) > self.compact_ratio * max(self._segment.doc_count, 1):
+            self.build()
+            result["compacted"] = 1
+            return result
+
+        delta._rebuild()
+        with self._lock:
+            self._delta = delta
+        self._save_delta()
+        return result
+
+    # ---- search ----
+    def _idf(self, df: int, n: int) -> float:
+        return math.log(1 + (n - df + 0.5) / (df + 0.5))
+
+    def search(self,
+               query: str,
+               category: Optional[str] = None,
+               top_k: int = 5,
+               alpha: float = 0.7) -> List[Dict[str, Any]]:
+        """Top-k articles by ``alpha * bm25 + (1 - alpha) * cosine``, optionally within a category"""
+        with self._lock:
+            segment, delta = self._segment, self._delta
+            if segment is not None:
+                segment.acquire()
+        try:
+            return self._search(segment, delta, query, category, top_k, alpha)
+        finally:
+            if segment is not None:
+                segment.release()
+
+    def _search(self,
+                segment: Optional[_Segment],
+                delta: _DeltaSegment,
+                query: str,
+                category: Optional[str],
+                top_k: int,
+                alpha: float) -> List[Dict[str, Any]]:
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms or top_k <= 0 or (segment is None and not delta.keys):
+            return []
+        category = category.lower() if category else None
+        use_vectors = self.embedder is not None and alpha < 1.0
+        query_vec = self.embedder([query])[0] if use_vectors else None
+
+        base_n = segment.doc_count if segment else 0
+        n = max(base_n + len(delta.keys), 1)
+        avg_len = segment.avg_len if segment and segment.avg_len else (
+            sum(delta.doc_len) / len(delta.doc_len) if delta.doc_len else 1.0
+        )
+        candidates: List[Tuple[str, float, int]] = []
+        base_scores, mask = None, None
+        delta_scores: List[float] = []
+
+        # Raw BM25 per segment; filtered and tombstoned documents score zero
+        if segment is not None and base_n:
+            scores = np.zeros(base_n, dtype=np.float32)
+            for term in terms:
+                entry = segment.vocab.get(term)
+                if not entry:
+                    continue
+                start, length = entry
+                df = length + delta.doc_freq.get(term, 0)
+                docs = segment.postings_doc[start:start + length]
+                tf = segment.postings_tf[start:start + length].astype(np.float32)
+                norm = self.k1 * (1 - self.b + self.b * segment.doc_len[docs] / avg_len)
+                scores[docs] += self._idf(df, n) * tf * (self.k1 + 1) / (tf + norm)
+            mask = np.ones(base_n, dtype=bool)
+            if category is not None:
+                code = segment.category_codes.get(category)
+                mask &= (segment.doc_category == code) if code is not None else False
+            if delta.tombstones:
+                mask[np.fromiter(delta.tombstones, dtype=np.int64)] = False
+            base_scores = np.where(mask, scores, 0)
+
+        for key, tf_counts, length in zip(delta.keys, delta.term_freqs, delta.doc_len):
+            score = 0.0
+            if category is None or delta.articles[key].get("category") == category:
+                for term in terms:
+                    tf = tf_counts.get(term, 0)
+                    if tf:
+                        df = delta.doc_freq[term] + (segment.vocab.get(term, (0, 0))[1] if segment else 0)
+                        score += self._idf(df, n) * tf * (self.k1 + 1) / (
+                            tf + self.k1 * (1 - self.b + self.b * length / avg_len))
+            delta_scores.append(score)
+
+        # One scale for both segments, taken over the documents that can be returned
+        top = max(float(base_scores.max()) if base_scores is not None else 0.0, max(delta_scores, default=0.0))
+
+        if base_scores is not None:
+            combined = base_scores / top if top > 0 else base_scores
+            if use_vectors and segment.embeddings is not None and len(segment.embeddings):
+                combined = alpha * combined + (1 - alpha) * np.clip(segment.embeddings @ query_vec, 0, None)
+            combined = np.where(mask, combined, 0)
+            k = min(top_k, base_n)
+            best = np.argpartition(-combined, k - 1)[:k]
+            candidates.extend(("base", float(combined[i]), int(i)) for i in best if combined[i] > 0)
+
+        if delta.keys:
+            sims = np.clip(delta.embeddings @ query_vec, 0, None) if use_vectors and delta.embeddings is not None else None
+            for i, key in enumerate(delta.keys):
+                if category is not None and delta.articles[key].get("category") != category:
+                    continue
+                score = delta_scores[i] / top if top > 0 else 0.0
+                if sims is not None:
+                    score = alpha * score + (1 - alpha) * float(sims[i])
+                if score > 0:
+                    candidates.append(("delta", score, i))
+
+        candidates.sort(key=lambda c: c[1], reverse=True)
+        results = []
+        for source, score, idx in candidates[:top_k]:
+            article = segment.document(idx) if source == "base" else dict(delta.articles[delta.keys[idx]])
+            article.pop("_stat", None)
+            article["relevance"] = round(score, 4)
+            results.append(article)
+        return results
@@ -0,0 +1,103 @@
+from typing import Dict, List, Any, Callable, Iterable, Optional, Tuple
+import importlib
+import threading
+
+class ToolRegistry:
+    """Tool functions by name, wrapped as LangChain tools on first use
+
+    Registering a function is free; `langchain_core.tools` is only imported and
+    the StructuredTool only built when a tool is first requested, so importing
+    the tools module does not pay for LangChain at startup.
+    """
+
+    def __init__(self, modules: Iterable[str] = ()):
+        # Modules whose import registers the tools, loaded on first lookup
+        self.modules = list(modules)
+        self._functions: Dict[str, Callable] = {}
+        self._tools: Dict[str, Any] = {}
+        # Arguments filled in by the caller (e.g. the verified user ID), never by the model
+        self._injected: Dict[str, Tuple[str, ...]] = {}
+        self._lock = threading.RLock()
+
+    def register(self, fn: Optional[Callable] = None, *, injected: Iterable[str] = ()):
+        """Decorator; the function name is the tool name and its docstring the description
+
+        `injected` names arguments left out of the schema the model sees; the
+        workflow supplies them from the verified session when the tool runs.
+        """
+        def decorate(fn: Callable) -> Callable:
+            self._functions[fn.__name__] = fn
+            if injected:
+                self._injected[fn.__name__] = tuple(injected)
+            return fn
+        return decorate(fn) if fn is not None else decorate
+
+    def injected(self, name: str) -> Tuple[str, ...]:
+        """Arguments of a tool the caller must supply"""
+        self._ensure_loaded()
+        return self._injected.get(name, ())
+
+    def bind_caller(self, name: str, args: Dict[str, Any], caller: Dict[str, Any]) -> Dict[str, Any]:
+        """`args` with the tool's injected arguments taken from `caller`, overriding the model's
+
+        Raises PermissionError when the caller cannot supply one of them.
+        """
+        bound = dict(args)
+        for arg in self.injected(name):
+            if not caller.get(arg):
+                raise PermissionError(f"{name} requires a verified {arg}")
+            bound[arg] = caller[arg]
+        return bound
+
+    def _ensure_loaded(self):
+        for module in self.modules:
+            importlib.import_module(module)
+
+    def __contains__(self, name: str) -> bool:
+        self._ensure_loaded()
+        return name in self._functions
+
+    def names(self) -> List[str]:
+        self._ensure_loaded()
+        return list(self._functions)
+
+    def get(self, name: str):
+        """The LangChain tool for `name`, created on first request"""
+        tool = self._tools.get(name)
+        if tool is not None:
+            return tool
+        self._ensure_loaded()
+        if name not in self._functions:
+            raise KeyError(f"Unknown tool: {name}")
+        with self._lock:
+            tool = self._tools.get(name)
+            if tool is None:
+                from langchain_core.tools import tool as make_tool
+                tool = self._tools[name] = make_tool(self._with_injected(name))
+        return tool
+
+    def _with_injected(self, name: str) -> Callable:
+        """The tool function with its injected arguments marked so schemas omit them"""
+        fn = self._functions[name]
+        if name in self._injected:
+            from typing import Annotated
+            from langchain_core.tools import InjectedToolArg
+            for arg in self._injected[name]:
+                fn.__annotations__[arg] = Annotated[fn.__annotations__.get(arg, str), InjectedToolArg]
+        return fn
+
+    def get_many(self, names: Iterable[str]) -> List[Any]:
+        return [self.get(name) for name in names]
+
+    def get_stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"registered": len(self._functions), "instantiated": len(self._tools)}
+
+registry = ToolRegistry(modules=["tools.tools"])
+
+# A simple wrapper to group standalone tool functions; each tool is created on first use
+class ToolsWrapper:
+    def __getattr__(self, name: str):
+        if name not in registry:
+            raise AttributeError(name)
+        return registry.get(name)
@@ -1,10 +1,14 @@
-from typing import Dict, List, Optional, Any
-from langchain_core.tools import tool
+from typing import Dict, List, Optional, Any, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
 from datetime import datetime
 import json
+import os
+import threading
+import time
 from dataclasses import dataclass
-import requests
 from enum import Enum
+from tools.registry import registry
 
 # ----------------------------
 # Enumerations and Data Classes
@@ -21,19 +25,77 @@ class ActionResult:
     data: Optional[Dict] = None
     error: Optional[str] = None
 
+# ActionResult.error of a verification the backend rejected, as opposed to one that failed
+INVALID_CREDENTIALS = "Invalid credentials"
+
+class OrderNotFound(LookupError):
+    """Raised for orders that do not exist or belong to another customer"""
+
+    def __init__(self, order_number: str):
+        super().__init__(f"Order {order_number} not found")
+        self.order_number = order_number
+
+# Batch order endpoint responses meaning the backend has no such endpoint (not found, method not allowed, not implemented)
+BATCH_UNSUPPORTED_CODES = {404, 405, 501}
+
 # ----------------------------
 # MetaCSRTools Class Definition
 # ----------------------------
 class MetaCSRTools:
     """Unified tools class for Meta CSR Agent"""
     
-    def __init__(self, api_base_url: str, api_key: str):
+    def __init__(self,
+                 api_base_url: str,
+                 api_key: str,
+                 knowledge_base=None,
+                 admission=None,
+                 supports_batch_orders: bool = True,
+                 order_cache_ttl: float = 30.0,
+                 mock_batch_orders: bool = True):
         self.api_base_url = api_base_url
         self.api_key = api_key
         self.headers = {
             "Authorization": f"Bearer {api_key}",
             "Content-Type": "application/json"
         }
+        self._knowledge_base = knowledge_base
+        self._kb_lock = threading.Lock()
+        # Optional AdmissionController guarding backend calls
+        self.admission = admission
+        # Order statuses are cached briefly and shared by single and batch lookups
+        self.supports_batch_orders = supports_batch_orders
+        self.order_cache_ttl = order_cache_ttl
+        # Keyed by (customer_id, order_number) so one customer's lookups never serve another
+        self._order_cache: Dict[Tuple[str, str], Tuple[float, Dict]] = {}
+        self._order_lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        # Whether the mock backend serves the batch order endpoint; without it the
+        # mock answers 404 like a backend that predates the endpoint
+        self.mock_batch_orders = mock_batch_orders
+
+    @property
+    def knowledge_base(self):
+        """Local KB index, opened on first use when KB_ARTICLES_DIR is configured"""
+        if self._knowledge_base is None and os.getenv("KB_ARTICLES_DIR"):
+            with self._kb_lock:
+                if self._knowledge_base is None:
+                    from tools.knowledge_base import KnowledgeBase
+                    kb = KnowledgeBase(
+                        index_dir=os.getenv("KB_INDEX_DIR", ".kb_index"),
+                        articles_dir=os.getenv("KB_ARTICLES_DIR")
+                    )
+                    kb.refresh()
+                    self._knowledge_base = kb
+        return self._knowledge_base
+
+    def _api_call(self, method: str, endpoint: str, data: Optional[Dict] = None) -> Dict:
+        """
+        Backend call guarded by admission control; raises AdmissionRejected when shed.
+        HTTP errors come back as {"status_code": ..., "error": ...}.
+        """
+        if self.admission is not None:
+            self.admission.admit_current()
+        return self._mock_api_call(method, endpoint, data)
 
     def _mock_api_call(self, method: str, endpoint: str, data: Optional[Dict] = None) -> Dict:
         """
@@ -60,14 +122,31 @@ class MetaCSRTools:
                     }
                 ]
             }
-        # Order status endpoint
+        # Order status endpoint; the mock treats every order as the caller's own
         elif endpoint.startswith("/orders/") and endpoint.endswith("/status"):
             return {
                 "order_number": endpoint.split("/")[2],
+                "customer_id": (data or {}).get("customer_id"),
                 "status": "shipped",
                 "estimated_delivery": "2025-02-15",
                 "tracking_number": "1234567890"
             }
+        # Batch order status endpoint
+        elif endpoint == "/orders/status/batch":
+            if not self.mock_batch_orders:
+                return {"status_code": 404, "error": "Not Found"}
+            return {
+                "orders": [
+                    {
+                        "order_number": order_number,
+                        "customer_id": data.get("customer_id"),
+                        "status": "shipped",
+                        "estimated_delivery": "2025-02-15",
+                        "tracking_number": "1234567890"
+                    }
+                    for order_number in data.get("order_numbers", [])
+                ]
+            }
         # User context endpoint
         elif endpoint.startswith("/users/") and endpoint.endswith("/context"):
             return {
@@ -123,7 +202,7 @@ class MetaCSRTools:
 
     def verify_identity_impl(self, customer_id: str, password: str) -> ActionResult:
         try:
-            response = self._mock_api_call("POST", "/auth/verify", {"customer_id": customer_id, "password": password})
+            response = self._api_call("POST", "/auth/verify", {"customer_id": customer_id, "password": password})
             if response.get("verified", False):
                 return ActionResult(
                     success=True,
@@ -133,52 +212,154 @@ class MetaCSRTools:
             return ActionResult(
                 success=False,
                 message="Identity verification failed",
-                error="Invalid credentials"
+                error=INVALID_CREDENTIALS
             )
         except Exception as e:
             return ActionResult(success=False, message="Verification error", error=str(e))
 
+    def _cached_order(self, customer_id: str, order_number: str) -> Optional[Dict]:
+        with self._order_lock:
+            cached = self._order_cache.get((customer_id, order_number))
+        if cached is not None and time.monotonic() - cached[0] < self.order_cache_ttl:
+            return cached[1]
+        return None
+
+    def _cache_order(self, customer_id: str, order: Dict):
+        with self._order_lock:
+            self._order_cache[(customer_id, order["order_number"])] = (time.monotonic(), order)
+
+    @staticmethod
+    def _owned(order: Dict, customer_id: str) -> bool:
+        return bool(customer_id) and order.get("customer_id") == customer_id
+
+    def get_order_status(self, order_number: str, customer_id: str) -> Dict:
+        """Status of one of the customer's orders, served from the customer's cache entry when fresh
+
+        Raises OrderNotFound when the order belongs to someone else.
+        """
+        order = self._cached_order(customer_id, order_number)
+        if order is None:
+            order = self._api_call("GET", f"/orders/{order_number}/status", {"customer_id": customer_id})
+            self._cache_order(customer_id, order)
+        if not self._owned(order, customer_id):
+            raise OrderNotFound(order_number)
+        return order
+
+    def get_order_statuses(self, order_numbers: List[str], customer_id: str, chunk_size: int = 50) -> Dict[str, Dict]:
+        """Statuses for many of the customer's orders: deduplicated, cache-first, then fetched in chunks
+
+        Uses the batch endpoint when the backend has one and falls back to
+        concurrent single-order calls otherwise. Orders of other customers are
+        left out as if they did not exist.
+        """
+        unique = list(dict.fromkeys(str(n).strip() for n in order_numbers if str(n).strip()))
+        orders = {}
+        missing = []
+        for order_number in unique:
+            cached = self._cached_order(customer_id, order_number)
+            if cached is not None:
+                orders[order_number] = cached
+            else:
+                missing.append(order_number)
+
+        for start in range(0, len(missing), chunk_size):
+            chunk = missing[start:start + chunk_size]
+            fetched = self._fetch_order_chunk(chunk, customer_id)
+            for order in fetched:
+                self._cache_order(customer_id, order)
+                orders[order["order_number"]] = order
+        return {n: orders[n] for n in unique if n in orders and self._owned(orders[n], customer_id)}
+
+    def _fetch_order_chunk(self, chunk: List[str], customer_id: str) -> List[Dict]:
+        if self.supports_batch_orders:
+            response = self._api_call("POST", "/orders/status/batch", {"order_numbers": chunk, "customer_id": customer_id})
+            if response.get("status_code") not in BATCH_UNSUPPORTED_CODES:
+                if "orders" not in response:
+                    raise ValueError(f"Batch order status failed: {response.get('error', 'no orders in response')}")
+                return response["orders"]
+            # Backend has no batch API; remember and fall back
+            self.supports_batch_orders = False
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="csr-orders")
+        # Copy the caller's context so admission control charges the right session
+        futures = [
+            self._executor.submit(copy_context().run, self._api_call, "GET", f"/orders/{n}/status",
+                                  {"customer_id": customer_id})
+            for n in chunk
+        ]
+        return [future.result() for future in futures]
+
+    def search_knowledge_base(self, query: str, category: Optional[str] = None, top_k: int = 3) -> List[Dict]:
+        """Search the local KB index, falling back to the KB API when none is configured"""
+        if self.knowledge_base is not None:
+            return self.knowledge_base.search(query, category=category, top_k=top_k)
+        params = {"query": query}
+        if category:
+            params["category"] = category
+        return self._api_call("GET", "/kb/search", params).get("articles", [])[:top_k]
+
 # ----------------------------
-# Create a Global Instance of MetaCSRTools
+# Shared Instance of MetaCSRTools
 # ----------------------------
-meta_csr_tools = MetaCSRTools(api_base_url="https://api.example.com", api_key="your_api_key_here")
+_meta_csr_tools: Optional[MetaCSRTools] = None
+_meta_csr_tools_lock = threading.Lock()
+
+def get_meta_csr_tools() -> MetaCSRTools:
+    """The process-wide MetaCSRTools, created on first use"""
+    global _meta_csr_tools
+    if _meta_csr_tools is None:
+        with _meta_csr_tools_lock:
+            if _meta_csr_tools is None:
+                _meta_csr_tools = MetaCSRTools(api_base_url="https://api.example.com", api_key="your_api_key_here")
+    return _meta_csr_tools
+
+def __getattr__(name: str):
+    # Keeps `from tools.tools import meta_csr_tools` working without building it at import
+    if name == "meta_csr_tools":
+        return get_meta_csr_tools()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # ----------------------------
 # Standalone Tool Functions
 # ----------------------------
+# Plain functions; `registry.get(name)` wraps one as a LangChain tool on first use.
+# `user_id` and `session_id` are injected from the verified session, so the model
+# can only act on the customer it is talking to.
 
-@tool
+@registry.register
 def verify_identity(customer_id: str, password: str) -> ActionResult:
     """
     Verify customer identity using their credentials.
     """
-    return meta_csr_tools.verify_identity_impl(customer_id, password)
+    return get_meta_csr_tools().verify_identity_impl(customer_id, password)
 
-@tool
-def query_knowledge_base(query: str, category: Optional[str] = None) -> ActionResult:
+@registry.register
+def query_knowledge_base(query: str, category: Optional[str] = None, top_k: int = 3) -> ActionResult:
     """
     Search knowledge base for relevant information.
+    
+    Args:
+        query: Free-text search query.
+        category: Optional article category to restrict the search to (e.g., shipping, returns).
+        top_k: Maximum number of articles to return.
     """
     try:
-        params = {"query": query}
-        if category:
-            params["category"] = category
-        response = meta_csr_tools._mock_api_call("GET", "/kb/search", params)
+        articles = get_meta_csr_tools().search_knowledge_base(query, category=category, top_k=top_k)
         return ActionResult(
             success=True,
             message="Knowledge base query successful",
-            data={"articles": response.get("articles", [])}
+            data={"articles": articles}
         )
     except Exception as e:
         return ActionResult(success=False, message="Knowledge base query failed", error=str(e))
 
-@tool
-def fetch_order_status(order_number: str) -> ActionResult:
+@registry.register(injected=("user_id",))
+def fetch_order_status(order_number: str, user_id: str) -> ActionResult:
     """
     Get current status of an order.
     """
     try:
-        response = meta_csr_tools._mock_api_call("GET", f"/orders/{order_number}/status")
+        response = get_meta_csr_tools().get_order_status(order_number, user_id)
         return ActionResult(
             success=True,
             message="Order status retrieved successfully",
@@ -187,13 +368,33 @@ def fetch_order_status(order_number: str) -> ActionResult:
     except Exception as e:
         return ActionResult(success=False, message="Failed to fetch order status", error=str(e))
 
-@tool
+@registry.register(injected=("user_id",))
+def fetch_order_statuses(order_numbers: List[str], user_id: str) -> ActionResult:
+    """
+    Get the current status of several orders in one call.
+    
+    Args:
+        order_numbers: The order numbers to look up.
+    """
+    try:
+        orders = get_meta_csr_tools().get_order_statuses(order_numbers, user_id)
+        requested = dict.fromkeys(str(n).strip() for n in order_numbers)
+        not_found = [n for n in requested if n and n not in orders]
+        return ActionResult(
+            success=True,
+            message=f"Retrieved status for {len(orders)} orders",
+            data={"orders": list(orders.values()), "not_found": not_found}
+        )
+    except Exception as e:
+        return ActionResult(success=False, message="Failed to fetch order statuses", error=str(e))
+
+@registry.register(injected=("user_id",))
 def get_user_context(user_id: str) -> ActionResult:
     """
     Get complete user context including state and available actions.
     """
     try:
-        response = meta_csr_tools._mock_api_call("GET", f"/users/{user_id}/context")
+        response = get_meta_csr_tools()._api_call("GET", f"/users/{user_id}/context")
         return ActionResult(
             success=True,
             message="User context retrieved successfully",
@@ -202,13 +403,13 @@ def get_user_context(user_id: str) -> ActionResult:
     except Exception as e:
         return ActionResult(success=False, message="Failed to fetch user context", error=str(e))
 
-@tool
+@registry.register(injected=("user_id",))
 def execute_action(user_id: str, action_id: str, params: Optional[Dict] = None) -> ActionResult:
     """
     Execute an action on behalf of the user.
     """
     try:
-        response = meta_csr_tools._mock_api_call("POST", f"/actions/{action_id}/execute", {"user_id": user_id, "params": params or {}})
+        response = get_meta_csr_tools()._api_call("POST", f"/actions/{action_id}/execute", {"user_id": user_id, "params": params or {}})
         return ActionResult(
             success=True,
             message=f"Action {action_id} executed successfully",
@@ -217,13 +418,13 @@ def execute_action(user_id: str, action_id: str, params: Optional[Dict] = None)
     except Exception as e:
         return ActionResult(success=False, message=f"Failed to execute action {action_id}", error=str(e))
 
-@tool
+@registry.register(injected=("session_id",))
 def log_feedback(session_id: str, rating: int, comments: Optional[str] = None) -> ActionResult:
     """
     Log customer feedback for the session.
     """
     try:
-        response = meta_csr_tools._mock_api_call("POST", "/feedback/log", {"session_id": session_id, "rating": rating, "comments": comments})
+        response = get_meta_csr_tools()._api_call("POST", "/feedback/log", {"session_id": session_id, "rating": rating, "comments": comments})
         return ActionResult(
             success=True,
             message="Feedback logged successfully",
@@ -236,8 +437,8 @@ def log_feedback(session_id: str, rating: int, comments: Optional[str] = None) -
 # Additional CRM Endpoints / Tools
 # ----------------------------
 
-@tool
-def update_shipping_address(order_number: str, new_address: Dict[str, str]) -> ActionResult:
+@registry.register(injected=("user_id",))
+def update_shipping_address(order_number: str, new_address: Dict[str, str], user_id: str) -> ActionResult:
     """
     Update the shipping address for a specific order.
     
@@ -246,7 +447,8 @@ def update_shipping_address(order_number: str, new_address: Dict[str, str]) -> A
         new_address: A dictionary with address details (e.g., street, city, state, zip).
     """
     try:
-        response = meta_csr_tools._mock_api_call("POST", f"/orders/{order_number}/update_shipping", {"new_address": new_address})
+        get_meta_csr_tools().get_order_status(order_number, user_id)
+        response = get_meta_csr_tools()._api_call("POST", f"/orders/{order_number}/update_shipping", {"new_address": new_address})
         return ActionResult(
             success=True,
             message="Shipping address updated successfully",
@@ -255,8 +457,8 @@ def update_shipping_address(order_number: str, new_address: Dict[str, str]) -> A
     except Exception as e:
         return ActionResult(success=False, message="Failed to update shipping address", error=str(e))
 
-@tool
-def request_refund(order_number: str, reason: str) -> ActionResult:
+@registry.register(injected=("user_id",))
+def request_refund(order_number: str, reason: str, user_id: str) -> ActionResult:
     """
     Request a refund for a given order.
     
@@ -265,7 +467,8 @@ def request_refund(order_number: str, reason: str) -> ActionResult:
         reason: Reason for the refund request.
     """
     try:
-        response = meta_csr_tools._mock_api_call("POST", f"/orders/{order_number}/refund", {"reason": reason})
+        get_meta_csr_tools().get_order_status(order_number, user_id)
+        response = get_meta_csr_tools()._api_call("POST", f"/orders/{order_number}/refund", {"reason": reason})
         return ActionResult(
             success=True,
             message="Refund request initiated successfully",
@@ -274,8 +477,8 @@ def request_refund(order_number: str, reason: str) -> ActionResult:
     except Exception as e:
         return ActionResult(success=False, message="Failed to initiate refund", error=str(e))
 
-@tool
-def send_order_email(recipient: str, order_number: str) -> ActionResult:
+@registry.register(injected=("user_id",))
+def send_order_email(recipient: str, order_number: str, user_id: str) -> ActionResult:
     """
     Email the order details to the specified recipient.
     
@@ -284,7 +487,8 @@ def send_order_email(recipient: str, order_number: str) -> ActionResult:
         order_number: The order number.
     """
     try:
-        response = meta_csr_tools._mock_api_call("POST", f"/orders/{order_number}/email", {"recipient": recipient})
+        get_meta_csr_tools().get_order_status(order_number, user_id)
+        response = get_meta_csr_tools()._api_call("POST", f"/orders/{order_number}/email", {"recipient": recipient})
         return ActionResult(
             success=True,
             message="Order details emailed successfully",
@@ -293,17 +497,16 @@ def send_order_email(recipient: str, order_number: str) -> ActionResult:
     except Exception as e:
         return ActionResult(success=False, message="Failed to email order details", error=str(e))
 
-@tool
+@registry.register(injected=("user_id",))
 def update_account_details(user_id: str, details: Dict[str, Any]) -> ActionResult:
     """
-    Update account or billing details for a user.
+    Update account or billing details for the customer.
     
     Args:
-        user_id: The user's ID.
         details: A dictionary containing the details to update.
     """
     try:
-        response = meta_csr_tools._mock_api_call("POST", "/account/update", {"user_id": user_id, "details": details})
+        response = get_meta_csr_tools()._api_call("POST", "/account/update", {"user_id": user_id, "details": details})
         return ActionResult(
             success=True,
             message="Account details updated successfully",
@@ -312,17 +515,16 @@ def update_account_details(user_id: str, details: Dict[str, Any]) -> ActionResul
     except Exception as e:
         return ActionResult(success=False, message="Failed to update account details", error=str(e))
 
-@tool
+@registry.register(injected=("user_id",))
 def schedule_callback(user_id: str, callback_time: str) -> ActionResult:
     """
-    Schedule a callback for the user at a specified time.
+    Schedule a callback for the customer at a specified time.
     
     Args:
-        user_id: The user's ID.
         callback_time: The desired callback time as a string.
     """
     try:
-        response = meta_csr_tools._mock_api_call("POST", "/crm/callback", {"user_id": user_id, "callback_time": callback_time})
+        response = get_meta_csr_tools()._api_call("POST", "/crm/callback", {"user_id": user_id, "callback_time": callback_time})
         return ActionResult(
             success=True,
             message="Callback scheduled successfully",
@@ -330,3 +532,40 @@ def schedule_callback(user_id: str, callback_time: str) -> ActionResult:
         )
     except Exception as e:
         return ActionResult(success=False, message="Failed to schedule callback", error=str(e))
+
+# ----------------------------
+# Tool Groups
+# ----------------------------
+# Names of the tools the model may call natively (resolve with `registry.get_many`).
+# verify_identity is left out because credentials are collected by the verification
+# form, never by the model.
+AGENT_TOOLS = [
+    "query_knowledge_base",
+    "fetch_order_status",
+    "fetch_order_statuses",
+    "get_user_context",
+    "execute_action",
+    "log_feedback",
+    "update_shipping_address",
+    "request_refund",
+    "send_order_email",
+    "update_account_details",
+    "schedule_callback"
+]
+
+# Side-effect free tools that may run concurrently within one tool step
+PARALLEL_SAFE_TOOLS = {"query_knowledge_base", "fetch_order_status", "fetch_order_statuses", "get_user_context"}
+
+# Fire-and-forget writes that can be acknowledged before they complete
+WRITE_BEHIND_TOOLS = {"log_feedback", "schedule_callback", "send_order_email"}
+
+# Tools that change an order or the account; the model can only propose them and
+# they run once the customer confirms in the UI
+CONFIRM_TOOLS = {
+    "execute_action",
+    "update_shipping_address",
+    "request_refund",
+    "send_order_email",
+    "update_account_details",
+    "schedule_callback"
+}